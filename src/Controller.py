@@ -52,6 +52,8 @@ class Controller:
             self.send_to_view("show_error", data)
         elif mode == "terminal_print":
             self.send_to_view("terminal_print", data)
+        elif mode == "overlap":
+            self.send_to_view("overlap", data)
 
     def send_to_view(self, mode, data):
         """
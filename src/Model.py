@@ -2,6 +2,9 @@ import realsense as rs
 import tool
 import os
 
+# 深度濾波設定與 config.json 同樣位於 src 資料夾，不依賴啟動 GUI 時的工作目錄
+DEPTH_FILTERS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'depth_filters.json')
+
 class Model:
     def __init__(self):
         """
@@ -45,7 +48,7 @@ class Model:
         mode (str): 操作模式
         data (any): 要發送的數據
         """
-        if mode in ['record_imgs', 'show_error', 'terminal_print']:
+        if mode in ['record_imgs', 'show_error', 'terminal_print', 'overlap']:
             self.controller_callback(mode, data)
 
     def send_to_view_system(self, mode, data=None):
@@ -96,7 +99,7 @@ class Model:
         mode (str): 操作模式
         data (any): 附加數據
         """
-        if mode in ['record_imgs', 'show_error']:
+        if mode in ['record_imgs', 'show_error', 'terminal_print', 'overlap']:
             self.send_to_controller(mode, data)
 
     def recive_from_reconstruction_system(self, mode, data):
@@ -183,6 +186,8 @@ class Model:
         """
         if self.recorder:
             self.recorder.recive_from_model('stop_record')
+        selected_items = config_dict['selected_items_dict']
+        depth_filters = DEPTH_FILTERS_FILE if selected_items.get('Depth filters') else None
         args = rs.Args(
             output_folder=config_dict['selected_path'],
             record_rosbag=config_dict['selected_items_dict']['Record rosbag'],
@@ -194,7 +199,10 @@ class Model:
             height=config_dict['realsense_selection'][0][1],
             depth_fmt=config_dict['realsense_selection'][0][3],
             color_fmt=config_dict['realsense_selection'][1][3],
-            fps=config_dict['realsense_selection'][0][2]
+            fps=config_dict['realsense_selection'][0][2],
+            estimate_overlap=bool(selected_items.get('Estimate overlap')),
+            depth_filters=depth_filters,
+            filter_thread=depth_filters is not None
         )
         print(args.depth_fmt, args.color_fmt, args.fps)
         self.recorder = rs.RealSenseRecorder(args, self.recive_from_realsense_recorder)
@@ -79,3 +79,5 @@ class View:
             self.send_to_gui("show_error", data)
         elif mode == "terminal_print":
             self.send_to_gui("terminal_print", data)
+        elif mode == "overlap":
+            self.send_to_gui("overlap", data)
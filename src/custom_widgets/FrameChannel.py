@@ -0,0 +1,109 @@
+import threading
+import numpy as np
+from PyQt5.QtCore import QObject, Qt, pyqtSignal, pyqtSlot
+
+class FrameChannel(QObject):
+    """
+    幀傳遞通道，繼承自 QObject。
+
+    可從任意線程調用 push()，幀會經由排隊連接的訊號交給 GUI 線程。
+    GUI 線程來不及處理時，連續推送的幀會合併為最新的一幀。
+    copy_arrays 為 True 時，push() 將數組複製到通道自有的兩組緩衝區（一組待處理、一組交給接收函數），
+    生產者可以在 push() 返回後立即重複使用自己的數組（例如 PreviewProcessor 輪流使用的輸出緩衝區）。
+
+    屬性:
+    frame_ready (pyqtSignal): 有新幀待處理時發出的訊號。
+    """
+
+    frame_ready = pyqtSignal()
+
+    def __init__(self, receiver, parent=None, copy_arrays=False):
+        """
+        初始化 FrameChannel。必須在 GUI 線程中建立。
+
+        參數:
+        receiver (callable): 在 GUI 線程中接收幀的函數。
+        parent (QObject, optional): 父級對象。預設為 None。
+        copy_arrays (bool, optional): 是否在 push() 時複製 numpy 數組，取得其所有權。預設為 False。
+        """
+        super().__init__(parent)
+        self.receiver = receiver
+        self.copy_arrays = copy_arrays
+        # [待處理的緩衝區, 交給接收函數的緩衝區]，push() 只寫入前者
+        self.slots = [None, None]
+        self.lock = threading.Lock()
+        self.latest = None
+        self.pending = False
+        self.pushed = 0
+        self.delivered = 0
+        self.frame_ready.connect(self.deliver, Qt.QueuedConnection)
+
+    def push(self, *frames):
+        """
+        推送一組幀（可從任意線程調用）。copy_arrays 為 False 時，推送後不應再修改這些數組。
+
+        參數:
+        frames (tuple): 要交給接收函數的參數。
+        """
+        with self.lock:
+            if self.copy_arrays:
+                frames = self.copy_to_slot(frames)
+            self.latest = frames
+            self.pushed += 1
+            if self.pending:
+                return
+            self.pending = True
+        self.frame_ready.emit()
+
+    def copy_to_slot(self, frames):
+        """
+        將數組複製到待處理的緩衝區（在持有鎖時調用），形狀或類型改變時重新分配。
+
+        回傳:
+        tuple: 以緩衝區取代數組後的幀。
+        """
+        slot = self.slots[0]
+        if slot is None or len(slot) != len(frames) or any(
+                isinstance(frame, np.ndarray) != (buffer is not None) or
+                (buffer is not None and (buffer.shape != frame.shape or buffer.dtype != frame.dtype))
+                for frame, buffer in zip(frames, slot)):
+            slot = [np.empty_like(frame) if isinstance(frame, np.ndarray) else None for frame in frames]
+            self.slots[0] = slot
+        copied = []
+        for frame, buffer in zip(frames, slot):
+            if buffer is not None:
+                np.copyto(buffer, frame)
+                copied.append(buffer)
+            else:
+                copied.append(frame)
+        return tuple(copied)
+
+    @pyqtSlot()
+    def deliver(self):
+        """
+        在 GUI 線程中取出最新的一組幀並交給接收函數。
+        """
+        with self.lock:
+            frames = self.latest
+            self.latest = None
+            self.pending = False
+            if self.copy_arrays and frames is not None:
+                # 交出待處理的緩衝區，上一次交給接收函數的緩衝區已經用完，之後的 push() 寫入該組
+                self.slots.reverse()
+        if frames is not None:
+            self.delivered += 1
+            self.receiver(*frames)
+
+    def get_counters(self):
+        """
+        獲取通道計數器。
+
+        回傳:
+        dict: 包含 'pushed'、'delivered' 與 'coalesced' 的字典。
+        """
+        with self.lock:
+            return {
+                'pushed': self.pushed,
+                'delivered': self.delivered,
+                'coalesced': self.pushed - self.delivered
+            }
@@ -1,7 +1,81 @@
-from PyQt5.QtWidgets import QWidget, QHBoxLayout, QLabel
-from PyQt5.QtGui import QPixmap, QImage
-from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QWidget, QHBoxLayout, QVBoxLayout, QLabel
+from PyQt5.QtGui import QImage, QPainter, QColor
+from PyQt5.QtCore import Qt, QSize
 import numpy as np
+from custom_widgets.FrameChannel import FrameChannel
+
+class ImageView(QWidget):
+    def __init__(self, parent=None):
+        """
+        初始化 ImageView。
+
+        以 QPainter 直接繪製預先分配的 QImage，不經過 QPixmap 轉換；
+        只有在圖像尺寸或格式改變時才重新分配緩衝區並調整控件大小。
+
+        參數:
+        parent (QWidget, optional): 父級窗口。預設為 None。
+        """
+        super().__init__(parent)
+        self.image = None
+        self.image_buffer = None
+
+    def set_array(self, image_array):
+        """
+        將圖像數組複製到預先分配的 QImage 中並請求重繪。
+
+        參數:
+        image_array (np.ndarray): 圖像數組，形狀為 (h, w, 3) 或 (h, w)。
+        """
+        if image_array is None:
+            self.image = None
+            self.image_buffer = None
+            self.update()
+            return
+
+        if len(image_array.shape) == 3:
+            height, width, channel = image_array.shape
+            image_format = QImage.Format_RGB888
+        elif len(image_array.shape) == 2:
+            height, width = image_array.shape
+            channel = 1
+            image_format = QImage.Format_Grayscale8
+        else:
+            raise ValueError("Unsupported image array shape")
+
+        if self.image is None or self.image.width() != width or self.image.height() != height or self.image.format() != image_format:
+            self.image = QImage(width, height, image_format)
+            bits = self.image.bits()
+            bits.setsize(self.image.byteCount())
+            # QImage 每行按 4 位元組對齊，視圖中只使用每行前 width * channel 個位元組
+            self.image_buffer = np.frombuffer(bits, dtype=np.uint8).reshape(height, self.image.bytesPerLine())[:, :width * channel]
+            self.setFixedSize(width, height)
+
+        np.copyto(self.image_buffer, np.asarray(image_array, dtype=np.uint8).reshape(height, width * channel))
+        self.update()
+
+    def sizeHint(self):
+        """
+        回傳:
+        QSize: 圖像大小。
+        """
+        if self.image is None:
+            return QSize(200, 150)
+        return self.image.size()
+
+    def paintEvent(self, event):
+        """
+        繪製圖像，沒有圖像時顯示提示文字。
+
+        參數:
+        event (QPaintEvent): 繪製事件。
+        """
+        painter = QPainter(self)
+        if self.image is None:
+            painter.setPen(QColor(220, 220, 220))
+            painter.drawText(self.rect(), Qt.AlignCenter, "No image available")
+        else:
+            painter.drawImage(self.rect(), self.image)
+        painter.end()
 
 class ImagesDisplayPanel(QWidget):
     def __init__(self, image1_array=None, image2_array=None, parent=None):
@@ -14,76 +88,87 @@ class ImagesDisplayPanel(QWidget):
         parent (QWidget, optional): 父級窗口。預設為 None。
         """
         super().__init__(parent)
-        
-        self.layout = QHBoxLayout(self)
 
-        # 創建兩個 QLabel 用於顯示圖片
-        self.image_label1 = QLabel(self)
-        self.image_label2 = QLabel(self)
+        self.layout = QVBoxLayout(self)
+        self.images_layout = QHBoxLayout()
+
+        # 創建兩個 ImageView 用於顯示圖片
+        self.image_view1 = ImageView(self)
+        self.image_view2 = ImageView(self)
 
-        # 設置 QLabel 的對齊方式，防止調整大小時圖像內容不一致
-        self.image_label1.setAlignment(Qt.AlignCenter)
-        self.image_label2.setAlignment(Qt.AlignCenter)
+        # 添加 ImageView 到佈局中
+        self.images_layout.addWidget(self.image_view1, 0, Qt.AlignCenter)
+        self.images_layout.addWidget(self.image_view2, 0, Qt.AlignCenter)
+        self.layout.addLayout(self.images_layout)
 
-        # 添加 QLabel 到佈局中
-        self.layout.addWidget(self.image_label1)
-        self.layout.addWidget(self.image_label2)
+        # 重疊比例標籤，收到第一個估計結果後才顯示
+        self.overlap_label = QLabel(self)
+        self.overlap_label.setAlignment(Qt.AlignCenter)
+        self.overlap_label.setVisible(False)
+        self.layout.addWidget(self.overlap_label)
         self.setLayout(self.layout)
 
+        # 從其他線程推送的幀經由此通道交給 GUI 線程
+        # 預覽圖像來自 PreviewProcessor 輪流重複使用的輸出緩衝區，由通道複製後再交給 GUI 線程
+        self.frame_channel = FrameChannel(self.apply_images, self, copy_arrays=True)
+        self.overlap_channel = FrameChannel(self.apply_overlap, self)
+
         # 設置圖片
-        self.set_image(self.image_label1, image1_array)
-        self.set_image(self.image_label2, image2_array)
+        self.set_image(self.image_view1, image1_array)
+        self.set_image(self.image_view2, image2_array)
 
-    def set_image(self, label, image_array):
+    def set_image(self, view, image_array):
         """
-        設置 QLabel 的圖像。
+        設置 ImageView 的圖像（僅在 GUI 線程中調用）。
 
         參數:
-        label (QLabel): 要設置圖像的 QLabel。
+        view (ImageView): 要設置圖像的 ImageView。
         image_array (np.ndarray): 圖像數組。
         """
-        if image_array is not None:
-            if len(image_array.shape) == 3:
-                height, width, channel = image_array.shape
-                bytes_per_line = 3 * width
-                q_image = QImage(image_array.data, width, height, bytes_per_line, QImage.Format_RGB888)
-            elif len(image_array.shape) == 2:
-                height, width = image_array.shape
-                bytes_per_line = width
-                q_image = QImage(image_array.data, width, height, bytes_per_line, QImage.Format_Grayscale8)
-            else:
-                raise ValueError("Unsupported image array shape")
-                
-            pixmap = QPixmap.fromImage(q_image)
-            label.setPixmap(pixmap)
-            label.setScaledContents(True)
-            label.setFixedSize(pixmap.width(), pixmap.height())
-        else:
-            label.setText("No image available")
+        view.set_array(image_array)
+
+    def apply_images(self, image1_array, image2_array):
+        """
+        在 GUI 線程中更新兩張圖像。
+
+        參數:
+        image1_array (np.ndarray): 第一張顯示的圖像數組。
+        image2_array (np.ndarray): 第二張顯示的圖像數組。
+        """
+        self.set_image(self.image_view1, image1_array)
+        self.set_image(self.image_view2, image2_array)
 
     def update_images(self, image1_array, image2_array):
         """
-        更新顯示的圖像。
+        更新顯示的圖像。可從任意線程調用，連續的更新會合併為最新的一組。
 
         參數:
         image1_array (np.ndarray): 第一張顯示的圖像數組。
         image2_array (np.ndarray): 第二張顯示的圖像數組。
         """
-        # 禁用窗口重繪
-        self.setUpdatesEnabled(False)
-        
-        if self.image_label1 is not None:
-            self.set_image(self.image_label1, image1_array)
-        else:
-            print("image_label1 is None")
-        
-        if self.image_label2 is not None:
-            self.set_image(self.image_label2, image2_array)
+        self.frame_channel.push(image1_array, image2_array)
+
+    def apply_overlap(self, overlap_data):
+        """
+        在 GUI 線程中更新重疊比例標籤，低於警告門檻時以紅色顯示。
+
+        參數:
+        overlap_data (dict): 包含 'ratio'、'keyframes'、'warning' 與 'threshold' 的字典。
+        """
+        text = f"Overlap: {100.0 * overlap_data['ratio']:.0f}%    Keyframes: {overlap_data['keyframes']}"
+        if overlap_data['warning']:
+            text += f"    Low overlap (< {100.0 * overlap_data['threshold']:.0f}%), move slower"
+            self.overlap_label.setStyleSheet("color: #F44747; font-weight: bold;")
         else:
-            print("image_label2 is None")
-        
-        # 啟用窗口重繪
-        self.setUpdatesEnabled(True)
-        
-        # 強制重繪窗口
-        self.update()
+            self.overlap_label.setStyleSheet("color: #DCDCDC;")
+        self.overlap_label.setText(text)
+        self.overlap_label.setVisible(True)
+
+    def update_overlap(self, overlap_data):
+        """
+        更新重疊比例。可從任意線程調用，連續的更新會合併為最新的一個。
+
+        參數:
+        overlap_data (dict): 包含 'ratio'、'keyframes'、'warning' 與 'threshold' 的字典。
+        """
+        self.overlap_channel.push(overlap_data)
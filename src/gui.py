@@ -679,6 +679,9 @@ class MainInterface(QWidget):
             self.error_signal.emit({"title": data["title"], "message": data["message"]})
         elif mode == "terminal_print":
             self.terminal_print_signal.emit({"owner": data["owner"], "message": data["message"]})
+        elif mode == "overlap":
+            if self.images_display_panel is not None:
+                self.images_display_panel.update_overlap(data)
 
     def update_image_display_panel(self, image1_array, image2_array):
         """
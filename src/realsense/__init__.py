@@ -1,7 +1,7 @@
 # realsense/__init__.py
 
 # 從 realsense.record 匯入類別和函數
-from .record import Args, Preset, RealSenseRecorder, get_profiles
+from .record import Args, Preset, RealSenseRecorder, MultiCameraRecorder, get_profiles, get_serial_numbers
 
 # 從 realsense.run_system 匯入類別
 from .run_system import Args_run_system, ReconstructionSystem
@@ -11,12 +11,41 @@ import os
 import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from point_cloud_manager import PointCloudManager, run_point_cloud_manager
+from frame_writer import FrameWriter
+from shared_frame_ring import SharedFrameRing
+from rgbd_container import RGBDChunkWriter
+from preview_publisher import PreviewPublisher
+from preview_processing import PreviewProcessor
+from capture_stats import CaptureStats
+from frame_source import RealSenseSource, EndOfStream
+from overlap_estimator import OverlapEstimator
+from keyframe_filter import KeyframeFilter
+from capture_pipeline import CapturePipeline, FrameConsumer
 import multiprocessing
 import traceback
-import ctypes
+import csv
+import time
+
+# 錄製時每幀的編號與時間戳，供多相機配對與後續處理使用
+TIMESTAMP_FILE = "timestamps.csv"
+# 重疊估計自動標記的關鍵幀
+KEYFRAME_FILE = "keyframes.csv"
+# 關鍵幀篩選跳過的幀
+SKIPPED_FRAME_FILE = "skipped_frames.csv"
+# 錄製消費者的隊列長度（寫入器另有自己的隊列），排隊中的幀會佔用 librealsense 的幀池
+RECORD_QUEUE_SIZE = 4
 
 class Args:
-    def __init__(self, output_folder, record_rosbag, record_imgs, playback_rosbag, calculate_overlap, overwrite, width=640, height=480, depth_fmt=rs.format.z16, color_fmt=rs.format.rgb8, fps=30):
+    def __init__(self, output_folder, record_rosbag, record_imgs, playback_rosbag, calculate_overlap, overwrite, width=640, height=480, depth_fmt=rs.format.z16, color_fmt=rs.format.rgb8, fps=30,
+                 writer_workers=2, writer_queue_size=64, writer_policy="block", writer_use_processes=False,
+                 overlap_ring_slots=4, record_format="imgs", chunk_depth_codec="zlib", depth_codec="png",
+                 display_rate=15, display_scale=1.0, stats_interval=5.0, stats_dump_path=None,
+                 serial=None, sensor_options=None, playback_real_time=True,
+                 live_tsdf=False, live_tsdf_voxel_size=0.05, live_tsdf_rate=2.0,
+                 estimate_overlap=False, overlap_voxel_size=0.05, overlap_keyframe_threshold=0.7, overlap_warn_threshold=0.3,
+                 keyframe_filter=False, keyframe_depth_threshold=0.05, keyframe_color_threshold=8.0,
+                 keyframe_rotation_threshold=2.0, keyframe_max_skip=15, keyframe_imu=False,
+                 depth_filters=None, filter_thread=False):
         """
         初始化 Args 類別。
 
@@ -32,6 +61,39 @@ class Args:
         depth_fmt (rs.format, optional): 深度格式。預設為 rs.format.z16。
         color_fmt (rs.format, optional): 顏色格式。預設為 rs.format.rgb8。
         fps (int, optional): 幀率。預設為 30。
+        writer_workers (int, optional): 圖像編碼工作者數量。預設為 2。
+        writer_queue_size (int, optional): 寫入隊列的最大長度。預設為 64。
+        writer_policy (str, optional): 寫入隊列已滿時的策略，"block"、"drop_oldest" 或 "fail"。預設為 "block"。
+        writer_use_processes (bool, optional): 是否以進程代替線程進行編碼。預設為 False。
+        overlap_ring_slots (int, optional): 傳送深度幀給點雲管理器的環形緩衝區槽位數。預設為 4。
+        record_format (str, optional): 圖像的儲存格式，"imgs" 為每幀一個 PNG/JPG，"chunks" 為分塊的 RGBD 容器。預設為 "imgs"。
+        chunk_depth_codec (str, optional): RGBD 容器的深度編碼方式，"raw"、"zlib"、"zstd"、"rvl" 或 "png"。預設為 "zlib"。
+        depth_codec (str, optional): 每幀一個文件時的深度編碼方式，"png"、"rvl"（較小）或 "zstd"（編解碼較快），
+            沒有安裝 zstandard 時 zstd 退回 zlib。預設為 "png"。
+        display_rate (float, optional): 預覽圖像發送到 GUI 的頻率 (Hz)。預設為 15。
+        display_scale (float, optional): 預覽圖像的縮放比例。預設為 1.0。
+        stats_interval (float, optional): 在終端輸出擷取統計摘要的間隔秒數，0 表示不輸出。預設為 5.0。
+        stats_dump_path (str, optional): 擷取結束時將統計數據與逐幀記錄寫入的 .json 或 .csv 文件。預設為 None。
+        serial (str, optional): 要使用的設備序號，None 表示使用第一個可用的設備。預設為 None。
+        sensor_options (dict, optional): 啟動時套用到設備感測器的 {rs.option: 值}。預設為 None。
+        playback_real_time (bool, optional): 回放 rosbag 時是否按照錄製速度循環播放。False 時以最快速度播放一次，
+            文件結束時停止擷取。預設為 True。
+        live_tsdf (bool, optional): 計算重疊區域時是否同時以粗體素即時融合 TSDF 預覽重建。預設為 False。
+        live_tsdf_voxel_size (float, optional): 即時 TSDF 的體素大小（米）。預設為 0.05。
+        live_tsdf_rate (float, optional): 即時 TSDF 每秒最多融合的幀數。預設為 2.0。
+        estimate_overlap (bool, optional): 是否估計每幀與上一關鍵幀的重疊比例並發送到 GUI（calculate_overlap 時總是估計）。預設為 False。
+        overlap_voxel_size (float, optional): 重疊估計的佔用網格體素大小（米）。預設為 0.05。
+        overlap_keyframe_threshold (float, optional): 重疊比例低於此值時自動標記關鍵幀。預設為 0.7。
+        overlap_warn_threshold (float, optional): 重疊比例低於此值時發出警告。預設為 0.3。
+        keyframe_filter (bool, optional): 錄製圖像時是否只保存帶來新資訊的幀，跳過的幀記錄在 skipped_frames.csv。預設為 False。
+        keyframe_depth_threshold (float, optional): 深度改變的像素比例超過此值時保存。預設為 0.05。
+        keyframe_color_threshold (float, optional): 灰階平均絕對差超過此值時保存。預設為 8.0。
+        keyframe_rotation_threshold (float, optional): IMU 旋轉角度（度）超過此值時保存。預設為 2.0。
+        keyframe_max_skip (int, optional): 最多連續跳過的幀數。預設為 15。
+        keyframe_imu (bool, optional): 是否啟用陀螺儀流供關鍵幀篩選使用（需要 D435i 等具備 IMU 的設備）。預設為 False。
+        depth_filters (dict 或 str, optional): 深度後處理濾波器（抽取、空間、時間、填洞）的設定字典或 JSON 文件路徑，
+            見 depth_filters.DEFAULT_FILTER_SETTINGS。啟用抽取時顏色改為對齊到深度流。None 表示不濾波。預設為 None。
+        filter_thread (bool, optional): 是否在獨立的工作線程中等待、濾波與對齊幀。預設為 False。
         """
         self.output_folder = output_folder
         self.record_rosbag = record_rosbag
@@ -44,6 +106,36 @@ class Args:
         self.depth_fmt = depth_fmt
         self.color_fmt = color_fmt
         self.fps = fps
+        self.writer_workers = writer_workers
+        self.writer_queue_size = writer_queue_size
+        self.writer_policy = writer_policy
+        self.writer_use_processes = writer_use_processes
+        self.overlap_ring_slots = overlap_ring_slots
+        self.record_format = record_format
+        self.chunk_depth_codec = chunk_depth_codec
+        self.depth_codec = depth_codec
+        self.display_rate = display_rate
+        self.display_scale = display_scale
+        self.stats_interval = stats_interval
+        self.stats_dump_path = stats_dump_path
+        self.serial = serial
+        self.sensor_options = sensor_options
+        self.playback_real_time = playback_real_time
+        self.live_tsdf = live_tsdf
+        self.live_tsdf_voxel_size = live_tsdf_voxel_size
+        self.live_tsdf_rate = live_tsdf_rate
+        self.estimate_overlap = estimate_overlap
+        self.overlap_voxel_size = overlap_voxel_size
+        self.overlap_keyframe_threshold = overlap_keyframe_threshold
+        self.overlap_warn_threshold = overlap_warn_threshold
+        self.keyframe_filter = keyframe_filter
+        self.keyframe_depth_threshold = keyframe_depth_threshold
+        self.keyframe_color_threshold = keyframe_color_threshold
+        self.keyframe_rotation_threshold = keyframe_rotation_threshold
+        self.keyframe_max_skip = keyframe_max_skip
+        self.keyframe_imu = keyframe_imu
+        self.depth_filters = depth_filters
+        self.filter_thread = filter_thread
 
 class Preset(IntEnum):
     Custom = 0
@@ -54,13 +146,14 @@ class Preset(IntEnum):
     MediumDensity = 5
 
 class RealSenseRecorder:
-    def __init__(self, args, callback=None):
+    def __init__(self, args, callback=None, source=None):
         """
         初始化 RealSenseRecorder。
 
         參數:
         args (Args): 配置參數。
         callback (callable, optional): 回調函數。預設為 None。
+        source (FrameSource, optional): 幀來源，None 表示使用 RealSense 設備或 rosbag 回放。預設為 None。
         """
         self.args = args
         self.pipeline = rs.pipeline()
@@ -76,10 +169,24 @@ class RealSenseRecorder:
         self.color_image = None
         self.bg_removed = None
         self.point_cloud_manager = None
+        self.frame_writer = None
+        self.writer_counters = None
+        self.frame_timestamps = []
+        self.frame_count = 0
+        self.consumer_counters = None
+        self.preview_publisher = None
+        self.preview_processor = None
+        self.clipping_distance = None
+        self.capture_stats = None
         self.intrinsics_dict = None
         self.depth_image_shape = None
-        self.shared_depth_image = None
-        self.data_queue = multiprocessing.Queue()
+        self.depth_ring = None
+        self.overlap_estimator = None
+        self.overlap_keyframes = []
+        self.overlap_warning = False
+        self.overlap_next_send = 0.0
+        self.keyframe_filter = None
+        self.skipped_frames = []
         self.stop_event = multiprocessing.Event()
 
         if callback:
@@ -87,6 +194,15 @@ class RealSenseRecorder:
         else:
             self.callback = None
 
+        if source is not None:
+            self.source = source
+        else:
+            # 錄製 rosbag 或圖像時設置高精度預設選項
+            visual_preset = Preset.HighAccuracy if args.record_rosbag or args.record_imgs else None
+            self.source = RealSenseSource(self.pipeline, self.config, visual_preset, args.sensor_options,
+                                          real_time=args.playback_real_time, use_imu=args.keyframe_imu,
+                                          depth_filters=args.depth_filters, filter_thread=args.filter_thread)
+
         self.setup_folders()
         self.configure_streams(preview=True)
 
@@ -97,8 +213,9 @@ class RealSenseRecorder:
         try:
             if self.args.record_imgs:
                 self.make_clean_folder(self.path_output, self.args.overwrite)
-                self.make_clean_folder(self.path_depth, self.args.overwrite)
-                self.make_clean_folder(self.path_color, self.args.overwrite)
+                if self.args.record_format == "imgs":
+                    self.make_clean_folder(self.path_depth, self.args.overwrite)
+                    self.make_clean_folder(self.path_color, self.args.overwrite)
             if self.args.record_rosbag:
                 self.handle_rosbag_file()
         except Exception as e:
@@ -114,10 +231,14 @@ class RealSenseRecorder:
         """
         try:
             if self.args.playback_rosbag:
-                self.config.enable_device_from_file(self.path_bag, repeat_playback=True)
+                self.config.enable_device_from_file(self.path_bag, repeat_playback=self.args.playback_real_time)
             else:
+                if self.args.serial:
+                    self.config.enable_device(self.args.serial)
                 self.config.enable_stream(rs.stream.depth, self.args.width, self.args.height, self.args.depth_fmt, self.args.fps)
                 self.config.enable_stream(rs.stream.color, self.args.width, self.args.height, self.args.color_fmt, self.args.fps)
+                if self.args.keyframe_imu:
+                    self.config.enable_stream(rs.stream.gyro)
                 if not preview and self.args.record_rosbag:
                     self.config.enable_record_to_file(self.path_bag)
         except Exception as e:
@@ -161,24 +282,19 @@ class RealSenseRecorder:
             print(f"Error handling rosbag file: {e}")
             self.send_to_model("show_error", {"title": "Error handling rosbag file", "message": str(e)})
 
-    @staticmethod
-    def save_intrinsic_as_json(filename, frame):
+    def create_container(self):
         """
-        保存相機內參到 JSON 文件。
+        依照幀來源的內參建立 RGBD 容器（深度已對齊到顏色流）。
 
-        參數:
-        filename (str): 文件名。
-        frame (rs.frame): RealSense 幀。
+        回傳:
+        RGBDChunkWriter: RGBD 容器寫入器。
         """
         try:
-            intrinsics = frame.profile.as_video_stream_profile().intrinsics
-            with open(filename, 'w') as outfile:
-                json.dump(
-                    {'width': intrinsics.width, 'height': intrinsics.height,
-                     'intrinsic_matrix': [intrinsics.fx, 0, 0, 0, intrinsics.fy, 0, intrinsics.ppx, intrinsics.ppy, 1]},
-                    outfile, indent=4)
+            intrinsics = self.source.intrinsics
+            return RGBDChunkWriter(self.path_output, intrinsics['width'], intrinsics['height'], self.source.intrinsic_matrix,
+                                   depth_scale=self.source.depth_scale, depth_codec=self.args.chunk_depth_codec)
         except Exception as e:
-            print(f"Error saving intrinsic as JSON: {e}")
+            print(f"Error creating RGBD container: {e}")
             raise
 
     def start_preview(self):
@@ -234,7 +350,7 @@ class RealSenseRecorder:
             if self.is_running:
                 self.is_running = False
                 try:
-                    self.pipeline.stop()
+                    self.source.stop()
                 except RuntimeError as e:
                     print(f"Error stopping pipeline: {e}")
                     self.send_to_model("show_error", {"title": "Error stopping pipeline", "message": str(e)})
@@ -268,188 +384,433 @@ class RealSenseRecorder:
         """
         預覽過程。
         """
-        try:
-            # 啟動管道並配置流
-            profile = self.pipeline.start(self.config)
-            depth_sensor = profile.get_device().first_depth_sensor()
-            
-            # 設置高精度預設選項（如果錄製 rosbag 或圖像）
-            if self.args.record_rosbag or self.args.record_imgs:
-                depth_sensor.set_option(rs.option.visual_preset, Preset.HighAccuracy)
-            
-            # 獲取深度比例並計算剪切距離（3 米）
-            depth_scale = depth_sensor.get_depth_scale()
-            clipping_distance = 3 / depth_scale
-            
-            # 對齊深度流和顏色流
-            align = rs.align(rs.stream.color)
-
-            # 如果需要計算重疊且正在播放 rosbag，初始化點雲管理器
-            if self.args.calculate_overlap and self.args.playback_rosbag:
-                aligned_frames = self.pipeline.wait_for_frames()
-                aligned_depth_frame = aligned_frames.get_depth_frame()
-                intrinsics = aligned_depth_frame.profile.as_video_stream_profile().intrinsics
-                self.intrinsics_dict = {
-                    'width': intrinsics.width,
-                    'height': intrinsics.height,
-                    'fx': intrinsics.fx,
-                    'fy': intrinsics.fy,
-                    'ppx': intrinsics.ppx,
-                    'ppy': intrinsics.ppy
-                }
-                self.depth_image_shape = (intrinsics.height, intrinsics.width)
-
-                self.shared_depth_image = multiprocessing.Array(ctypes.c_uint16, int(np.prod(self.depth_image_shape)))
-                # 啟動 PointCloudManager 進程
-                p = multiprocessing.Process(target=run_point_cloud_manager, args=(self.depth_image_shape, self.data_queue, self.shared_depth_image, self.stop_event, self.intrinsics_dict))
-                p.start()
-
-            while self.is_running:
-                # 等待新的幀並對齊
-                frames = self.pipeline.wait_for_frames()
-                aligned_frames = align.process(frames)
-                aligned_depth_frame = aligned_frames.get_depth_frame()
-                color_frame = aligned_frames.get_color_frame()
-                
-                # 檢查是否獲取到有效的深度和顏色幀
-                if not aligned_depth_frame or not color_frame:
-                    continue
-                
-                # 將幀數據轉換為 numpy 數組
-                self.depth_image = np.asanyarray(aligned_depth_frame.get_data())
-                self.color_image = np.asanyarray(color_frame.get_data())
-
-                # 如果需要計算重疊，將深度數據傳送到 PointCloudManager
-                if self.args.calculate_overlap and self.args.playback_rosbag:
-                    np.copyto(np.frombuffer(self.shared_depth_image.get_obj(), dtype=np.uint16).reshape(self.depth_image_shape), self.depth_image)
-                    self.data_queue.put(True)
-
-                # 移除背景
-                self.bg_removed = self.remove_background(self.depth_image, self.color_image, clipping_distance)
-                
-                # 將深度圖像轉換為彩色映射
-                self.depth_image = cv2.applyColorMap(
-                    cv2.convertScaleAbs(self.depth_image, alpha=0.09), cv2.COLORMAP_JET)
-                
-                # 發送圖像數據到模型
-                self.send_to_model("record_imgs", {"depth_image": self.depth_image, "color_image": self.bg_removed})
-                
-        except RuntimeError as e:
-            print(f"Error during preview: {e}")
-            self.send_to_model("show_error", {"title": "Error during preview", "message": str(e)})
-        finally:
-            if self.is_running:
-                try:
-                    self.pipeline.stop()
-                    self.is_running = False
-                    if self.args.calculate_overlap and self.args.playback_rosbag:
-                        self.stop_event.set()  # 設置停止事件
-                        p.join()
-                except Exception as e:
-                    print(f"Error stopping pipeline in preview: {e}")
-                    self.send_to_model("show_error", {"title": "Error stopping pipeline in preview", "message": str(e)})
+        self.capture(recording=False)
 
     def record(self):
         """
         錄製過程。
         """
+        self.capture(recording=True)
+
+    def capture(self, recording):
+        """
+        以分階段的管道擷取幀：擷取線程只等待已對齊的幀並分發給各消費者
+        （錄製、點雲管理器、重疊估計、預覽），每個消費者在自己的線程中以有界隊列處理，
+        緩慢的消費者不會拖慢擷取。
+
+        參數:
+        recording (bool): 是否為錄製過程（啟動寫入器與錄製消費者）。
+        """
+        mode, stop_mode = ("recording", "record") if recording else ("preview", "preview")
+        pipeline = None
+        point_cloud_process = None
         try:
-            # 啟動管道並配置流
-            profile = self.pipeline.start(self.config)
-            depth_sensor = profile.get_device().first_depth_sensor()
-            
-            # 設置高精度預設選項（如果錄製 rosbag 或圖像）
-            if self.args.record_rosbag or self.args.record_imgs:
-                depth_sensor.set_option(rs.option.visual_preset, Preset.HighAccuracy)
-            
-            # 獲取深度比例並計算剪切距離（3 米）
-            depth_scale = depth_sensor.get_depth_scale()
-            clipping_distance = 3 / depth_scale
-            
-            # 對齊深度流和顏色流
-            align = rs.align(rs.stream.color)
-
-            # 如果需要計算重疊，初始化點雲管理器
-            if self.args.calculate_overlap:
-                # 獲取並保存內參
-                aligned_frames = self.pipeline.wait_for_frames()
-                aligned_depth_frame = aligned_frames.get_depth_frame()
-                intrinsics = aligned_depth_frame.profile.as_video_stream_profile().intrinsics
-                self.intrinsics_dict = {
-                    'width': intrinsics.width,
-                    'height': intrinsics.height,
-                    'fx': intrinsics.fx,
-                    'fy': intrinsics.fy,
-                    'ppx': intrinsics.ppx,
-                    'ppy': intrinsics.ppy
-                }
-                self.depth_image_shape = (intrinsics.height, intrinsics.width)
-                
-                self.shared_depth_image = multiprocessing.Array(ctypes.c_uint16, int(np.prod(self.depth_image_shape)))
-                # 啟動 PointCloudManager 進程
-                p = multiprocessing.Process(target=run_point_cloud_manager, args=(self.depth_image_shape, self.data_queue, self.shared_depth_image, self.stop_event, self.intrinsics_dict))
-                p.start()
-
-            frame_count = 0
-            while self.is_running:
-                try:
-                    # 等待新的幀並對齊
-                    frames = self.pipeline.wait_for_frames()
-                    aligned_frames = align.process(frames)
-                    aligned_depth_frame = aligned_frames.get_depth_frame()
-                    color_frame = aligned_frames.get_color_frame()
-                    
-                    # 檢查是否獲取到有效的深度和顏色幀
-                    if not aligned_depth_frame or not color_frame:
-                        continue
-                    
-                    # 將幀數據轉換為 numpy 數組
-                    self.depth_image = np.asanyarray(aligned_depth_frame.get_data())
-                    self.color_image = np.asanyarray(color_frame.get_data())
-                    
-                    # 如果需要計算重疊，將深度數據傳送到 PointCloudManager
-                    if self.args.calculate_overlap:
-                        np.copyto(np.frombuffer(self.shared_depth_image.get_obj(), dtype=np.uint16).reshape(self.depth_image_shape), self.depth_image)
-                        self.data_queue.put(True)
-
-                    # 如果正在錄製，保存圖像
-                    if self.is_recording and self.args.record_imgs:
-                        if frame_count == 0:
-                            self.save_intrinsic_as_json(join(self.path_output, "camera_intrinsic.json"), color_frame)
-                        cv2.imwrite(f"{self.path_depth}/{frame_count:06d}.png", self.depth_image)
-                        cv2.imwrite(f"{self.path_color}/{frame_count:06d}.jpg", self.color_image)
-                        frame_count += 1
-
-                    # 移除背景
-                    self.bg_removed = self.remove_background(self.depth_image, self.color_image, clipping_distance)
-
-                    # 將深度圖像轉換為彩色映射
-                    self.depth_image = cv2.applyColorMap(
-                        cv2.convertScaleAbs(self.depth_image, alpha=0.09), cv2.COLORMAP_JET)
-
-                    # 發送圖像數據到模型
-                    self.send_to_model("record_imgs", {"depth_image": self.depth_image, "color_image": self.bg_removed})
-                    
-                except RuntimeError as e:
-                    tb = traceback.format_exc()
-                    print(f"Error processing frames: {e}\n{tb}")
-                    break  # 跳出循環，以便在 finally 中進行清理
+            # 啟動幀來源，深度與顏色幀已對齊
+            self.source.start()
+            self.clipping_distance = 3 / self.source.depth_scale  # 剪切距離（3 米）
+
+            # 錄製時如果需要計算重疊，或預覽播放中的 rosbag 時，啟動點雲管理器
+            if self.args.calculate_overlap and (recording or self.args.playback_rosbag):
+                point_cloud_process = self.start_point_cloud_manager()
+
+            self.start_capture_stats()
+            self.start_overlap_estimator()
+            self.source.stats = self.capture_stats
+            if recording:
+                self.start_keyframe_filter()
+                self.start_frame_writer()
+            self.start_preview_publisher()
+
+            pipeline = self.build_pipeline(recording, point_cloud_process is not None)
+            pipeline.run(lambda: self.is_running, self.on_frame)
+        except EndOfStream:
+            pass
         except RuntimeError as e:
             tb = traceback.format_exc()
-            print(f"Error during recording: {e}\n{tb}")
-            self.send_to_model("show_error", {"title": "Error during recording", "message": str(e)})
+            print(f"Error during {mode}: {e}\n{tb}")
+            self.send_to_model("show_error", {"title": f"Error during {mode}", "message": str(e)})
         finally:
             try:
+                # 先停止消費者（處理完排隊的幀），再關閉它們使用的寫入器與環形緩衝區
+                if pipeline is not None:
+                    self.consumer_counters = pipeline.get_counters()
+                    pipeline.close()
+                self.stop_preview_publisher()
                 if self.is_running:
-                    self.pipeline.stop()
+                    self.source.stop()
                     self.is_running = False
-                self.stop_event.set()  # 設置停止事件
-                if self.args.calculate_overlap:
-                    p.join()
+                if recording or point_cloud_process is not None:
+                    self.stop_event.set()  # 設置停止事件
+                if point_cloud_process is not None:
+                    self.release_depth_ring(point_cloud_process)
+                if recording:
+                    self.finish_frame_writer()
+                self.finish_capture_stats()
+            except Exception as e:
+                print(f"Error stopping pipeline in {stop_mode}: {e}")
+                self.send_to_model("show_error", {"title": f"Error stopping pipeline in {stop_mode}", "message": str(e)})
+            # 錄製消費者處理停止前排隊的幀時失敗
+            error = pipeline.get_consumer_error() if pipeline is not None and not pipeline.error_raised else None
+            if error is not None:
+                print(f"Error during {mode}: {error}")
+                self.send_to_model("show_error", {"title": f"Error during {mode}", "message": str(error)})
+
+    def build_pipeline(self, recording, point_cloud):
+        """
+        建立擷取管道並加入需要的消費者。
+
+        參數:
+        recording (bool): 是否加入錄製消費者（同時需要 record_imgs）。
+        point_cloud (bool): 是否加入將深度幀寫入點雲管理器環形緩衝區的消費者。
+
+        回傳:
+        CapturePipeline: 擷取管道。
+        """
+        stats = self.capture_stats
+        pipeline = CapturePipeline(self.source, stats)
+        if recording and self.args.record_imgs:
+            # 寫入器策略為 drop_oldest 時丟棄最舊的幀，否則擷取線程等待，由寫入器決定等待 (block) 或失敗 (fail)；
+            # 錄製失敗（例如 fail 策略的 FrameWriterFullError）時停止擷取並顯示錯誤
+            policy = "drop_oldest" if self.args.writer_policy == "drop_oldest" else "block"
+            pipeline.add_frame_consumer(FrameConsumer("record", self.record_frame, queue_size=RECORD_QUEUE_SIZE, policy=policy, stats=stats, fail_fast=True))
+        if point_cloud:
+            pipeline.add_frame_consumer(FrameConsumer("point_cloud", self.write_depth_ring, stats=stats))
+        if self.overlap_estimator is not None:
+            pipeline.add_frame_consumer(FrameConsumer("overlap", self.update_overlap, stats=stats))
+        # 預覽發佈器本身只保留最新一幀並在自己的線程中處理
+        pipeline.add_consumer("preview", lambda frame_set: self.preview_publisher.submit(frame_set.depth_image, frame_set.color_image))
+        return pipeline
+
+    def on_frame(self, frame_set):
+        """
+        每幀分發後在擷取線程中調用：保存最新的幀並更新擷取統計。
+
+        參數:
+        frame_set (FrameSet): 幀。
+        """
+        self.depth_image = frame_set.depth_image
+        self.color_image = frame_set.color_image
+        self.update_capture_stats(frame_set)
+
+    def start_frame_writer(self):
+        """
+        錄製圖像時啟動非同步寫入器。
+        """
+        self.frame_timestamps = []
+        self.frame_count = 0
+        if not self.args.record_imgs:
+            return
+        container = None
+        if self.args.record_format == "chunks":
+            container = self.create_container()
+        self.frame_writer = FrameWriter(
+            self.path_depth, self.path_color,
+            num_workers=self.args.writer_workers,
+            queue_size=self.args.writer_queue_size,
+            policy=self.args.writer_policy,
+            use_processes=self.args.writer_use_processes,
+            container=container,
+            stats=self.capture_stats,
+            depth_codec=self.args.depth_codec)
+        self.frame_writer.start()
+
+    def record_frame(self, frame_set):
+        """
+        錄製消費者：正在錄製時經過關鍵幀篩選後交給寫入器，並記錄幀編號與時間戳。
+
+        參數:
+        frame_set (FrameSet): 幀。
+        """
+        if not self.is_recording or not self.keep_frame(frame_set, self.frame_count):
+            return
+        if self.frame_count == 0:
+            self.source.save_intrinsic_as_json(join(self.path_output, "camera_intrinsic.json"))
+        self.frame_writer.put(self.frame_count, frame_set.depth_image, frame_set.color_image, frame_set.timestamp)
+        self.frame_timestamps.append((self.frame_count, frame_set.frame_number, frame_set.timestamp))
+        self.frame_count += 1
+
+    def write_depth_ring(self, frame_set):
+        """
+        點雲消費者：將深度幀寫入點雲管理器的環形緩衝區。
+
+        參數:
+        frame_set (FrameSet): 幀。
+        """
+        self.depth_ring.write(frame_set.depth_image, frame_set.frame_number)
+
+    def finish_frame_writer(self):
+        """
+        關閉寫入器並保存時間戳、自動標記的關鍵幀與跳過的幀。
+        """
+        if self.frame_writer is None:
+            return
+        counters = self.frame_writer.close()
+        self.writer_counters = counters
+        print(f"Frame writer: queued {counters['queued']}, written {counters['written']}, dropped {counters['dropped']}, errors {counters['errors']}")
+        self.frame_writer = None
+        self.save_timestamps(join(self.path_output, TIMESTAMP_FILE))
+        if self.overlap_estimator is not None:
+            self.save_keyframes(join(self.path_output, KEYFRAME_FILE))
+        if self.keyframe_filter is not None:
+            filter_stats = self.keyframe_filter.get_stats()
+            print(f"Keyframe filter: kept {filter_stats['kept']}, skipped {filter_stats['skipped']}")
+            self.save_skipped_frames(join(self.path_output, SKIPPED_FRAME_FILE))
+
+    def save_timestamps(self, filename):
+        """
+        保存錄製幀的編號與時間戳到 CSV 文件。
+
+        參數:
+        filename (str): 文件名。
+        """
+        try:
+            with open(filename, 'w', newline='') as outfile:
+                writer = csv.writer(outfile)
+                writer.writerow(['frame_id', 'frame_number', 'timestamp_ms'])
+                writer.writerows(self.frame_timestamps)
+        except Exception as e:
+            print(f"Error saving timestamps: {e}")
+            self.send_to_model("show_error", {"title": "Error saving timestamps", "message": str(e)})
+
+    def save_keyframes(self, filename):
+        """
+        保存重疊估計自動標記的關鍵幀編號與重疊比例到 CSV 文件，只包含已保存的幀。
+
+        參數:
+        filename (str): 文件名。
+        """
+        try:
+            frame_ids = {frame_number: frame_id for frame_id, frame_number, _ in self.frame_timestamps}
+            with open(filename, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(['frame_id', 'overlap'])
+                for frame_number, ratio in self.overlap_keyframes:
+                    if frame_number in frame_ids:
+                        writer.writerow([frame_ids[frame_number], f"{ratio:.4f}"])
+        except Exception as e:
+            print(f"Error saving keyframes: {e}")
+            self.send_to_model("show_error", {"title": "Error saving keyframes", "message": str(e)})
+
+    def start_keyframe_filter(self):
+        """
+        在錄製圖像且啟用關鍵幀篩選時建立新的關鍵幀篩選器。
+        """
+        self.keyframe_filter = None
+        self.skipped_frames = []
+        if not (self.args.keyframe_filter and self.args.record_imgs):
+            return
+        self.keyframe_filter = KeyframeFilter(
+            depth_threshold=self.args.keyframe_depth_threshold,
+            color_threshold=self.args.keyframe_color_threshold,
+            rotation_threshold=self.args.keyframe_rotation_threshold,
+            max_skip=self.args.keyframe_max_skip,
+            depth_scale=self.source.depth_scale)
+
+    def keep_frame(self, frame_set, frame_count):
+        """
+        判斷是否保存一幀，跳過時記錄其幀編號、時間戳與上一保存幀的編號。
+
+        參數:
+        frame_set (FrameSet): 幀來源回傳的幀。
+        frame_count (int): 已保存的幀數。
+
+        回傳:
+        bool: 是否保存此幀（未啟用關鍵幀篩選時總是 True）。
+        """
+        if self.keyframe_filter is None:
+            return True
+        with self.capture_stats.stage("keyframe_filter", per_frame=False):
+            decision = self.keyframe_filter.update(frame_set.depth_image, frame_set.color_image, frame_set.rotation)
+        if not decision.keep:
+            self.skipped_frames.append((frame_set.frame_number, frame_set.timestamp, frame_count - 1,
+                                        decision.depth_change, decision.color_change, decision.rotation))
+        return decision.keep
+
+    def save_skipped_frames(self, filename):
+        """
+        保存關鍵幀篩選跳過的幀到 CSV 文件，previous_frame_id 為其之前最後保存的幀。
+
+        參數:
+        filename (str): 文件名。
+        """
+        try:
+            with open(filename, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(['frame_number', 'timestamp_ms', 'previous_frame_id', 'depth_change', 'color_change', 'rotation_deg'])
+                for frame_number, timestamp, previous_id, depth_change, color_change, rotation in self.skipped_frames:
+                    writer.writerow([frame_number, f"{timestamp:.3f}", previous_id,
+                                     f"{depth_change:.4f}", f"{color_change:.2f}", f"{rotation:.3f}"])
+        except Exception as e:
+            print(f"Error saving skipped frames: {e}")
+            self.send_to_model("show_error", {"title": "Error saving skipped frames", "message": str(e)})
+
+    def start_overlap_estimator(self):
+        """
+        在計算重疊或估計重疊時建立新的重疊估計器。
+        """
+        self.overlap_estimator = None
+        self.overlap_keyframes = []
+        self.overlap_warning = False
+        self.overlap_next_send = 0.0
+        if not (self.args.calculate_overlap or self.args.estimate_overlap):
+            return
+        intrinsics = self.source.intrinsics
+        self.overlap_estimator = OverlapEstimator(
+            intrinsics, (intrinsics['height'], intrinsics['width']),
+            depth_scale=self.source.depth_scale,
+            voxel_size=self.args.overlap_voxel_size,
+            keyframe_threshold=self.args.overlap_keyframe_threshold,
+            warn_threshold=self.args.overlap_warn_threshold)
+
+    def update_overlap(self, frame_set):
+        """
+        重疊消費者：估計深度幀的重疊比例，記錄自動標記的關鍵幀，並以預覽頻率將結果發送到 GUI。
+        警告狀態改變時立即發送。
+
+        參數:
+        frame_set (FrameSet): 幀。
+        """
+        result = self.overlap_estimator.update(frame_set.depth_image)
+        if result.is_keyframe and self.is_recording:
+            self.overlap_keyframes.append((frame_set.frame_number, result.ratio))
+
+        changed = result.warning != self.overlap_warning
+        self.overlap_warning = result.warning
+        if changed and result.warning:
+            self.send_to_model("terminal_print", {"owner": "record", "message": f"Low overlap with last keyframe: {100.0 * result.ratio:.0f}%, move the camera slower"})
+
+        now = time.perf_counter()
+        if changed or now >= self.overlap_next_send:
+            self.overlap_next_send = now + (1.0 / self.args.display_rate if self.args.display_rate > 0 else 0.0)
+            self.send_to_model("overlap", {
+                "ratio": result.ratio,
+                "keyframes": self.overlap_estimator.keyframes,
+                "warning": result.warning,
+                "threshold": self.args.overlap_warn_threshold})
+
+    def start_point_cloud_manager(self):
+        """
+        建立深度幀環形緩衝區並啟動點雲管理器進程。
+
+        回傳:
+        multiprocessing.Process: 點雲管理器進程。
+        """
+        self.intrinsics_dict = dict(self.source.intrinsics)
+        self.depth_image_shape = (self.intrinsics_dict['height'], self.intrinsics_dict['width'])
+        self.depth_ring = SharedFrameRing(self.depth_image_shape, np.uint16, self.args.overlap_ring_slots)
+        manager_options = {}
+        if self.args.live_tsdf:
+            manager_options = {'live_tsdf': True,
+                               'tsdf_voxel_size': self.args.live_tsdf_voxel_size,
+                               'tsdf_rate': self.args.live_tsdf_rate}
+        process = multiprocessing.Process(target=run_point_cloud_manager, args=(self.depth_image_shape, self.depth_ring, self.stop_event, self.intrinsics_dict, manager_options))
+        process.start()
+        return process
+
+    def start_preview_publisher(self):
+        """
+        啟動預覽發佈線程。
+        """
+        self.preview_processor = PreviewProcessor(self.clipping_distance)
+        self.preview_publisher = PreviewPublisher(
+            self.render_preview, self.send_to_model,
+            display_rate=self.args.display_rate,
+            display_scale=self.args.display_scale,
+            stats=self.capture_stats)
+        self.preview_publisher.start()
+
+    def stop_preview_publisher(self):
+        """
+        停止預覽發佈線程。
+        """
+        if self.preview_publisher is not None:
+            self.preview_publisher.stop()
+            self.preview_publisher = None
+        if self.preview_processor is not None:
+            stats = self.preview_processor.get_stats()
+            print(f"Preview processing: {stats['frames']} frames, "
+                  f"mask {stats['mask']['mean_ms']:.2f} ms, colorize {stats['colorize']['mean_ms']:.2f} ms, "
+                  f"total {stats['total']['mean_ms']:.2f} ms (max {stats['total']['max_ms']:.2f} ms) per frame")
+
+    def start_capture_stats(self):
+        """
+        建立新的擷取統計。
+        """
+        self.capture_stats = CaptureStats(
+            expected_fps=self.args.fps,
+            report_interval=self.args.stats_interval,
+            trace=self.args.stats_dump_path is not None)
+
+    def update_capture_stats(self, frame_set):
+        """
+        記錄一個已處理的幀，並在到達間隔時將摘要發送到終端。
+
+        參數:
+        frame_set (FrameSet): 幀來源回傳的幀，用於取得幀編號與時間戳。
+        """
+        self.capture_stats.frame(frame_set.frame_number, frame_set.timestamp)
+        if self.capture_stats.summary_due():
+            self.send_to_model("terminal_print", {"owner": "record", "message": self.capture_stats.summary()})
+
+    def finish_capture_stats(self):
+        """
+        輸出最終的擷取統計摘要，並在設定了 stats_dump_path 時寫入文件。
+        """
+        if self.capture_stats is None:
+            return
+        print(f"Capture stats: {self.capture_stats.summary()}")
+        if self.args.stats_dump_path:
+            try:
+                self.capture_stats.dump(self.args.stats_dump_path)
             except Exception as e:
-                print(f"Error stopping pipeline in record: {e}")
-                self.send_to_model("show_error", {"title": "Error stopping pipeline in record", "message": str(e)})
+                print(f"Error dumping capture stats: {e}")
+                self.send_to_model("show_error", {"title": "Error dumping capture stats", "message": str(e)})
+
+    def get_stats(self):
+        """
+        獲取擷取循環的統計數據。
 
+        回傳:
+        dict: 包含 'capture'（各階段耗時直方圖、有效幀率、丟幀與延遲幀）、
+        'writer'（錄製結束後為最終計數）、'preview'、'preview_processing'、'overlap'、'keyframe_filter' 與 'consumers'（擷取結束後各消費者的計數）的字典，未啟用的部分為 None。
+        """
+        return {
+            'capture': self.capture_stats.get_stats() if self.capture_stats is not None else None,
+            'writer': self.frame_writer.get_counters() if self.frame_writer is not None else self.writer_counters,
+            'preview': self.preview_publisher.get_counters() if self.preview_publisher is not None else None,
+            'preview_processing': self.preview_processor.get_stats() if self.preview_processor is not None else None,
+            'overlap': self.overlap_estimator.get_stats() if self.overlap_estimator is not None else None,
+            'keyframe_filter': self.keyframe_filter.get_stats() if self.keyframe_filter is not None else None,
+            'consumers': self.consumer_counters
+        }
+
+    def render_preview(self, depth_image, color_image):
+        """
+        生成預覽圖像：移除背景並將深度圖像轉換為彩色映射。
+
+        參數:
+        depth_image (np.ndarray): 深度圖像數組。
+        color_image (np.ndarray): 顏色圖像數組。
+
+        回傳:
+        tuple: (深度彩色映射, 移除背景後的顏色圖像)。
+        """
+        return self.preview_processor.process(depth_image, color_image)
+
+    def release_depth_ring(self, process):
+        """
+        關閉深度幀環形緩衝區，等待點雲管理器進程結束後釋放共享記憶體。
+
+        參數:
+        process (multiprocessing.Process): 點雲管理器進程。
+        """
+        if self.depth_ring is None:
+            return
+        self.depth_ring.shutdown()
+        process.join()
+        self.depth_ring.close()
+        self.depth_ring.unlink()
+        self.depth_ring = None
 
     def recive_from_model(self, mode, data=None):
         """
@@ -481,7 +842,7 @@ class RealSenseRecorder:
         """
         if self.callback is not None:
             try:
-                if mode == "record_imgs" or mode == "show_error":
+                if mode in ["record_imgs", "show_error", "terminal_print", "overlap"]:
                     self.callback(mode, data)
             except Exception as e:
                 print(f"Error sending to model: {e}")
@@ -3,12 +3,15 @@
 # 從 RealSenseRecorder.py 匯入類別和函數
 from .RealSenseRecorder import Args, Preset, RealSenseRecorder
 
+# 從 multi_camera_recorder.py 匯入類別
+from .multi_camera_recorder import MultiCameraRecorder
+
 # 從 realsense_helper.py 匯入函數
-from .realsense_helper import get_profiles
+from .realsense_helper import get_profiles, get_serial_numbers
 
 # 選擇性地提供匯入模組的簡要說明或註釋
 """
 realsense.record 模組
 
-該模組整合了 RealSenseRecorder 和 realsense_helper 的功能。
+該模組整合了 RealSenseRecorder、MultiCameraRecorder 和 realsense_helper 的功能。
 """
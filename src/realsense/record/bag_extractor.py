@@ -0,0 +1,87 @@
+import argparse
+import json
+import time
+from os.path import join
+import pyrealsense2 as rs
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from RealSenseRecorder import Args, RealSenseRecorder
+from frame_source import RealSenseSource
+
+def extract_bag(path_bag, frames_folder, num_workers=None, use_processes=False, record_format="imgs", progress=None):
+    """
+    以非即時回放將 RealSense bag 文件轉換為 RGBD 資料集。
+
+    bag 文件只播放一次且不按照錄製速度等待，解碼與對齊以 CPU 允許的最快速度進行，
+    PNG/JPG 編碼分派給多個工作者。輸出結構與 Open3D RGBDVideoReader.save_frames 相同：
+        <frames_folder>/{depth/000000.png, color/000000.jpg, intrinsic.json}
+    record_format 為 "chunks" 時則輸出 RGBD 容器。
+
+    參數:
+    path_bag (str): bag 文件路徑。
+    frames_folder (str): 輸出資料夾（會被清空）。
+    num_workers (int, optional): 編碼工作者數量，None 表示使用所有 CPU 核心。預設為 None。
+    use_processes (bool, optional): 是否以進程代替線程進行編碼。預設為 False。
+    record_format (str, optional): "imgs" 或 "chunks"。預設為 "imgs"。
+    progress (callable, optional): 接收進度文字的函數。預設為 None。
+
+    回傳:
+    tuple: (frames_folder, path_intrinsic, depth_scale)，depth_scale 為每米的深度單位數（例如 1000）。
+    """
+    config = rs.config()
+    config.enable_device_from_file(path_bag, repeat_playback=False)
+    # 轉換為 BGR 後寫出，讓 color/*.jpg 的顏色與 Open3D 的輸出一致
+    source = RealSenseSource(rs.pipeline(), config, real_time=False, bgr_output=True)
+
+    args = Args(frames_folder, record_rosbag=False, record_imgs=True, playback_rosbag=False,
+                calculate_overlap=False, overwrite=True,
+                writer_workers=num_workers or os.cpu_count() or 2,
+                writer_queue_size=128, writer_policy="block", writer_use_processes=use_processes,
+                record_format=record_format, display_rate=1, stats_interval=5.0 if progress else 0)
+
+    errors = []
+    def callback(mode, data):
+        if mode == "terminal_print" and progress is not None:
+            progress(f"Extracting {os.path.basename(path_bag)}: {data['message']}")
+        elif mode == "show_error":
+            errors.append(f"{data['title']}: {data['message']}")
+
+    recorder = RealSenseRecorder(args, callback, source=source)
+    recorder.is_running = True
+    recorder.is_recording = True
+    start = time.perf_counter()
+    recorder.record()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise RuntimeError("; ".join(errors))
+
+    writer = recorder.get_stats()['writer']
+    written = writer['written']
+    if written == 0:
+        raise RuntimeError(f"No frames extracted from {path_bag}")
+    if writer['errors'] or writer['dropped']:
+        raise RuntimeError(f"Incomplete extraction from {path_bag}: {writer['errors']} write errors, {writer['dropped']} dropped frames")
+    if progress is not None:
+        progress(f"Extracted {written} frames from {os.path.basename(path_bag)} in {elapsed:.1f} s ({written / elapsed:.1f} fps)")
+
+    # depth_scale 與 Open3D 的 intrinsic.json 一致，為每米的深度單位數
+    depth_scale = 1.0 / source.depth_scale
+    path_intrinsic = join(frames_folder, "intrinsic.json")
+    with open(path_intrinsic, 'w') as outfile:
+        json.dump(
+            {'width': source.intrinsics['width'], 'height': source.intrinsics['height'],
+             'intrinsic_matrix': source.intrinsic_matrix, 'depth_scale': depth_scale},
+            outfile, indent=4)
+    return frames_folder, path_intrinsic, depth_scale
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract an RGBD dataset from a RealSense bag file as fast as possible")
+    parser.add_argument("bag", type=str, help="path to the .bag file")
+    parser.add_argument("--output", type=str, default=None, help="output folder (default: bag path without extension)")
+    parser.add_argument("--workers", type=int, default=None, help="number of encoding workers (default: all cores)")
+    parser.add_argument("--use_processes", action="store_true", help="encode in processes instead of threads")
+    parser.add_argument("--record_format", choices=["imgs", "chunks"], default="imgs")
+    args = parser.parse_args()
+    extract_bag(args.bag, args.output or os.path.splitext(args.bag)[0], args.workers, args.use_processes,
+                args.record_format, progress=print)
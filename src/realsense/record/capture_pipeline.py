@@ -0,0 +1,217 @@
+import threading
+from contextlib import nullcontext
+from queue import Queue, Empty, Full
+
+# 消費者隊列中表示停止的標記
+STOP = None
+
+class ConsumerError(RuntimeError):
+    """
+    fail_fast 消費者的處理函數拋出錯誤時，由擷取管道在擷取線程中拋出。
+    """
+    pass
+
+class FrameConsumer:
+    def __init__(self, name, handler, queue_size=1, policy="drop_oldest", stats=None, fail_fast=False):
+        """
+        初始化 FrameConsumer。
+
+        擷取管道的一個消費者階段，擁有自己的線程與有界隊列，handler 在消費者線程中處理每一幀。
+        隊列已滿時，"drop_oldest" 丟棄最舊的幀，擷取線程永遠不會等待；"block" 則讓擷取線程
+        等待到有空位為止（不丟幀，用於錄製）。
+
+        參數:
+        name (str): 消費者名稱，耗時以 "consumer_<name>" 記錄。
+        handler (callable): 處理函數，接收 FrameSet。
+        queue_size (int, optional): 隊列長度，1 表示只保留最新一幀。預設為 1。
+        policy (str, optional): 隊列已滿時的策略，"drop_oldest" 或 "block"。預設為 "drop_oldest"。
+        stats (CaptureStats, optional): 若提供，記錄每幀的處理耗時。預設為 None。
+        fail_fast (bool, optional): 為 True 時，handler 第一次拋出錯誤後保存該錯誤並不再處理之後的幀
+            （仍然取出以免 "block" 策略的擷取線程等待），由 CapturePipeline 在擷取線程中拋出；
+            為 False 時只輸出並計數錯誤後繼續（預覽、重疊等盡力而為的消費者）。預設為 False。
+        """
+        if policy not in ("drop_oldest", "block"):
+            raise ValueError(f"Unsupported consumer policy: {policy}")
+        self.name = name
+        self.handler = handler
+        self.policy = policy
+        self.stats = stats
+        self.fail_fast = fail_fast
+        self.error = None
+        self.queue = Queue(maxsize=max(1, queue_size))
+        self.thread = None
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def start(self):
+        """
+        啟動消費者線程。
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name=f"consumer-{self.name}", daemon=True)
+            self.thread.start()
+
+    def submit(self, frame_set):
+        """
+        交出一幀（在擷取線程中調用）。
+
+        參數:
+        frame_set (FrameSet): 幀。
+        """
+        with self.lock:
+            self.submitted += 1
+        if self.policy == "block":
+            self.queue.put(frame_set)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(frame_set)
+                return
+            except Full:
+                try:
+                    self.queue.get_nowait()
+                    with self.lock:
+                        self.dropped += 1
+                except Empty:
+                    pass
+
+    def run(self):
+        """
+        消費者線程的主循環，收到 STOP 後結束（之前排隊的幀都會處理完）。
+        """
+        while True:
+            frame_set = self.queue.get()
+            if frame_set is STOP:
+                break
+            if self.error is not None:
+                with self.lock:
+                    self.dropped += 1
+                continue
+            try:
+                with self.stats.stage(f"consumer_{self.name}", per_frame=False) if self.stats is not None else nullcontext():
+                    self.handler(frame_set)
+                with self.lock:
+                    self.processed += 1
+            except Exception as e:
+                print(f"Error in {self.name} consumer: {e}")
+                with self.lock:
+                    self.errors += 1
+                if self.fail_fast:
+                    self.error = e
+
+    def close(self):
+        """
+        處理完已排隊的幀後停止消費者線程。
+        """
+        if self.thread is None:
+            return
+        self.queue.put(STOP)
+        self.thread.join()
+        self.thread = None
+
+    def get_counters(self):
+        """
+        回傳:
+        dict: 包含 'submitted'、'processed'、'dropped' 與 'errors' 的字典。
+        """
+        with self.lock:
+            return {'submitted': self.submitted, 'processed': self.processed, 'dropped': self.dropped, 'errors': self.errors}
+
+class CapturePipeline:
+    def __init__(self, source, stats=None):
+        """
+        初始化 CapturePipeline。
+
+        擷取 → 對齊（在幀來源中完成，可使用幀來源的工作線程）→ 分發給各消費者。
+        擷取線程只等待幀並將其交給每個消費者的 submit()，寫入、預覽、重疊等工作
+        都在各自的線程中進行，因此緩慢的消費者不會拖慢擷取。
+
+        參數:
+        source (FrameSource): 已啟動的幀來源。
+        stats (CaptureStats, optional): 若提供，記錄 "fan_out" 階段的耗時。預設為 None。
+        """
+        self.source = source
+        self.stats = stats
+        self.consumers = []
+        self.frame_consumers = []
+        self.error_raised = False
+
+    def add_consumer(self, name, submit):
+        """
+        加入一個消費者。
+
+        參數:
+        name (str): 消費者名稱。
+        submit (callable): 在擷取線程中接收 FrameSet 的函數，必須立即返回
+            （例如只保留最新一幀的發佈器）。
+        """
+        self.consumers.append((name, submit))
+
+    def add_frame_consumer(self, consumer):
+        """
+        加入並啟動一個 FrameConsumer，close() 時一併停止。
+
+        參數:
+        consumer (FrameConsumer): 消費者。
+        """
+        consumer.start()
+        self.frame_consumers.append(consumer)
+        self.add_consumer(consumer.name, consumer.submit)
+
+    def run(self, is_running, on_frame=None):
+        """
+        擷取循環，直到 is_running() 為 False；幀來源結束時拋出 EndOfStream，fail_fast 消費者失敗時拋出 ConsumerError。
+
+        參數:
+        is_running (callable): 回傳是否繼續擷取。
+        on_frame (callable, optional): 每幀分發後在擷取線程中調用，接收 FrameSet。預設為 None。
+        """
+        while is_running():
+            frame_set = self.source.wait_for_frames()
+            if frame_set is None:
+                continue
+            with self.stats.stage("fan_out") if self.stats is not None else nullcontext():
+                for _, submit in self.consumers:
+                    submit(frame_set)
+            self.raise_consumer_error()
+            if on_frame is not None:
+                on_frame(frame_set)
+
+    def get_consumer_error(self):
+        """
+        回傳:
+        ConsumerError: 第一個失敗的 fail_fast 消費者的錯誤，沒有則為 None。
+        """
+        for consumer in self.frame_consumers:
+            if consumer.fail_fast and consumer.error is not None:
+                error = ConsumerError(f"{consumer.name} consumer failed: {consumer.error}")
+                error.__cause__ = consumer.error
+                return error
+        return None
+
+    def raise_consumer_error(self):
+        """
+        如果有 fail_fast 消費者失敗，拋出 ConsumerError（只拋出一次）。
+        """
+        error = self.get_consumer_error()
+        if error is not None and not self.error_raised:
+            self.error_raised = True
+            raise error
+
+    def close(self):
+        """
+        停止所有 FrameConsumer（各自處理完已排隊的幀）。不拋出錯誤，處理排隊幀時失敗的
+        fail_fast 消費者由 get_consumer_error() 取得。
+        """
+        for consumer in self.frame_consumers:
+            consumer.close()
+
+    def get_counters(self):
+        """
+        回傳:
+        dict: {消費者名稱: 計數器字典}，只包含 FrameConsumer。
+        """
+        return {consumer.name: consumer.get_counters() for consumer in self.frame_consumers}
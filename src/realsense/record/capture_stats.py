@@ -0,0 +1,265 @@
+import bisect
+import csv
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 直方圖的桶上界（毫秒），最後一個桶收集所有更大的值
+HISTOGRAM_EDGES_MS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+# 逐幀記錄只保留最近的幀（30 fps 約 10 分鐘），長時間錄製時記憶體保持穩定
+TRACE_HISTORY = 18000
+
+class StageHistogram:
+    def __init__(self):
+        """
+        初始化 StageHistogram，以固定的對數間隔桶記錄單一階段的耗時分佈。
+        """
+        self.counts = [0] * (len(HISTOGRAM_EDGES_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, value_ms):
+        """
+        記錄一次耗時。
+
+        參數:
+        value_ms (float): 耗時（毫秒）。
+        """
+        self.counts[bisect.bisect_left(HISTOGRAM_EDGES_MS, value_ms)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        if value_ms > self.max_ms:
+            self.max_ms = value_ms
+
+    def percentile(self, fraction):
+        """
+        以桶上界估計百分位數。
+
+        參數:
+        fraction (float): 百分位 (0~1)。
+
+        回傳:
+        float: 估計的耗時（毫秒）。
+        """
+        if self.count == 0:
+            return 0.0
+        target = fraction * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            cumulative += n
+            if cumulative >= target:
+                return min(HISTOGRAM_EDGES_MS[i], self.max_ms) if i < len(HISTOGRAM_EDGES_MS) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self):
+        """
+        回傳:
+        dict: 統計數據與直方圖。
+        """
+        labels = [f"<={edge}ms" for edge in HISTOGRAM_EDGES_MS] + [f">{HISTOGRAM_EDGES_MS[-1]}ms"]
+        return {
+            'count': self.count,
+            'mean_ms': self.total_ms / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': self.max_ms,
+            'histogram': dict(zip(labels, self.counts))
+        }
+
+class CaptureStats:
+    def __init__(self, expected_fps=30, report_interval=5.0, trace=False, trace_limit=TRACE_HISTORY):
+        """
+        初始化 CaptureStats。
+
+        記錄擷取循環中每個階段的耗時直方圖、有效幀率，並根據 RealSense 的幀編號與時間戳
+        偵測丟失與延遲的幀。可從多個線程調用。
+
+        參數:
+        expected_fps (float, optional): 預期幀率，用於判斷延遲幀。預設為 30。
+        report_interval (float, optional): 定期摘要的間隔秒數，0 表示不輸出摘要。預設為 5.0。
+        trace (bool, optional): 是否保存逐幀記錄以供離線分析。預設為 False。
+        trace_limit (int, optional): 逐幀記錄保留的最大幀數，超出時捨棄最早的記錄。預設為 TRACE_HISTORY。
+        """
+        self.expected_fps = expected_fps
+        self.expected_interval_ms = 1000.0 / expected_fps if expected_fps else 0.0
+        self.report_interval = report_interval
+        self.trace = trace
+        self.trace_limit = max(1, trace_limit)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        清除所有統計數據。
+        """
+        with self.lock:
+            self.stages = {}
+            self.frames = 0
+            self.dropped_frames = 0
+            self.late_frames = 0
+            self.last_frame_number = None
+            self.last_timestamp = None
+            self.start_time = None
+            self.last_time = None
+            self.window_start = time.perf_counter()
+            self.window_frames = 0
+            self.trace_rows = deque(maxlen=self.trace_limit)
+            self.trace_discarded = 0
+            self.current_row = {}
+
+    def add_timing(self, stage, seconds, per_frame=True):
+        """
+        記錄某一階段的耗時。
+
+        參數:
+        stage (str): 階段名稱。
+        seconds (float): 耗時（秒）。
+        per_frame (bool, optional): 是否屬於擷取線程的逐幀階段（寫入逐幀記錄）。
+            其他線程（編碼、預覽發佈）記錄的階段應設為 False。預設為 True。
+        """
+        value_ms = seconds * 1000.0
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = StageHistogram()
+                self.stages[stage] = histogram
+            histogram.add(value_ms)
+            if self.trace and per_frame:
+                self.current_row[stage] = value_ms
+
+    @contextmanager
+    def stage(self, stage, per_frame=True):
+        """
+        以 with 區塊計時某一階段。
+
+        參數:
+        stage (str): 階段名稱。
+        per_frame (bool, optional): 見 add_timing()。預設為 True。
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(stage, time.perf_counter() - start, per_frame)
+
+    def frame(self, frame_number, timestamp_ms):
+        """
+        記錄一個已擷取的幀，並根據幀編號與時間戳判斷丟幀與延遲。
+        時間戳間隔過大但幀編號顯示中間有丟幀時只計為丟幀，不再重複計為延遲。
+
+        參數:
+        frame_number (int): RealSense 幀編號。
+        timestamp_ms (float): RealSense 幀時間戳（毫秒）。
+        """
+        now = time.perf_counter()
+        with self.lock:
+            if self.start_time is None:
+                self.start_time = now
+            self.last_time = now
+            self.frames += 1
+            self.window_frames += 1
+
+            late = False
+            dropped = 0
+            if self.last_frame_number is not None and frame_number > self.last_frame_number + 1:
+                dropped = frame_number - self.last_frame_number - 1
+                self.dropped_frames += dropped
+            if self.last_timestamp is not None and self.expected_interval_ms:
+                if dropped == 0 and timestamp_ms - self.last_timestamp > 1.5 * self.expected_interval_ms:
+                    late = True
+                    self.late_frames += 1
+            self.last_frame_number = frame_number
+            self.last_timestamp = timestamp_ms
+
+            if self.trace:
+                row = {'frame_number': frame_number, 'timestamp_ms': timestamp_ms, 'dropped': dropped, 'late': int(late)}
+                row.update(self.current_row)
+                if len(self.trace_rows) == self.trace_limit:
+                    self.trace_discarded += 1
+                self.trace_rows.append(row)
+                self.current_row = {}
+
+    def get_stats(self):
+        """
+        獲取目前的統計數據。
+
+        回傳:
+        dict: 包含幀數、有效幀率、丟幀與延遲幀數以及各階段的統計。
+        """
+        with self.lock:
+            elapsed = (self.last_time - self.start_time) if self.frames > 1 else 0.0
+            return {
+                'frames': self.frames,
+                'elapsed_s': elapsed,
+                'fps': (self.frames - 1) / elapsed if elapsed > 0 else 0.0,
+                'expected_fps': self.expected_fps,
+                'dropped_frames': self.dropped_frames,
+                'late_frames': self.late_frames,
+                'stages': {name: histogram.to_dict() for name, histogram in self.stages.items()}
+            }
+
+    def summary_due(self):
+        """
+        回傳:
+        bool: 是否已到輸出定期摘要的時間。
+        """
+        return self.report_interval > 0 and time.perf_counter() - self.window_start >= self.report_interval
+
+    def summary(self):
+        """
+        生成一行摘要文字並開始新的統計窗口。
+
+        回傳:
+        str: 摘要文字。
+        """
+        stats = self.get_stats()
+        with self.lock:
+            now = time.perf_counter()
+            window = now - self.window_start
+            recent_fps = self.window_frames / window if window > 0 else 0.0
+            self.window_start = now
+            self.window_frames = 0
+        stages = ", ".join(
+            f"{name} {stage['mean_ms']:.1f}/{stage['p95_ms']:.1f}ms"
+            for name, stage in stats['stages'].items())
+        return (f"{stats['frames']} frames, {recent_fps:.1f} fps (avg {stats['fps']:.1f}), "
+                f"dropped {stats['dropped_frames']}, late {stats['late_frames']} | mean/p95: {stages}")
+
+    def dump(self, path):
+        """
+        將統計數據寫入 JSON 或 CSV 文件（依副檔名決定）。
+
+        JSON 包含完整統計（啟用 trace 時附帶最近 trace_limit 幀的逐幀記錄與被捨棄的幀數）；
+        CSV 在啟用 trace 時為逐幀記錄，否則為每個階段一行的統計。
+
+        參數:
+        path (str): 輸出文件路徑。
+        """
+        stats = self.get_stats()
+        with self.lock:
+            rows = list(self.trace_rows)
+            discarded = self.trace_discarded
+        if path.endswith(".json"):
+            if self.trace:
+                stats['trace'] = rows
+                stats['trace_discarded'] = discarded
+            with open(path, 'w') as outfile:
+                json.dump(stats, outfile, indent=4)
+        elif path.endswith(".csv"):
+            with open(path, 'w', newline='') as outfile:
+                if self.trace:
+                    fields = ['frame_number', 'timestamp_ms', 'dropped', 'late']
+                    fields += sorted({stage for row in rows for stage in row} - set(fields))
+                    writer = csv.DictWriter(outfile, fieldnames=fields)
+                    writer.writeheader()
+                    writer.writerows(rows)
+                else:
+                    writer = csv.writer(outfile)
+                    writer.writerow(['stage', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms'])
+                    for name, stage in stats['stages'].items():
+                        writer.writerow([name, stage['count'], stage['mean_ms'], stage['p50_ms'], stage['p95_ms'], stage['max_ms']])
+        else:
+            raise ValueError(f"Unsupported stats dump format: {path}")
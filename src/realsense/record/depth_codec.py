@@ -0,0 +1,369 @@
+import struct
+import threading
+import time
+import zlib
+from os.path import splitext
+import numpy as np
+import cv2
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 深度編碼方式；在 RGBD 容器中圖像形狀由容器標頭提供
+DEPTH_CODECS = ("raw", "zlib", "zstd", "rvl", "png")
+# 每幀一個文件時可用的深度編碼方式與副檔名（zlib 為沒有 zstandard 時 zstd 的替代）
+DEPTH_FILE_EXTENSIONS = {"png": ".png", "rvl": ".rvl", "zstd": ".zst", "zlib": ".zlib"}
+# 非 PNG 深度文件的標頭：編碼標記、寬度、高度
+FILE_HEADER = struct.Struct("<4sII")
+FILE_MAGIC = {"rvl": b"RVL1", "zstd": b"ZST1", "zlib": b"ZLB1"}
+# RVL 數據的標頭：遊程數量、遊程數據的位元組數
+RVL_HEADER = struct.Struct("<II")
+ZSTD_LEVEL = 1
+ZLIB_LEVEL = 1
+
+_zstd_warning = threading.Event()
+
+def resolve_depth_codec(codec):
+    """
+    檢查深度編碼方式，沒有安裝 zstandard 時 zstd 退回 zlib。
+
+    參數:
+    codec (str): 深度編碼方式。
+
+    回傳:
+    str: 實際使用的編碼方式。
+    """
+    if codec not in DEPTH_CODECS:
+        raise ValueError(f"Unsupported depth codec: {codec}")
+    if codec == "zstd" and zstandard is None:
+        if not _zstd_warning.is_set():
+            _zstd_warning.set()
+            print("zstandard is not installed, depth frames are compressed with zlib instead")
+        return "zlib"
+    return codec
+
+def encode_varints(values):
+    """
+    以 4 位元為單位的變長碼編碼非負整數：每個 4 位元塊含 3 位數據與 1 位延續標記，
+    兩個塊組成一個位元組。逐層（第 k 個塊）向量化處理。
+
+    參數:
+    values (np.ndarray): 非負整數。
+
+    回傳:
+    bytes: 編碼後的數據。
+    """
+    values = np.asarray(values, dtype=np.uint32)
+    if len(values) == 0:
+        return b""
+    # frexp 的指數即為整數的位元長度（0 為 0）
+    _, bits = np.frexp(values)
+    lengths = np.maximum(1, (bits + 2) // 3)
+    ends = np.cumsum(lengths, dtype=np.int32)
+    positions = ends - lengths
+    total = int(ends[-1])
+    nibbles = np.zeros(total + total % 2, dtype=np.uint8)
+    more = lengths > 1
+    nibbles[positions] = (values & 7).astype(np.uint8) | (more.view(np.uint8) << 3)
+    # 多數整數只有 1–2 個塊，之後的層只處理仍有剩餘位元的整數
+    index = np.flatnonzero(more)
+    level = 1
+    while len(index):
+        more = lengths[index] > level + 1
+        nibbles[positions[index] + level] = ((values[index] >> np.uint32(3 * level)) & 7).astype(np.uint8) | (more.view(np.uint8) << 3)
+        index = index[more]
+        level += 1
+    return (nibbles[0::2] | (nibbles[1::2] << 4)).tobytes()
+
+def decode_varints(buffer, count):
+    """
+    解碼 encode_varints() 的數據。
+
+    參數:
+    buffer (buffer-like): 編碼後的數據。
+    count (int): 整數的數量。
+
+    回傳:
+    np.ndarray: uint32 整數。
+    """
+    if count == 0:
+        return np.zeros(0, dtype=np.uint32)
+    packed = np.frombuffer(buffer, dtype=np.uint8)
+    nibbles = np.empty(2 * len(packed), dtype=np.uint8)
+    nibbles[0::2] = packed & 15
+    nibbles[1::2] = packed >> 4
+    ends = np.flatnonzero(nibbles < 8)[:count]
+    if len(ends) < count:
+        raise ValueError("Truncated varint data")
+    starts = np.empty(count, dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    values = (nibbles[starts] & 7).astype(np.uint32)
+    # 只有少數整數超過一個塊，逐層累加剩餘的塊
+    index = np.flatnonzero(ends > starts)
+    shift = 3
+    while len(index):
+        positions = starts[index] + shift // 3
+        values[index] |= (nibbles[positions] & 7).astype(np.uint32) << np.uint32(shift)
+        index = index[positions < ends[index]]
+        shift += 3
+    return values
+
+def encode_rvl(depth_image):
+    """
+    RVL 風格的無損深度編碼：零值以遊程長度表示，非零值以與前一個非零值的差
+    （zigzag 映射為非負數）表示，兩者都以 4 位元變長碼儲存。
+    與原始 RVL 逐像素交錯不同，遊程與差值分成兩段儲存，以便向量化編碼與解碼。
+
+    參數:
+    depth_image (np.ndarray): uint16 深度圖像。
+
+    回傳:
+    bytes: 編碼後的數據。
+    """
+    flat = np.ascontiguousarray(depth_image).ravel()
+    valid = flat != 0
+    boundaries = np.flatnonzero(valid[1:] != valid[:-1]) + 1
+    runs = np.diff(np.concatenate(([0], boundaries, [len(flat)])))
+    # 遊程從零值開始交替，第一個像素為非零時補一個長度為 0 的零值遊程
+    if len(flat) and valid[0]:
+        runs = np.concatenate(([0], runs))
+    deltas = np.diff(flat[valid].astype(np.int32), prepend=np.int32(0))
+    zigzag = ((deltas << 1) ^ (deltas >> 31)).view(np.uint32)
+    run_bytes = encode_varints(runs)
+    return RVL_HEADER.pack(len(runs), len(run_bytes)) + run_bytes + encode_varints(zigzag)
+
+def decode_rvl(buffer, shape):
+    """
+    解碼 encode_rvl() 的數據。
+
+    參數:
+    buffer (buffer-like): 編碼後的數據。
+    shape (tuple): 深度圖像形狀 (height, width)。
+
+    回傳:
+    np.ndarray: uint16 深度圖像。
+    """
+    buffer = memoryview(buffer).cast("B")
+    run_count, run_size = RVL_HEADER.unpack_from(buffer)
+    offset = RVL_HEADER.size
+    runs = decode_varints(buffer[offset:offset + run_size], run_count).astype(np.int64)
+    if runs.sum() != shape[0] * shape[1]:
+        raise ValueError(f"RVL data does not match the image shape {shape}")
+    valid = np.repeat(np.arange(run_count) % 2 == 1, runs)
+    zigzag = decode_varints(buffer[offset + run_size:], int(runs[1::2].sum())).astype(np.int32)
+    deltas = (zigzag >> 1) ^ -(zigzag & 1)
+    depth_image = np.zeros(shape[0] * shape[1], dtype=np.uint16)
+    depth_image[valid] = np.cumsum(deltas)
+    return depth_image.reshape(shape)
+
+def encode_depth(depth_image, codec):
+    """
+    將深度圖像編碼為位元組（不含形狀）。
+
+    參數:
+    depth_image (np.ndarray): uint16 深度圖像。
+    codec (str): 深度編碼方式，見 DEPTH_CODECS。
+
+    回傳:
+    bytes: 編碼後的數據。
+    """
+    data = np.ascontiguousarray(depth_image, dtype='<u2')
+    if codec == "raw":
+        return data.tobytes()
+    if codec == "zlib":
+        return zlib.compress(data.tobytes(), ZLIB_LEVEL)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd depth codec requires the zstandard package")
+        # ZstdCompressor 不能在線程間共用，每次建立的成本很低
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data.tobytes())
+    if codec == "rvl":
+        return encode_rvl(data)
+    if codec == "png":
+        success, encoded = cv2.imencode(".png", data)
+        if not success:
+            raise RuntimeError("Failed to encode depth image")
+        return encoded.tobytes()
+    raise ValueError(f"Unsupported depth codec: {codec}")
+
+def decode_depth(buffer, codec, shape):
+    """
+    將位元組解碼為深度圖像。
+
+    參數:
+    buffer (buffer-like): 編碼後的數據。
+    codec (str): 深度編碼方式，見 DEPTH_CODECS。
+    shape (tuple): 深度圖像形狀 (height, width)。
+
+    回傳:
+    np.ndarray: uint16 深度圖像。raw 編碼時為緩衝區的唯讀視圖。
+    """
+    if codec == "raw":
+        return np.frombuffer(buffer, dtype='<u2').reshape(shape)
+    if codec == "zlib":
+        return np.frombuffer(zlib.decompress(buffer), dtype='<u2').reshape(shape)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd depth codec requires the zstandard package")
+        data = zstandard.ZstdDecompressor().decompress(buffer, max_output_size=shape[0] * shape[1] * 2)
+        return np.frombuffer(data, dtype='<u2').reshape(shape)
+    if codec == "rvl":
+        return decode_rvl(buffer, shape)
+    if codec == "png":
+        return cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    raise ValueError(f"Unsupported depth codec: {codec}")
+
+def is_depth_file(filename):
+    """
+    回傳:
+    bool: 文件是否為 write_depth_file() 可寫出的深度文件（依副檔名判斷）。
+    """
+    return splitext(filename)[1] in DEPTH_FILE_EXTENSIONS.values()
+
+def write_depth_file(path_depth, frame_id, depth_image, codec="png"):
+    """
+    將深度圖像寫成單獨的文件，PNG 以外的文件帶有編碼標記與圖像尺寸的標頭。
+
+    參數:
+    path_depth (str): 深度圖像資料夾。
+    frame_id (int): 幀編號。
+    depth_image (np.ndarray): uint16 深度圖像。
+    codec (str, optional): "png"、"rvl"、"zstd" 或 "zlib"。預設為 "png"。
+
+    回傳:
+    str: 寫入的文件路徑。
+    """
+    filename = f"{path_depth}/{frame_id:06d}{DEPTH_FILE_EXTENSIONS[codec]}"
+    if codec == "png":
+        cv2.imwrite(filename, depth_image)
+        return filename
+    height, width = depth_image.shape[:2]
+    with open(filename, "wb") as f:
+        f.write(FILE_HEADER.pack(FILE_MAGIC[codec], width, height))
+        f.write(encode_depth(depth_image, codec))
+    return filename
+
+def read_depth_file(filename):
+    """
+    讀取 write_depth_file() 寫出的深度文件。
+
+    參數:
+    filename (str): 文件路徑。
+
+    回傳:
+    np.ndarray: uint16 深度圖像。
+    """
+    if splitext(filename)[1] == ".png":
+        return cv2.imread(filename, cv2.IMREAD_UNCHANGED)
+    with open(filename, "rb") as f:
+        data = f.read()
+    magic, width, height = FILE_HEADER.unpack_from(data)
+    for codec, codec_magic in FILE_MAGIC.items():
+        if magic == codec_magic:
+            return decode_depth(memoryview(data)[FILE_HEADER.size:], codec, (height, width))
+    raise ValueError(f"Unknown depth file format: {filename}")
+
+def benchmark(depth_images, codecs=None, repeat=3):
+    """
+    比較各深度編碼方式的編碼與解碼吞吐量及壓縮後大小，並檢查是否無損。
+
+    參數:
+    depth_images (list): uint16 深度圖像。
+    codecs (list, optional): 要比較的編碼方式，None 表示所有可用的方式。預設為 None。
+    repeat (int, optional): 重複次數，取最快的一次。預設為 3。
+
+    回傳:
+    list: 每種編碼方式一個字典，包含 'codec'、'encode_ms'、'decode_ms'、'ratio' 與 'lossless'。
+    """
+    if codecs is None:
+        codecs = [codec for codec in DEPTH_CODECS if codec != "zstd" or zstandard is not None]
+    raw_size = sum(image.nbytes for image in depth_images)
+    results = []
+    for codec in codecs:
+        encode_time = decode_time = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            encoded = [encode_depth(image, codec) for image in depth_images]
+            encode_time = min(encode_time, time.perf_counter() - start)
+            start = time.perf_counter()
+            decoded = [decode_depth(buffer, codec, image.shape) for buffer, image in zip(encoded, depth_images)]
+            decode_time = min(decode_time, time.perf_counter() - start)
+        results.append({
+            'codec': codec,
+            'encode_ms': 1000 * encode_time / len(depth_images),
+            'decode_ms': 1000 * decode_time / len(depth_images),
+            'ratio': raw_size / sum(len(buffer) for buffer in encoded),
+            'lossless': all(np.array_equal(a, b) for a, b in zip(decoded, depth_images))
+        })
+    return results
+
+def synthetic_depth(width=640, height=480, frames=10):
+    """
+    生成帶有噪聲與無效區域的合成深度圖像，沒有錄製數據時用於基準測試。
+
+    回傳:
+    list: uint16 深度圖像。
+    """
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    images = []
+    for i in range(frames):
+        surface = 1500 + 400 * np.sin((x + 4 * i) / 90.0) + 300 * np.cos(y / 70.0)
+        depth = surface + rng.normal(0, 3, surface.shape)
+        depth[rng.random(surface.shape) < 0.03] = 0
+        depth[:, :width // 16] = 0
+        images.append(depth.astype(np.uint16))
+    return images
+
+def load_depth_frames(path_dataset, frames):
+    """
+    讀取已錄製的深度圖像（depth/ 資料夾或 RGBD 容器），不需要 pyrealsense2。
+
+    參數:
+    path_dataset (str): 錄製輸出資料夾。
+    frames (int): 最多讀取的幀數。
+
+    回傳:
+    list: uint16 深度圖像。
+    """
+    from os import listdir
+    from os.path import join
+    # rgbd_container 匯入本模組，在函數內匯入以免循環匯入
+    from rgbd_container import is_rgbd_container, RGBDChunkReader
+    if is_rgbd_container(path_dataset):
+        reader = RGBDChunkReader(path_dataset)
+        return [np.array(reader.read_depth(i)) for i in range(min(frames, len(reader)))]
+    path_depth = join(path_dataset, "depth")
+    files = sorted(join(path_depth, f) for f in listdir(path_depth) if is_depth_file(f))
+    if not files:
+        raise ValueError(f"No depth images found in {path_depth}")
+    return [read_depth_file(path) for path in files[:frames]]
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    from os.path import dirname, abspath
+    sys.path.append(dirname(abspath(__file__)))
+
+    parser = argparse.ArgumentParser(description="Compare depth codecs on recorded or synthetic frames")
+    parser.add_argument("--dataset", type=str, help="recorded folder (depth/ or rgbd_chunks/), synthetic frames if omitted")
+    parser.add_argument("--frames", type=int, default=30, help="number of frames to compare")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--codecs", type=str, nargs="+", choices=DEPTH_CODECS)
+    args = parser.parse_args()
+
+    if args.dataset:
+        images = load_depth_frames(args.dataset, args.frames)
+    else:
+        images = synthetic_depth(frames=args.frames)
+    height, width = images[0].shape
+    print(f"{len(images)} depth frames, {width}x{height}")
+    print(f"{'codec':<6} {'encode ms':>10} {'decode ms':>10} {'encode MB/s':>12} {'decode MB/s':>12} {'ratio':>6}  lossless")
+    frame_mb = images[0].nbytes / 1e6
+    for result in benchmark(images, args.codecs, args.repeat):
+        print(f"{result['codec']:<6} {result['encode_ms']:10.2f} {result['decode_ms']:10.2f} "
+              f"{frame_mb / result['encode_ms'] * 1000:12.1f} {frame_mb / result['decode_ms'] * 1000:12.1f} "
+              f"{result['ratio']:6.2f}  {result['lossless']}")
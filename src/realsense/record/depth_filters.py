@@ -0,0 +1,124 @@
+import json
+from contextlib import nullcontext
+import pyrealsense2 as rs
+
+# 依照 Intel 建議的順序套用：抽取 → (視差域) 空間 → 時間 → (深度域) 填洞
+FILTER_ORDER = ("decimation", "spatial", "temporal", "hole_filling")
+
+# 每個濾波器的選項名稱為 rs.option 的屬性名稱；省略或設為 false 的濾波器不啟用
+DEFAULT_FILTER_SETTINGS = {
+    "decimation": {"filter_magnitude": 2},
+    "spatial": {"filter_magnitude": 2, "filter_smooth_alpha": 0.5, "filter_smooth_delta": 20, "holes_fill": 0},
+    "temporal": {"filter_smooth_alpha": 0.4, "filter_smooth_delta": 20, "holes_fill": 3},
+    "hole_filling": {"holes_fill": 1},
+    "disparity": True
+}
+
+def load_filter_settings(settings):
+    """
+    讀取濾波器設定。
+
+    參數:
+    settings (dict 或 str): 設定字典，或包含設定字典的 JSON 文件路徑。
+
+    回傳:
+    dict: 設定字典。
+    """
+    if isinstance(settings, str):
+        with open(settings, "r") as f:
+            settings = json.load(f)
+    unknown = set(settings) - set(FILTER_ORDER) - {"disparity"}
+    if unknown:
+        raise ValueError(f"Unknown depth filters: {sorted(unknown)}")
+    return settings
+
+def create_filter(name, options):
+    """
+    建立一個 librealsense 後處理濾波器並設置選項。
+
+    參數:
+    name (str): 濾波器名稱，見 FILTER_ORDER。
+    options (dict): {rs.option 屬性名稱: 值}。
+
+    回傳:
+    rs.filter: 濾波器。
+    """
+    if name == "decimation":
+        block = rs.decimation_filter()
+    elif name == "spatial":
+        block = rs.spatial_filter()
+    elif name == "temporal":
+        block = rs.temporal_filter()
+    elif name == "hole_filling":
+        block = rs.hole_filling_filter()
+    else:
+        raise ValueError(f"Unknown depth filter: {name}")
+    for option, value in options.items():
+        block.set_option(getattr(rs.option, option), value)
+    return block
+
+class DepthFilterChain:
+    def __init__(self, settings):
+        """
+        初始化 DepthFilterChain。
+
+        在對齊之前對深度流依序套用抽取、空間、時間與填洞濾波器，空間與時間濾波在視差域進行。
+        濾波器作用於整個幀組，顏色幀保持不變。
+
+        參數:
+        settings (dict 或 str): 設定字典或 JSON 文件路徑，格式見 DEFAULT_FILTER_SETTINGS。
+        """
+        settings = load_filter_settings(settings)
+        self.filters = []
+        self.decimation_magnitude = 1
+        for name in FILTER_ORDER:
+            options = settings.get(name)
+            if options is False or options is None:
+                continue
+            if not isinstance(options, dict):
+                options = {}
+            if name == "decimation":
+                # librealsense 的預設抽取倍數為 2
+                self.decimation_magnitude = int(options.get("filter_magnitude", 2))
+            self.filters.append((name, create_filter(name, options)))
+
+        names = [name for name, _ in self.filters]
+
+        # 空間與時間濾波在視差域中效果較好
+        if settings.get("disparity", True) and ("spatial" in names or "temporal" in names):
+            first = min(names.index(name) for name in ("spatial", "temporal") if name in names)
+            last = max(names.index(name) for name in ("spatial", "temporal") if name in names)
+            self.filters.insert(last + 1, ("to_depth", rs.disparity_transform(False)))
+            self.filters.insert(first, ("to_disparity", rs.disparity_transform(True)))
+
+    @property
+    def decimates(self):
+        """
+        回傳:
+        bool: 是否降低深度解析度。
+        """
+        return self.decimation_magnitude > 1
+
+    @property
+    def names(self):
+        """
+        回傳:
+        list: 依套用順序排列的濾波器名稱。
+        """
+        return [name for name, _ in self.filters]
+
+    def process(self, frames, stage=None):
+        """
+        對幀組套用濾波器鏈。
+
+        參數:
+        frames (rs.composite_frame): 管道回傳的幀組。
+        stage (callable, optional): stage(name) 回傳計時用的 contextmanager，每個濾波器以 "filter_<name>" 計時。預設為 None。
+
+        回傳:
+        rs.composite_frame: 深度已濾波的幀組。
+        """
+        for name, block in self.filters:
+            with stage(f"filter_{name}") if stage is not None else nullcontext():
+                frames = block.process(frames)
+        return frames.as_frameset()
@@ -0,0 +1,108 @@
+import time
+import numpy as np
+
+class DepthBackProjector:
+    def __init__(self, intrinsics_dict, depth_image_shape, depth_scale=0.001, stride=1, flip=True):
+        """
+        初始化 DepthBackProjector。
+
+        內參在整個錄製期間固定，因此每個像素的射線方向只在初始化時計算一次；
+        每幀只需選出有效像素並乘上深度，輸出 float32 點並寫入重複使用的緩衝區。
+
+        參數:
+        intrinsics_dict (dict): 相機內參字典，包含 'fx', 'fy', 'ppx', 'ppy'。
+        depth_image_shape (tuple): 深度圖像的形狀 (height, width)。
+        depth_scale (float, optional): 深度單位（米）。預設為 0.001。
+        stride (int, optional): 像素取樣間隔，2 表示每隔一行一列取樣。預設為 1。
+        flip (bool, optional): 是否翻轉 x 和 y 軸（與原本的點雲方向一致）。預設為 True。
+        """
+        self.depth_image_shape = tuple(depth_image_shape)
+        self.depth_scale = np.float32(depth_scale)
+        self.stride = max(1, int(stride))
+
+        fx, fy = intrinsics_dict['fx'], intrinsics_dict['fy']
+        cx, cy = intrinsics_dict['ppx'], intrinsics_dict['ppy']
+        height, width = self.depth_image_shape
+        sign = -1.0 if flip else 1.0
+        u = np.arange(0, width, self.stride, dtype=np.float64)
+        v = np.arange(0, height, self.stride, dtype=np.float64)
+        # 每個取樣像素在 z = 1 平面上的 x、y 座標
+        ray_x = (sign * (u - cx) / fx).astype(np.float32)
+        ray_y = (sign * (v - cy) / fy).astype(np.float32)
+        self.ray_x = np.broadcast_to(ray_x, (len(v), len(u))).ravel()
+        self.ray_y = np.broadcast_to(ray_y[:, None], (len(v), len(u))).ravel()
+
+        self.buffer = np.empty((len(self.ray_x), 3), dtype=np.float32)
+        self.valid = np.empty(len(self.ray_x), dtype=bool)
+
+    def project(self, depth_image, out=None):
+        """
+        將深度圖像轉換為點雲，只輸出深度有效（非零）的像素。
+
+        參數:
+        depth_image (np.ndarray): uint16 深度圖像數組。
+        out (np.ndarray, optional): (N, 3) float32 輸出緩衝區，None 表示使用內部緩衝區。預設為 None。
+
+        回傳:
+        np.ndarray: (n, 3) float32 點雲，為輸出緩衝區的前 n 行；下一次調用會覆寫內部緩衝區，
+        需要保留時請自行複製。
+        """
+        if depth_image.shape != self.depth_image_shape:
+            raise ValueError(f"Depth image shape {depth_image.shape} does not match {self.depth_image_shape}")
+        if out is None:
+            out = self.buffer
+
+        depth = depth_image[::self.stride, ::self.stride].ravel()
+        valid = np.not_equal(depth, 0, out=self.valid)
+        n = np.count_nonzero(valid)
+        points = out[:n]
+        z = points[:, 2]
+        np.multiply(np.compress(valid, depth), self.depth_scale, out=z, casting='unsafe')
+        np.multiply(np.compress(valid, self.ray_x), z, out=points[:, 0])
+        np.multiply(np.compress(valid, self.ray_y), z, out=points[:, 1])
+        return points
+
+def legacy_convert_depth_to_pointcloud(depth_image, intrinsics_dict):
+    """
+    原本的轉換方式（每幀建立 meshgrid，float64，包含無效像素），用於比較。
+
+    參數:
+    depth_image (np.ndarray): 深度圖像數組。
+    intrinsics_dict (dict): 相機內參字典。
+
+    回傳:
+    np.ndarray: 點雲數據。
+    """
+    fx, fy = intrinsics_dict['fx'], intrinsics_dict['fy']
+    cx, cy = intrinsics_dict['ppx'], intrinsics_dict['ppy']
+    height, width = depth_image.shape
+    x, y = np.meshgrid(np.arange(width), np.arange(height))
+    z = depth_image / 1000.0
+    x = -((x - cx) * z / fx)
+    y = -((y - cy) * z / fy)
+    return np.stack((x, y, z), axis=-1).reshape(-1, 3)
+
+if __name__ == "__main__":
+    # 以隨機數據比較原本的轉換方式與快取射線方式的每幀耗時
+    height, width, n_frames = 720, 1280, 50
+    intrinsics = {'fx': 910.0, 'fy': 910.0, 'ppx': 640.0, 'ppy': 360.0}
+    rng = np.random.default_rng(0)
+    depth = rng.integers(300, 4000, size=(height, width), dtype=np.uint16)
+    depth[rng.random((height, width)) < 0.2] = 0
+
+    start = time.perf_counter()
+    for _ in range(n_frames):
+        expected = legacy_convert_depth_to_pointcloud(depth, intrinsics)
+    legacy_ms = 1000.0 * (time.perf_counter() - start) / n_frames
+
+    print(f"{width}x{height}, {n_frames} frames")
+    print(f"legacy     : {legacy_ms:.2f} ms/frame")
+    for stride in (1, 2):
+        projector = DepthBackProjector(intrinsics, (height, width), stride=stride)
+        start = time.perf_counter()
+        for _ in range(n_frames):
+            points = projector.project(depth)
+        elapsed_ms = 1000.0 * (time.perf_counter() - start) / n_frames
+        if stride == 1:
+            assert np.allclose(points, expected[depth.ravel() > 0], atol=1e-4)
+        print(f"stride {stride}   : {elapsed_ms:.2f} ms/frame ({len(points)} points)")
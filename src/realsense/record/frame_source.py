@@ -0,0 +1,526 @@
+import json
+import threading
+import time
+from contextlib import nullcontext
+from os import listdir
+from os.path import join, splitext, exists
+import numpy as np
+import cv2
+import pyrealsense2 as rs
+from queue import Queue, Empty, Full
+from rgbd_container import RGBDChunkReader, is_rgbd_container
+from depth_codec import DEPTH_FILE_EXTENSIONS, read_depth_file
+from depth_filters import DepthFilterChain
+
+class EndOfStream(Exception):
+    """
+    幀來源已沒有更多幀時拋出。
+    """
+    pass
+
+class FrameSet:
+    __slots__ = ("depth_image", "color_image", "frame_number", "timestamp", "rotation")
+
+    def __init__(self, depth_image, color_image, frame_number, timestamp, rotation=None):
+        """
+        一組已對齊到顏色流的深度與顏色幀。
+
+        參數:
+        depth_image (np.ndarray): uint16 深度圖像 (h, w)。
+        color_image (np.ndarray): 顏色圖像 (h, w, 3)。
+        frame_number (int): 幀編號。
+        timestamp (float): 時間戳（毫秒）。
+        rotation (float, optional): 自上一組幀以來陀螺儀積分的旋轉角度（度），沒有 IMU 時為 None。預設為 None。
+        """
+        self.depth_image = depth_image
+        self.color_image = color_image
+        self.frame_number = frame_number
+        self.timestamp = timestamp
+        self.rotation = rotation
+
+class FrameSource:
+    """
+    幀來源的基底類別。
+
+    RealSenseRecorder 只透過 start()、wait_for_frames()、stop() 取得幀，
+    start() 之後 intrinsics (dict) 與 depth_scale 必須可用。
+
+    屬性:
+    intrinsics (dict): 包含 'width'、'height'、'fx'、'fy'、'ppx'、'ppy' 的內參字典。
+    depth_scale (float): 深度比例（米/深度單位）。
+    stats (CaptureStats): 若設定，記錄 "wait" 與 "align" 階段的耗時。
+    """
+
+    def __init__(self):
+        self.intrinsics = None
+        self.depth_scale = 0.001
+        self.stats = None
+
+    def stage(self, name, per_frame=True):
+        """
+        回傳:
+        contextmanager: 在設定了 stats 時計時該階段，否則不做任何事。
+        per_frame 見 CaptureStats.add_timing()。
+        """
+        return self.stats.stage(name, per_frame) if self.stats is not None else nullcontext()
+
+    @property
+    def intrinsic_matrix(self):
+        """
+        回傳:
+        list: 以列優先排列的 3x3 內參矩陣，與 camera_intrinsic.json 的格式一致。
+        """
+        i = self.intrinsics
+        return [i['fx'], 0, 0, 0, i['fy'], 0, i['ppx'], i['ppy'], 1]
+
+    def save_intrinsic_as_json(self, filename):
+        """
+        保存相機內參到 JSON 文件。
+
+        參數:
+        filename (str): 文件名。
+        """
+        with open(filename, 'w') as outfile:
+            json.dump(
+                {'width': self.intrinsics['width'], 'height': self.intrinsics['height'],
+                 'intrinsic_matrix': self.intrinsic_matrix},
+                outfile, indent=4)
+
+    def start(self):
+        raise NotImplementedError
+
+    def wait_for_frames(self):
+        """
+        等待下一組幀。
+
+        回傳:
+        FrameSet: 下一組幀；本次沒有有效幀時回傳 None。
+
+        拋出:
+        EndOfStream: 來源已結束。
+        """
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+class RealSenseSource(FrameSource):
+    def __init__(self, pipeline, config, visual_preset=None, sensor_options=None, real_time=True, bgr_output=False, use_imu=False,
+                 depth_filters=None, filter_thread=False, filter_queue_size=2):
+        """
+        初始化 RealSenseSource，從 RealSense 設備或 rosbag 回放讀取幀並對齊到顏色流。
+
+        設定了 depth_filters 時，在對齊前對深度流套用後處理濾波器鏈；啟用抽取 (decimation) 時
+        改為將顏色對齊到抽取後的深度流，內參與圖像尺寸隨之縮小，後續所有階段的成本都會降低。
+
+        參數:
+        pipeline (rs.pipeline): RealSense 管道。
+        config (rs.config): 管道配置（可在兩次 start() 之間修改）。
+        visual_preset (int, optional): 深度感測器的預設選項，None 表示不設置。預設為 None。
+        sensor_options (dict, optional): {rs.option: 值}，套用到設備上所有支援該選項的感測器
+            （例如多相機錄製時的 global_time_enabled 與 inter_cam_sync_mode）。預設為 None。
+        real_time (bool, optional): 回放 rosbag 時是否按照錄製速度播放。False 時以 CPU 允許的最快速度
+            逐幀解碼且不丟幀，配合 repeat_playback=False 在文件結束時拋出 EndOfStream。預設為 True。
+        bgr_output (bool, optional): 顏色流為 rgb8 時是否轉換為 BGR，使 cv2 寫出的圖像顏色正確。預設為 False。
+        use_imu (bool, optional): 管道中有陀螺儀流時，是否積分角速度並填入 FrameSet.rotation。預設為 False。
+        depth_filters (dict 或 str, optional): 濾波器設定字典或 JSON 文件路徑，見 depth_filters.DEFAULT_FILTER_SETTINGS。
+            None 表示不濾波。預設為 None。
+        filter_thread (bool, optional): 是否在獨立的工作線程中等待、濾波與對齊，使擷取循環的其他工作與其並行。預設為 False。
+        filter_queue_size (int, optional): 工作線程輸出隊列的長度。預設為 2。
+        """
+        super().__init__()
+        self.pipeline = pipeline
+        self.config = config
+        self.visual_preset = visual_preset
+        self.sensor_options = sensor_options or {}
+        self.real_time = real_time
+        self.bgr_output = bgr_output
+        self.align = None
+        self.playback = None
+        self.convert_color = False
+        self.use_imu = use_imu
+        self.has_gyro = False
+        self.gyro_time = None
+        self.rotation = 0.0
+        self.depth_filters = depth_filters
+        self.filter_thread = filter_thread
+        self.filter_chain = None
+        self.processed = Queue(maxsize=max(1, filter_queue_size))
+        self.worker = None
+        self.worker_stop = threading.Event()
+
+    def start(self):
+        """
+        啟動管道並讀取深度比例與對齊後的內參。
+        """
+        profile = self.pipeline.start(self.config)
+        device = profile.get_device()
+        self.playback = device.as_playback() if device.is_playback() else None
+        if self.playback is not None:
+            self.playback.set_real_time(self.real_time)
+        depth_sensor = device.first_depth_sensor()
+        if self.visual_preset is not None:
+            depth_sensor.set_option(rs.option.visual_preset, self.visual_preset)
+        for sensor in profile.get_device().query_sensors():
+            for option, value in self.sensor_options.items():
+                if sensor.supports(option):
+                    sensor.set_option(option, value)
+        self.depth_scale = depth_sensor.get_depth_scale()
+        self.filter_chain = DepthFilterChain(self.depth_filters) if self.depth_filters else None
+        self.has_gyro = self.use_imu and any(stream.stream_type() == rs.stream.gyro for stream in profile.get_streams())
+        self.gyro_time = None
+        self.rotation = 0.0
+
+        color_profile = profile.get_stream(rs.stream.color)
+        self.convert_color = self.bgr_output and color_profile.format() == rs.format.rgb8
+        if self.filter_chain is not None and self.filter_chain.decimates:
+            # 抽取後將顏色對齊到深度流，避免對齊時又放大回顏色解析度；內參取自濾波後的第一幀
+            self.align = rs.align(rs.stream.depth)
+            frames = self.pipeline.wait_for_frames()
+            while not frames.get_depth_frame():
+                frames = self.pipeline.wait_for_frames()
+            frames = self.filter_chain.process(frames)
+            intrinsics = frames.get_depth_frame().profile.as_video_stream_profile().get_intrinsics()
+        else:
+            # 深度已對齊到顏色流，因此使用顏色流的內參
+            self.align = rs.align(rs.stream.color)
+            intrinsics = color_profile.as_video_stream_profile().get_intrinsics()
+        self.intrinsics = {
+            'width': intrinsics.width,
+            'height': intrinsics.height,
+            'fx': intrinsics.fx,
+            'fy': intrinsics.fy,
+            'ppx': intrinsics.ppx,
+            'ppy': intrinsics.ppy
+        }
+
+        if self.filter_thread:
+            self.worker_stop.clear()
+            self.processed = Queue(maxsize=self.processed.maxsize)
+            self.worker = threading.Thread(target=self.run_worker, daemon=True)
+            self.worker.start()
+
+    def wait_for_frames(self):
+        if self.worker is not None:
+            try:
+                item = self.processed.get(timeout=1.0)
+            except Empty:
+                return None
+            if isinstance(item, Exception):
+                raise item
+            return item
+        return self.read_frames()
+
+    def run_worker(self):
+        """
+        工作線程：持續讀取、濾波並對齊幀，放入輸出隊列；錯誤或文件結束時將例外交給擷取線程。
+        """
+        while not self.worker_stop.is_set():
+            try:
+                item = self.read_frames(per_frame=False)
+            except Exception as e:
+                if self.worker_stop.is_set():
+                    return
+                item = e
+            if item is None:
+                continue
+            while not self.worker_stop.is_set():
+                try:
+                    self.processed.put(item, timeout=0.5)
+                    break
+                except Full:
+                    pass
+            if isinstance(item, Exception):
+                return
+
+    def read_frames(self, per_frame=True):
+        """
+        讀取一組幀，濾波並對齊。
+
+        參數:
+        per_frame (bool, optional): 計時是否屬於擷取線程的逐幀階段，工作線程中為 False。預設為 True。
+
+        回傳:
+        FrameSet: 已對齊的幀；沒有完整的深度與顏色幀時為 None。
+        """
+        stage = lambda name: self.stage(name, per_frame)
+        with stage("wait"):
+            if self.playback is None:
+                frames = self.pipeline.wait_for_frames()
+            else:
+                # 回放時以逾時輪詢，文件播放完畢後結束而不是拋出逾時錯誤
+                success, frames = self.pipeline.try_wait_for_frames(1000)
+                if not success:
+                    if self.playback.current_status() == rs.playback_status.stopped:
+                        raise EndOfStream()
+                    return None
+        if self.has_gyro:
+            # 陀螺儀幀與影像幀不同步，可能單獨到達
+            self.accumulate_gyro(frames)
+            if not frames.get_depth_frame() or not frames.get_color_frame():
+                return None
+        if self.filter_chain is not None:
+            frames = self.filter_chain.process(frames, stage)
+        with stage("align"):
+            aligned_frames = self.align.process(frames)
+        aligned_depth_frame = aligned_frames.get_depth_frame()
+        color_frame = aligned_frames.get_color_frame()
+        if not aligned_depth_frame or not color_frame:
+            return None
+        color_image = np.asanyarray(color_frame.get_data())
+        depth_image = np.asanyarray(aligned_depth_frame.get_data())
+        # 分發前複製數據：擷取管道的錄製隊列、預覽與重疊消費者會保留幀，
+        # 直接引用 librealsense 的幀內存會耗盡其很小的幀池，使擷取停頓或丟幀
+        depth_image = depth_image.copy()
+        if not self.convert_color:
+            color_image = color_image.copy()
+        if self.convert_color:
+            color_image = cv2.cvtColor(color_image, cv2.COLOR_RGB2BGR)
+        return FrameSet(
+            depth_image,
+            color_image,
+            color_frame.get_frame_number(),
+            color_frame.get_timestamp(),
+            self.take_rotation() if self.has_gyro else None)
+
+    def accumulate_gyro(self, frames):
+        """
+        積分幀組中陀螺儀幀的角速度大小。
+
+        參數:
+        frames (rs.composite_frame): 管道回傳的幀組。
+        """
+        for frame in frames:
+            if not frame.is_motion_frame() or frame.get_profile().stream_type() != rs.stream.gyro:
+                continue
+            data = frame.as_motion_frame().get_motion_data()
+            timestamp = frame.get_timestamp()
+            if self.gyro_time is not None and timestamp > self.gyro_time:
+                speed = np.sqrt(data.x * data.x + data.y * data.y + data.z * data.z)
+                self.rotation += np.degrees(speed) * (timestamp - self.gyro_time) / 1000.0
+            self.gyro_time = timestamp
+
+    def take_rotation(self):
+        """
+        回傳:
+        float: 自上一次調用以來的旋轉角度（度）。
+        """
+        rotation = self.rotation
+        self.rotation = 0.0
+        return rotation
+
+    def stop(self):
+        if self.worker is not None:
+            # 先停止管道，喚醒阻塞在 wait_for_frames 中的工作線程
+            self.worker_stop.set()
+            self.pipeline.stop()
+            self.worker.join()
+            self.worker = None
+            return
+        self.pipeline.stop()
+
+class PacedSource(FrameSource):
+    def __init__(self, fps=30, realtime=True):
+        """
+        初始化 PacedSource，按照指定幀率發出幀的來源基底類別。
+
+        參數:
+        fps (float, optional): 幀率。預設為 30。
+        realtime (bool, optional): 是否按照幀率等待；False 時以最快速度發出幀。預設為 True。
+        """
+        super().__init__()
+        self.fps = fps
+        self.realtime = realtime
+        self.stop_flag = threading.Event()
+        self.frame_number = 0
+        self.next_time = None
+
+    def start(self):
+        self.stop_flag.clear()
+        self.frame_number = 0
+        self.next_time = time.perf_counter()
+
+    def pace(self):
+        """
+        等待到下一幀的時刻，停止時拋出 EndOfStream。
+        """
+        if self.stop_flag.is_set():
+            raise EndOfStream()
+        if self.realtime and self.fps > 0:
+            delay = self.next_time - time.perf_counter()
+            if delay > 0 and self.stop_flag.wait(delay):
+                raise EndOfStream()
+            # 落後時不補發，避免累積成突發的幀
+            self.next_time = max(self.next_time, time.perf_counter() - 1.0 / self.fps) + 1.0 / self.fps
+
+    def emit(self, depth_image, color_image):
+        """
+        回傳:
+        FrameSet: 帶有遞增幀編號與時間戳的幀。
+        """
+        self.frame_number += 1
+        timestamp = 1000.0 * self.frame_number / self.fps if self.fps > 0 else 0.0
+        return FrameSet(depth_image, color_image, self.frame_number, timestamp)
+
+    def stop(self):
+        self.stop_flag.set()
+
+class SyntheticSource(PacedSource):
+    def __init__(self, width=640, height=480, fps=30, num_frames=None, realtime=True, n_patterns=8, seed=0):
+        """
+        初始化 SyntheticSource，生成合成的深度與顏色幀，用於沒有相機的環境。
+
+        預先生成 n_patterns 組幀並循環使用，因此每幀的生成成本接近零，
+        量測到的是錄製器本身的吞吐量。
+
+        參數:
+        width (int, optional): 圖像寬度。預設為 640。
+        height (int, optional): 圖像高度。預設為 480。
+        fps (float, optional): 幀率。預設為 30。
+        num_frames (int, optional): 發出的幀數，None 表示直到 stop()。預設為 None。
+        realtime (bool, optional): 是否按照幀率等待。預設為 True。
+        n_patterns (int, optional): 預先生成的幀數。預設為 8。
+        seed (int, optional): 隨機種子。預設為 0。
+        """
+        super().__init__(fps, realtime)
+        self.width = width
+        self.height = height
+        self.num_frames = num_frames
+        self.n_patterns = max(1, n_patterns)
+        self.seed = seed
+        self.patterns = None
+
+    def generate(self):
+        """
+        生成帶有傾斜平面、移動方塊與雜訊的深度幀以及對應的顏色幀。
+
+        回傳:
+        list: (depth_image, color_image) 列表。
+        """
+        rng = np.random.default_rng(self.seed)
+        ys, xs = np.mgrid[0:self.height, 0:self.width]
+        plane = 1500 + 1500 * ys / max(1, self.height - 1)
+        patterns = []
+        for i in range(self.n_patterns):
+            depth = plane + rng.normal(0, 5, size=plane.shape)
+            x0 = int((i + 0.5) * self.width / (self.n_patterns + 1))
+            y0 = self.height // 3
+            size = max(1, min(self.width, self.height) // 4)
+            depth[y0:y0 + size, x0:x0 + size] = 800
+            depth[rng.random(plane.shape) < 0.02] = 0  # 模擬無效深度
+            color = np.empty((self.height, self.width, 3), dtype=np.uint8)
+            color[..., 0] = (xs * 255 // max(1, self.width - 1)).astype(np.uint8)
+            color[..., 1] = (ys * 255 // max(1, self.height - 1)).astype(np.uint8)
+            color[..., 2] = (i * 255 // self.n_patterns)
+            color[y0:y0 + size, x0:x0 + size] = (255, 255, 255)
+            patterns.append((depth.astype(np.uint16), color))
+        return patterns
+
+    def start(self):
+        if self.patterns is None:
+            self.patterns = self.generate()
+        self.intrinsics = {
+            'width': self.width,
+            'height': self.height,
+            'fx': float(self.width),
+            'fy': float(self.width),
+            'ppx': self.width / 2.0,
+            'ppy': self.height / 2.0
+        }
+        super().start()
+
+    def wait_for_frames(self):
+        if self.num_frames is not None and self.frame_number >= self.num_frames:
+            raise EndOfStream()
+        with self.stage("wait"):
+            self.pace()
+        return self.emit(*self.patterns[self.frame_number % self.n_patterns])
+
+class FolderSource(PacedSource):
+    def __init__(self, path_dataset, fps=30, realtime=True, loop=False, preload=False):
+        """
+        初始化 FolderSource，回放已錄製的 depth/、color/ 資料夾或 RGBD 容器。
+
+        參數:
+        path_dataset (str): 錄製輸出資料夾。
+        fps (float, optional): 回放幀率。預設為 30。
+        realtime (bool, optional): 是否按照幀率等待。預設為 True。
+        loop (bool, optional): 播放完畢後是否從頭開始。預設為 False。
+        preload (bool, optional): 是否在 start() 時將所有幀讀入記憶體，避免量測到解碼時間。預設為 False。
+        """
+        super().__init__(fps, realtime)
+        self.path_dataset = path_dataset
+        self.loop = loop
+        self.preload = preload
+        self.reader = None
+        self.depth_files = None
+        self.color_files = None
+        self.frames = None
+        self.position = 0
+
+    @staticmethod
+    def list_files(path, extensions):
+        """
+        回傳:
+        list: 資料夾中指定副檔名的文件，依檔名排序。
+        """
+        return sorted(join(path, f) for f in listdir(path) if splitext(f)[1] in extensions)
+
+    def __len__(self):
+        return len(self.reader) if self.reader is not None else len(self.depth_files)
+
+    def read(self, i):
+        """
+        讀取第 i 幀。
+
+        回傳:
+        tuple: (depth_image, color_image)。
+        """
+        if self.frames is not None:
+            return self.frames[i]
+        if self.reader is not None:
+            return self.reader.read_depth(i), self.reader.read_color(i)
+        return read_depth_file(self.depth_files[i]), cv2.imread(self.color_files[i], cv2.IMREAD_COLOR)
+
+    def start(self):
+        if self.reader is None and is_rgbd_container(self.path_dataset):
+            self.reader = RGBDChunkReader(self.path_dataset)
+        if self.reader is not None:
+            self.depth_scale = self.reader.header.get('depth_scale', self.depth_scale)
+            path_intrinsic = self.reader.path_intrinsic
+        else:
+            self.depth_files = self.list_files(join(self.path_dataset, "depth"), tuple(DEPTH_FILE_EXTENSIONS.values()))
+            self.color_files = self.list_files(join(self.path_dataset, "color"), (".jpg", ".png"))
+            if len(self.depth_files) != len(self.color_files):
+                raise ValueError(f"Found {len(self.depth_files)} depth and {len(self.color_files)} color images in {self.path_dataset}")
+            path_intrinsic = join(self.path_dataset, "camera_intrinsic.json")
+        if len(self) == 0:
+            raise ValueError(f"No frames found in {self.path_dataset}")
+
+        depth_image, _ = self.read(0)
+        height, width = depth_image.shape[:2]
+        if exists(path_intrinsic):
+            with open(path_intrinsic) as infile:
+                intrinsic = json.load(infile)
+            matrix = intrinsic['intrinsic_matrix']
+            self.intrinsics = {'width': intrinsic['width'], 'height': intrinsic['height'],
+                               'fx': matrix[0], 'fy': matrix[4], 'ppx': matrix[6], 'ppy': matrix[7]}
+        else:
+            self.intrinsics = {'width': width, 'height': height, 'fx': float(width), 'fy': float(width),
+                               'ppx': width / 2.0, 'ppy': height / 2.0}
+
+        if self.preload and self.frames is None:
+            self.frames = [self.read(i) for i in range(len(self))]
+        self.position = 0
+        super().start()
+
+    def wait_for_frames(self):
+        if self.position >= len(self):
+            if not self.loop:
+                raise EndOfStream()
+            self.position = 0
+        with self.stage("wait"):
+            self.pace()
+            depth_image, color_image = self.read(self.position)
+        self.position += 1
+        return self.emit(depth_image, color_image)
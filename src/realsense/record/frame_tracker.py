@@ -0,0 +1,144 @@
+from collections import deque
+import numpy as np
+import open3d as o3d
+
+# 只保留最近的關鍵幀位姿與信息矩陣，長時間錄製時記憶體保持穩定
+KEYFRAME_HISTORY = 1000
+
+class TrackingResult:
+    __slots__ = ("pose", "is_keyframe", "skipped", "fitness", "inlier_rmse")
+
+    def __init__(self, pose, is_keyframe, skipped, fitness, inlier_rmse):
+        """
+        單幀追蹤的結果。
+
+        參數:
+        pose (np.ndarray): 4x4 相機到全域座標的位姿。
+        is_keyframe (bool): 此幀是否被加入關鍵幀窗口。
+        skipped (bool): 是否因移動量很小而跳過 ICP。
+        fitness (float): 與局部模型的重疊比例。
+        inlier_rmse (float): 內點的均方根誤差。
+        """
+        self.pose = pose
+        self.is_keyframe = is_keyframe
+        self.skipped = skipped
+        self.fitness = fitness
+        self.inlier_rmse = inlier_rmse
+
+def motion_magnitude(relative):
+    """
+    回傳:
+    tuple: 相對位姿的 (平移距離, 旋轉角度（度）)。
+    """
+    translation = np.linalg.norm(relative[:3, 3])
+    cos_angle = np.clip((np.trace(relative[:3, :3]) - 1.0) / 2.0, -1.0, 1.0)
+    return translation, np.degrees(np.arccos(cos_angle))
+
+class KeyframeTracker:
+    def __init__(self, voxel_size=0.02, window_size=5, keyframe_translation=0.05, keyframe_rotation=5.0,
+                 skip_fitness=0.9, skip_rmse_ratio=0.5, max_iteration=20):
+        """
+        初始化 KeyframeTracker。
+
+        每幀與最近數個關鍵幀組成的下採樣局部模型配準（幀到模型），而不是與上一幀配準，
+        以減少漂移。每幀最多一次點到平面 ICP：先以上一幀位姿評估一次對應關係，
+        若幾乎沒有移動則直接沿用位姿並跳過 ICP。只有在加入新關鍵幀時才重建局部模型與法向量，
+        因此每幀的延遲有上限。
+
+        參數:
+        voxel_size (float, optional): 下採樣體素大小。預設為 0.02。
+        window_size (int, optional): 局部模型使用的關鍵幀數量。預設為 5。
+        keyframe_translation (float, optional): 與上一關鍵幀的平移超過此值（米）時加入關鍵幀。預設為 0.05。
+        keyframe_rotation (float, optional): 與上一關鍵幀的旋轉超過此值（度）時加入關鍵幀。預設為 5.0。
+        skip_fitness (float, optional): 沿用上一幀位姿時，重疊比例至少為此值才跳過 ICP。預設為 0.9。
+        skip_rmse_ratio (float, optional): 沿用上一幀位姿時，內點誤差不超過 voxel_size 的此倍數才跳過 ICP。預設為 0.5。
+        max_iteration (int, optional): ICP 的最大迭代次數。預設為 20。
+        """
+        self.voxel_size = voxel_size
+        self.keyframe_translation = keyframe_translation
+        self.keyframe_rotation = keyframe_rotation
+        self.skip_fitness = skip_fitness
+        self.skip_rmse = voxel_size * skip_rmse_ratio
+        self.max_distance = voxel_size * 3
+        self.criteria = o3d.pipelines.registration.ICPConvergenceCriteria(max_iteration=max_iteration)
+        self.keyframes = deque(maxlen=max(1, window_size))
+        self.keyframe_poses = deque(maxlen=KEYFRAME_HISTORY)
+        self.keyframe_information = deque(maxlen=KEYFRAME_HISTORY)
+        self.keyframe_count = 0
+        self.model = None
+        self.pose = np.identity(4)
+        self.previous_pose = np.identity(4)
+        self.frames = 0
+        self.skipped = 0
+
+    def rebuild_model(self):
+        """
+        以窗口中的關鍵幀（全域座標）重建下採樣的局部模型並估計法向量。
+        """
+        model = o3d.geometry.PointCloud()
+        for keyframe in self.keyframes:
+            model += keyframe
+        model = model.voxel_down_sample(self.voxel_size)
+        model.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=self.voxel_size * 2, max_nn=30))
+        self.model = model
+
+    def add_keyframe(self, frame, pose, information):
+        """
+        加入關鍵幀並重建局部模型。
+
+        參數:
+        frame (o3d.geometry.PointCloud): 相機座標系下的下採樣點雲。
+        pose (np.ndarray): 4x4 位姿。
+        information (np.ndarray): 6x6 與局部模型配準的信息矩陣。
+        """
+        self.keyframes.append(o3d.geometry.PointCloud(frame).transform(pose))
+        self.keyframe_poses.append(pose.copy())
+        self.keyframe_information.append(information)
+        self.keyframe_count += 1
+        self.rebuild_model()
+
+    def track(self, frame):
+        """
+        追蹤一幀。
+
+        參數:
+        frame (o3d.geometry.PointCloud): 相機座標系下的下採樣點雲。
+
+        回傳:
+        TrackingResult: 追蹤結果。
+        """
+        registration = o3d.pipelines.registration
+        self.frames += 1
+        if self.model is None:
+            self.add_keyframe(frame, self.pose, np.identity(6))
+            return TrackingResult(self.pose.copy(), True, False, 1.0, 0.0)
+
+        # 幾乎沒有移動時直接沿用上一幀的位姿
+        evaluation = registration.evaluate_registration(frame, self.model, self.max_distance, self.pose)
+        if evaluation.fitness >= self.skip_fitness and evaluation.inlier_rmse <= self.skip_rmse:
+            self.skipped += 1
+            self.previous_pose = self.pose
+            return TrackingResult(self.pose.copy(), False, True, evaluation.fitness, evaluation.inlier_rmse)
+
+        # 以等速模型預測初始位姿
+        prediction = self.pose @ np.linalg.inv(self.previous_pose) @ self.pose
+        result = registration.registration_icp(
+            frame, self.model, self.max_distance, prediction,
+            registration.TransformationEstimationPointToPlane(), self.criteria)
+        self.previous_pose = self.pose
+        self.pose = result.transformation
+
+        translation, rotation = motion_magnitude(np.linalg.inv(self.keyframe_poses[-1]) @ self.pose)
+        is_keyframe = translation > self.keyframe_translation or rotation > self.keyframe_rotation
+        if is_keyframe:
+            information = registration.get_information_matrix_from_point_clouds(
+                frame, self.model, self.max_distance, self.pose)
+            self.add_keyframe(frame, self.pose, information)
+        return TrackingResult(self.pose.copy(), is_keyframe, False, result.fitness, result.inlier_rmse)
+
+    def get_stats(self):
+        """
+        回傳:
+        dict: 包含 'frames'、'skipped' 與 'keyframes'（加入過的關鍵幀總數）的字典。
+        """
+        return {'frames': self.frames, 'skipped': self.skipped, 'keyframes': self.keyframe_count}
@@ -0,0 +1,222 @@
+import threading
+import multiprocessing
+import time
+import queue
+import numpy as np
+import cv2
+from depth_codec import DEPTH_FILE_EXTENSIONS, resolve_depth_codec, write_depth_file
+
+class FrameWriterFullError(RuntimeError):
+    """
+    當寫入隊列已滿且背壓策略為 "fail" 時拋出的錯誤。
+    """
+    pass
+
+def write_frame_pair(path_depth, path_color, frame_id, depth_image, color_image, depth_codec="png"):
+    """
+    將一組深度與顏色圖像編碼並寫入磁碟。
+
+    參數:
+    path_depth (str): 深度圖像資料夾。
+    path_color (str): 顏色圖像資料夾。
+    frame_id (int): 幀編號。
+    depth_image (np.ndarray): 深度圖像數組。
+    color_image (np.ndarray): 顏色圖像數組。
+    depth_codec (str, optional): 深度文件的編碼方式，見 depth_codec.DEPTH_FILE_EXTENSIONS。預設為 "png"。
+    """
+    write_depth_file(path_depth, frame_id, depth_image, depth_codec)
+    cv2.imwrite(f"{path_color}/{frame_id:06d}.jpg", color_image)
+
+def _process_worker(frame_queue, path_depth, path_color, depth_codec, written, errors):
+    """
+    編碼進程的主循環，直到收到 None 為止。
+
+    參數:
+    frame_queue (multiprocessing.Queue): 幀隊列。
+    path_depth (str): 深度圖像資料夾。
+    path_color (str): 顏色圖像資料夾。
+    depth_codec (str): 深度文件的編碼方式。
+    written (multiprocessing.Value): 已寫入幀數的共享計數器。
+    errors (multiprocessing.Value): 寫入失敗次數的共享計數器。
+    """
+    while True:
+        item = frame_queue.get()
+        if item is None:
+            break
+        try:
+            write_frame_pair(path_depth, path_color, *item[:3], depth_codec)
+            with written.get_lock():
+                written.value += 1
+        except Exception as e:
+            print(f"Error writing frame {item[0]}: {e}")
+            with errors.get_lock():
+                errors.value += 1
+
+class FrameWriter:
+    POLICIES = ("block", "drop_oldest", "fail")
+
+    def __init__(self, path_depth, path_color, num_workers=2, queue_size=64, policy="block", use_processes=False, container=None, stats=None, depth_codec="png"):
+        """
+        初始化 FrameWriter。
+
+        擷取循環只需調用 put() 交出幀，深度與顏色圖像的編碼與寫入由獨立的線程或進程池完成，
+        避免編碼時間佔用 wait_for_frames() 的時間。
+
+        參數:
+        path_depth (str): 深度圖像資料夾。
+        path_color (str): 顏色圖像資料夾。
+        num_workers (int, optional): 編碼工作者數量。預設為 2。
+        queue_size (int, optional): 寫入隊列的最大長度。預設為 64。
+        policy (str, optional): 隊列已滿時的背壓策略，"block"、"drop_oldest" 或 "fail"。預設為 "block"。
+        use_processes (bool, optional): 是否使用進程而非線程進行編碼。預設為 False。
+        container (RGBDChunkWriter, optional): 若提供，幀會追加到該容器而非寫成單獨的圖像文件。預設為 None。
+        stats (CaptureStats, optional): 若提供，記錄每幀的編碼耗時（"encode" 階段，僅限線程模式）。預設為 None。
+        depth_codec (str, optional): 單獨圖像文件的深度編碼方式，"png"、"rvl" 或 "zstd"（沒有安裝 zstandard 時退回 zlib）。預設為 "png"。
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unsupported backpressure policy: {policy}")
+        if container is not None and use_processes:
+            raise ValueError("RGBD container output requires thread workers")
+        self.path_depth = path_depth
+        self.path_color = path_color
+        self.num_workers = max(1, num_workers)
+        self.queue_size = max(1, queue_size)
+        self.policy = policy
+        self.use_processes = use_processes
+        self.container = container
+        self.stats = stats
+        self.depth_codec = resolve_depth_codec(depth_codec)
+        if self.depth_codec not in DEPTH_FILE_EXTENSIONS:
+            raise ValueError(f"Unsupported depth file codec: {depth_codec}")
+        self.workers = []
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.dropped = 0
+
+        if use_processes:
+            self.frame_queue = multiprocessing.Queue(maxsize=self.queue_size)
+            self.written_value = multiprocessing.Value('q', 0)
+            self.errors_value = multiprocessing.Value('q', 0)
+        else:
+            self.frame_queue = queue.Queue(maxsize=self.queue_size)
+            self.written_value = None
+            self.errors_value = None
+            self._written = 0
+            self._errors = 0
+
+    def start(self):
+        """
+        啟動編碼工作者。
+        """
+        for _ in range(self.num_workers):
+            if self.use_processes:
+                worker = multiprocessing.Process(
+                    target=_process_worker,
+                    args=(self.frame_queue, self.path_depth, self.path_color, self.depth_codec, self.written_value, self.errors_value),
+                    daemon=True)
+            else:
+                worker = threading.Thread(target=self._thread_worker, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def _thread_worker(self):
+        """
+        編碼線程的主循環，直到收到 None 為止。
+        """
+        while True:
+            item = self.frame_queue.get()
+            if item is None:
+                break
+            try:
+                start = time.perf_counter()
+                if self.container is not None:
+                    self.container.append(*item)
+                else:
+                    write_frame_pair(self.path_depth, self.path_color, *item[:3], self.depth_codec)
+                if self.stats is not None:
+                    self.stats.add_timing("encode", time.perf_counter() - start, per_frame=False)
+                with self.lock:
+                    self._written += 1
+            except Exception as e:
+                print(f"Error writing frame {item[0]}: {e}")
+                with self.lock:
+                    self._errors += 1
+
+    def put(self, frame_id, depth_image, color_image, timestamp=0.0):
+        """
+        將一組幀交給寫入隊列。
+
+        圖像會被複製一次，使 librealsense 的幀緩衝區能立即歸還給幀池。
+
+        參數:
+        frame_id (int): 幀編號。
+        depth_image (np.ndarray): 深度圖像數組。
+        color_image (np.ndarray): 顏色圖像數組。
+        timestamp (float, optional): 幀的時間戳（毫秒）。預設為 0.0。
+
+        回傳:
+        bool: 幀是否成功進入隊列。
+        """
+        item = (frame_id, np.array(depth_image, copy=True), np.array(color_image, copy=True), timestamp)
+        if self.policy == "block":
+            self.frame_queue.put(item)
+        elif self.policy == "drop_oldest":
+            while True:
+                try:
+                    self.frame_queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        self.frame_queue.get_nowait()
+                        with self.lock:
+                            self.dropped += 1
+                    except queue.Empty:
+                        pass
+        else:
+            try:
+                self.frame_queue.put_nowait(item)
+            except queue.Full:
+                with self.lock:
+                    self.dropped += 1
+                raise FrameWriterFullError(f"Frame writer queue is full, frame {frame_id} rejected")
+        with self.lock:
+            self.queued += 1
+        return True
+
+    def get_counters(self):
+        """
+        獲取寫入計數器。
+
+        回傳:
+        dict: 包含 'queued'、'written'、'dropped'、'errors' 與 'pending' 的字典。
+        """
+        with self.lock:
+            if self.use_processes:
+                written = self.written_value.value
+                errors = self.errors_value.value
+            else:
+                written = self._written
+                errors = self._errors
+            return {
+                'queued': self.queued,
+                'written': written,
+                'dropped': self.dropped,
+                'errors': errors,
+                'pending': max(0, self.queued - self.dropped - written - errors)
+            }
+
+    def close(self):
+        """
+        等待隊列中剩餘的幀寫入完成並停止所有工作者。
+
+        回傳:
+        dict: 最終的寫入計數器。
+        """
+        for _ in self.workers:
+            self.frame_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        if self.container is not None:
+            self.container.close()
+        return self.get_counters()
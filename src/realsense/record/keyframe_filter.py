@@ -0,0 +1,134 @@
+import numpy as np
+
+class FilterDecision:
+    __slots__ = ("keep", "reason", "depth_change", "color_change", "rotation")
+
+    def __init__(self, keep, reason, depth_change, color_change, rotation):
+        """
+        單幀篩選的結果。
+
+        參數:
+        keep (bool): 是否保存此幀。
+        reason (str): 保存的原因（"first"、"depth"、"color"、"imu" 或 "max_skip"），跳過時為空字串。
+        depth_change (float): 與上一保存幀相比深度改變的像素比例。
+        color_change (float): 與上一保存幀相比灰階的平均絕對差 (0–255)。
+        rotation (float): 自上一保存幀以來陀螺儀積分的旋轉角度（度），沒有 IMU 時為 0。
+        """
+        self.keep = keep
+        self.reason = reason
+        self.depth_change = depth_change
+        self.color_change = color_change
+        self.rotation = rotation
+
+class KeyframeFilter:
+    def __init__(self, depth_threshold=0.05, color_threshold=8.0, rotation_threshold=2.0, max_skip=15,
+                 depth_delta=0.03, depth_scale=0.001, stride=8, use_depth=True, use_color=True):
+        """
+        初始化 KeyframeFilter。
+
+        錄製時以低成本的差異判斷每幀是否帶來新資訊：在 stride 取樣的縮圖上，
+        比較與上一保存幀的深度改變比例與灰階平均差，並可加上 IMU 陀螺儀積分的旋轉角度。
+        任一指標超過門檻，或已連續跳過 max_skip 幀時保存此幀，其餘幀跳過。
+        每幀只需處理約千個像素，不影響擷取循環。
+
+        參數:
+        depth_threshold (float, optional): 深度改變的像素比例超過此值時保存。預設為 0.05。
+        color_threshold (float, optional): 灰階平均絕對差超過此值時保存。預設為 8.0。
+        rotation_threshold (float, optional): IMU 旋轉角度（度）超過此值時保存。預設為 2.0。
+        max_skip (int, optional): 最多連續跳過的幀數，保持後續里程計所需的時間連續性。預設為 15。
+        depth_delta (float, optional): 深度差超過此值（米）的像素視為已改變。預設為 0.03。
+        depth_scale (float, optional): 深度單位（米）。預設為 0.001。
+        stride (int, optional): 縮圖的像素取樣間隔。預設為 8。
+        use_depth (bool, optional): 是否使用深度差異。預設為 True。
+        use_color (bool, optional): 是否使用顏色差異。預設為 True。
+        """
+        self.depth_threshold = depth_threshold
+        self.color_threshold = color_threshold
+        self.rotation_threshold = rotation_threshold
+        self.max_skip = max(0, int(max_skip))
+        self.depth_delta_units = depth_delta / depth_scale
+        self.stride = max(1, int(stride))
+        self.use_depth = use_depth
+        self.use_color = use_color
+        self.reference_depth = None
+        self.reference_gray = None
+        self.rotation = 0.0
+        self.skipped_in_row = 0
+        self.kept = 0
+        self.skipped = 0
+
+    def thumbnails(self, depth_image, color_image):
+        """
+        回傳:
+        tuple: (float32 深度縮圖, float32 灰階縮圖)，未使用的指標為 None。
+        """
+        depth = depth_image[::self.stride, ::self.stride].astype(np.float32) if self.use_depth else None
+        gray = color_image[::self.stride, ::self.stride].mean(axis=2, dtype=np.float32) if self.use_color else None
+        return depth, gray
+
+    def depth_change(self, depth):
+        """
+        回傳:
+        float: 與參考幀相比，深度差超過 depth_delta 或有效性改變的像素比例。
+        """
+        valid = depth > 0
+        reference_valid = self.reference_depth > 0
+        either = valid | reference_valid
+        n = np.count_nonzero(either)
+        if n == 0:
+            return 0.0
+        changed = (valid != reference_valid) | (np.abs(depth - self.reference_depth) > self.depth_delta_units)
+        return np.count_nonzero(changed & either) / n
+
+    def update(self, depth_image, color_image, rotation=None):
+        """
+        判斷是否保存一幀，保存時以此幀作為新的參考幀。
+
+        參數:
+        depth_image (np.ndarray): uint16 深度圖像。
+        color_image (np.ndarray): 顏色圖像 (h, w, 3)。
+        rotation (float, optional): 自上一幀以來的旋轉角度（度），None 表示沒有 IMU 數據。預設為 None。
+
+        回傳:
+        FilterDecision: 篩選結果。
+        """
+        if rotation is not None:
+            self.rotation += rotation
+        depth, gray = self.thumbnails(depth_image, color_image)
+
+        if self.kept == 0:
+            return self.keep(depth, gray, "first", 0.0, 0.0)
+
+        depth_change = self.depth_change(depth) if self.use_depth else 0.0
+        color_change = float(np.mean(np.abs(gray - self.reference_gray))) if self.use_color else 0.0
+        if self.use_depth and depth_change > self.depth_threshold:
+            return self.keep(depth, gray, "depth", depth_change, color_change)
+        if self.use_color and color_change > self.color_threshold:
+            return self.keep(depth, gray, "color", depth_change, color_change)
+        if self.rotation > self.rotation_threshold:
+            return self.keep(depth, gray, "imu", depth_change, color_change)
+        if self.skipped_in_row >= self.max_skip:
+            return self.keep(depth, gray, "max_skip", depth_change, color_change)
+
+        self.skipped_in_row += 1
+        self.skipped += 1
+        return FilterDecision(False, "", depth_change, color_change, self.rotation)
+
+    def keep(self, depth, gray, reason, depth_change, color_change):
+        """
+        將縮圖設為新的參考幀並回傳保存的結果。
+        """
+        decision = FilterDecision(True, reason, depth_change, color_change, self.rotation)
+        self.reference_depth = depth
+        self.reference_gray = gray
+        self.rotation = 0.0
+        self.skipped_in_row = 0
+        self.kept += 1
+        return decision
+
+    def get_stats(self):
+        """
+        回傳:
+        dict: 包含 'kept' 與 'skipped' 的字典。
+        """
+        return {'kept': self.kept, 'skipped': self.skipped}
@@ -0,0 +1,164 @@
+import threading
+import time
+import numpy as np
+import open3d as o3d
+
+# 點雲管理器的點雲翻轉了 x 和 y 軸，位姿需先乘上此矩陣才是標準的相機座標
+FLIP_XY = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+class LiveTSDFIntegrator:
+    def __init__(self, intrinsics_dict, voxel_size=0.05, block_resolution=8, block_count=20000,
+                 depth_scale=1000.0, depth_max=3.0, stride=2, integrate_rate=2.0):
+        """
+        初始化 LiveTSDFIntegrator。
+
+        錄製時以粗體素在 CPU 上的 VoxelBlockGrid 中即時融合已追蹤的深度幀，讓操作者
+        立即看到尚未掃描到的空洞。融合在背景線程中以 integrate_rate 的頻率進行，
+        只處理最新提交的一幀；網格或點雲只在需要時提取。
+
+        參數:
+        intrinsics_dict (dict): 相機內參字典，包含 'fx', 'fy', 'ppx', 'ppy'。
+        voxel_size (float, optional): 體素大小（米）。預設為 0.05。
+        block_resolution (int, optional): 每個體素塊的解析度。預設為 8。
+        block_count (int, optional): 預先分配的體素塊數量。預設為 20000。
+        depth_scale (float, optional): 每米的深度單位數。預設為 1000.0。
+        depth_max (float, optional): 最大融合深度（米）。預設為 3.0。
+        stride (int, optional): 深度圖像的取樣間隔，內參會相應縮放。預設為 2。
+        integrate_rate (float, optional): 每秒最多融合的幀數。預設為 2.0。
+        """
+        self.voxel_size = voxel_size
+        self.depth_scale = depth_scale
+        self.depth_max = depth_max
+        self.stride = max(1, int(stride))
+        self.interval = 1.0 / integrate_rate if integrate_rate > 0 else 0.0
+        self.device = o3d.core.Device("CPU:0")
+        intrinsic = np.array([[intrinsics_dict['fx'], 0, intrinsics_dict['ppx']],
+                              [0, intrinsics_dict['fy'], intrinsics_dict['ppy']],
+                              [0, 0, 1]], dtype=np.float64)
+        intrinsic[:2] /= self.stride
+        self.intrinsic = o3d.core.Tensor(intrinsic)
+        self.vbg = o3d.t.geometry.VoxelBlockGrid(
+            attr_names=('tsdf', 'weight'),
+            attr_dtypes=(o3d.core.float32, o3d.core.float32),
+            attr_channels=((1), (1)),
+            voxel_size=voxel_size,
+            block_resolution=block_resolution,
+            block_count=block_count,
+            device=self.device)
+
+        self.lock = threading.Lock()
+        self.frame_event = threading.Event()
+        self.stop_flag = threading.Event()
+        self.thread = None
+        self.latest = None
+        self.submitted = 0
+        self.integrated = 0
+
+    def downsample(self, depth_image):
+        """
+        回傳:
+        np.ndarray: 依照 stride 取樣後的深度圖像副本（輸入可能位於共享記憶體中）。
+        """
+        return np.array(depth_image[::self.stride, ::self.stride], order='C')
+
+    def start(self):
+        """
+        啟動融合線程。
+        """
+        if self.thread is None:
+            self.stop_flag.clear()
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """
+        停止融合線程。
+        """
+        self.stop_flag.set()
+        self.frame_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, depth_image, pose):
+        """
+        提交一幀，覆蓋尚未融合的舊幀。
+
+        參數:
+        depth_image (np.ndarray): 已依照 stride 取樣的 uint16 深度圖像（提交後不應再修改）。
+        pose (np.ndarray): 點雲管理器座標下的 4x4 位姿（相機到全域）。
+        """
+        with self.lock:
+            self.latest = (depth_image, pose)
+            self.submitted += 1
+        self.frame_event.set()
+
+    def integrate(self, depth_image, pose):
+        """
+        將一幀融合到體素塊網格中。
+
+        參數:
+        depth_image (np.ndarray): 已依照 stride 取樣的 uint16 深度圖像。
+        pose (np.ndarray): 點雲管理器座標下的 4x4 位姿。
+        """
+        extrinsic = o3d.core.Tensor(np.linalg.inv(pose @ FLIP_XY))
+        depth = o3d.t.geometry.Image(o3d.core.Tensor(depth_image)).to(self.device)
+        with self.lock:
+            frustum_block_coords = self.vbg.compute_unique_block_coordinates(
+                depth, self.intrinsic, extrinsic, self.depth_scale, self.depth_max)
+            self.vbg.integrate(frustum_block_coords, depth, self.intrinsic, extrinsic,
+                               self.depth_scale, self.depth_max)
+            self.integrated += 1
+
+    def run(self):
+        """
+        融合線程的主循環，兩次融合之間至少間隔 1 / integrate_rate 秒。
+        """
+        next_time = time.perf_counter()
+        while not self.stop_flag.is_set():
+            if not self.frame_event.wait(timeout=0.5):
+                continue
+            delay = next_time - time.perf_counter()
+            if delay > 0 and self.stop_flag.wait(delay):
+                break
+            with self.lock:
+                frame = self.latest
+                self.latest = None
+                self.frame_event.clear()
+            if frame is None:
+                continue
+            next_time = time.perf_counter() + self.interval
+            try:
+                self.integrate(*frame)
+            except Exception as e:
+                print(f"Error integrating live TSDF: {e}")
+
+    def extract_triangle_mesh(self):
+        """
+        提取目前的三角網格。
+
+        回傳:
+        o3d.geometry.TriangleMesh: 網格。
+        """
+        with self.lock:
+            mesh = self.vbg.extract_triangle_mesh()
+        return mesh.to_legacy()
+
+    def extract_point_cloud(self):
+        """
+        提取目前的表面點雲。
+
+        回傳:
+        o3d.geometry.PointCloud: 點雲。
+        """
+        with self.lock:
+            pcd = self.vbg.extract_point_cloud()
+        return pcd.to_legacy()
+
+    def get_counters(self):
+        """
+        回傳:
+        dict: 包含 'submitted'、'integrated' 與 'skipped' 的字典。
+        """
+        with self.lock:
+            return {'submitted': self.submitted, 'integrated': self.integrated, 'skipped': self.submitted - self.integrated}
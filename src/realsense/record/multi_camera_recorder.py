@@ -0,0 +1,244 @@
+import copy
+import csv
+import json
+import threading
+from os import makedirs
+from os.path import exists, join
+import numpy as np
+import pyrealsense2 as rs
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from RealSenseRecorder import RealSenseRecorder, TIMESTAMP_FILE
+from realsense_helper import get_serial_numbers
+
+# 多相機錄製的共享時間戳索引
+MULTI_CAMERA_INDEX_FILE = "multi_camera_index.json"
+
+def camera_folder(output_folder, serial):
+    """
+    回傳:
+    str: 該設備的輸出資料夾。
+    """
+    return join(output_folder, f"camera_{serial}")
+
+def load_timestamps(filename):
+    """
+    讀取 RealSenseRecorder 保存的時間戳文件。
+
+    參數:
+    filename (str): timestamps.csv 路徑。
+
+    回傳:
+    tuple: (frame_ids, timestamps) 兩個 numpy 數組，按時間戳排序。
+    """
+    frame_ids, timestamps = [], []
+    if exists(filename):
+        with open(filename, newline='') as infile:
+            for row in csv.DictReader(infile):
+                frame_ids.append(int(row['frame_id']))
+                timestamps.append(float(row['timestamp_ms']))
+    order = np.argsort(timestamps, kind='stable')
+    return np.asarray(frame_ids, dtype=np.int64)[order], np.asarray(timestamps, dtype=np.float64)[order]
+
+def build_timestamp_index(output_folder, serials, tolerance_ms):
+    """
+    以第一台相機為參考，為每一幀找出其他相機時間戳最接近的幀。
+
+    參數:
+    output_folder (str): 多相機錄製的輸出資料夾。
+    serials (list): 設備序號列表，第一個為參考相機。
+    tolerance_ms (float): 配對允許的最大時間差（毫秒），超過時該相機記為 -1。
+
+    回傳:
+    dict: 共享時間戳索引。
+    """
+    recorded = [load_timestamps(join(camera_folder(output_folder, serial), TIMESTAMP_FILE)) for serial in serials]
+    reference_ids, reference_timestamps = recorded[0]
+    columns = [reference_ids]
+    for frame_ids, timestamps in recorded[1:]:
+        if len(timestamps) == 0:
+            columns.append(np.full(len(reference_ids), -1, dtype=np.int64))
+            continue
+        # 在排序後的時間戳中找出左右兩個候選並取較近者
+        right = np.clip(np.searchsorted(timestamps, reference_timestamps), 0, len(timestamps) - 1)
+        left = np.clip(right - 1, 0, len(timestamps) - 1)
+        nearest = np.where(np.abs(timestamps[left] - reference_timestamps) <= np.abs(timestamps[right] - reference_timestamps), left, right)
+        matched = np.where(np.abs(timestamps[nearest] - reference_timestamps) <= tolerance_ms, frame_ids[nearest], -1)
+        columns.append(matched)
+
+    return {
+        'cameras': [{'serial': serial, 'folder': f"camera_{serial}", 'frames': int(len(ids))} for serial, (ids, _) in zip(serials, recorded)],
+        'reference': serials[0],
+        'tolerance_ms': tolerance_ms,
+        'columns': ['timestamp_ms'] + list(serials),
+        'frames': [[float(t)] + [int(column[i]) for column in columns] for i, t in enumerate(reference_timestamps)]
+    }
+
+class MultiCameraRecorder:
+    def __init__(self, args, serials=None, callback=None, hardware_sync=False, tolerance_ms=None):
+        """
+        初始化 MultiCameraRecorder。
+
+        每台設備使用各自的 RealSenseRecorder，因此各自擁有管道、擷取線程與寫入隊列，
+        每台相機都能以完整幀率錄製，不會在同一個循環中互相等待。每台設備的圖像、
+        內參與時間戳寫入 output_folder/camera_<序號>/，停止錄製後在 output_folder
+        寫入共享的時間戳索引 (multi_camera_index.json)，供後續重建配對幀。
+
+        參數:
+        args (Args): 配置參數，output_folder 為所有相機的上層資料夾；不支援 rosbag 錄製與回放。
+        serials (list, optional): 設備序號列表，None 表示使用所有已連接的設備。預設為 None。
+        callback (callable, optional): 回調函數，只轉發第一台相機的預覽圖像。預設為 None。
+        hardware_sync (bool, optional): 是否啟用硬體同步（第一台為主機，其餘為從機），需連接同步線。預設為 False。
+        tolerance_ms (float, optional): 幀配對允許的最大時間差，None 表示半個幀間隔。預設為 None。
+        """
+        self.args = args
+        self.callback = callback
+        self.serials = list(serials) if serials else get_serial_numbers()
+        self.hardware_sync = hardware_sync
+        self.tolerance_ms = tolerance_ms if tolerance_ms is not None else 500.0 / args.fps
+        self.recorders = []
+
+        try:
+            if len(self.serials) == 0:
+                raise RuntimeError("No RealSense device connected")
+            if args.record_rosbag or args.playback_rosbag:
+                raise ValueError("Multi-camera recording does not support rosbag files")
+            if not exists(args.output_folder):
+                makedirs(args.output_folder)
+            for i, serial in enumerate(self.serials):
+                self.recorders.append(RealSenseRecorder(self.device_args(i, serial), self.device_callback(i)))
+        except Exception as e:
+            print(f"Error creating multi-camera recorder: {e}")
+            self.send_to_model("show_error", {"title": "Error creating multi-camera recorder", "message": str(e)})
+
+    def device_args(self, i, serial):
+        """
+        生成單台設備的配置參數。
+
+        參數:
+        i (int): 設備順序。
+        serial (str): 設備序號。
+
+        回傳:
+        Args: 該設備的配置參數。
+        """
+        args = copy.copy(self.args)
+        args.output_folder = camera_folder(self.args.output_folder, serial)
+        args.serial = serial
+        # 只有第一台相機啟動點雲管理器
+        args.calculate_overlap = self.args.calculate_overlap and i == 0
+        # 使用主機時間域，讓不同設備的時間戳可以直接比較
+        sensor_options = dict(self.args.sensor_options or {})
+        sensor_options[rs.option.global_time_enabled] = 1
+        if self.hardware_sync:
+            sensor_options[rs.option.inter_cam_sync_mode] = 1 if i == 0 else 2
+        args.sensor_options = sensor_options
+        if args.stats_dump_path:
+            root, ext = os.path.splitext(args.stats_dump_path)
+            args.stats_dump_path = f"{root}_{serial}{ext}"
+        return args
+
+    def device_callback(self, i):
+        """
+        生成單台設備的回調函數，只有第一台相機的預覽圖像與重疊比例會發送到 GUI。
+
+        參數:
+        i (int): 設備順序。
+
+        回傳:
+        callable: 回調函數。
+        """
+        def callback(mode, data):
+            if mode in ["record_imgs", "overlap"] and i != 0:
+                return
+            if mode == "terminal_print":
+                data = dict(data, message=f"[{self.serials[i]}] {data['message']}")
+            self.send_to_model(mode, data)
+        return callback
+
+    def start_preview(self):
+        """
+        啟動所有設備的預覽。
+        """
+        for recorder in self.recorders:
+            recorder.start_preview()
+
+    def start_recording(self):
+        """
+        啟動所有設備的錄製。
+        """
+        for recorder in self.recorders:
+            recorder.start_recording()
+
+    def stop_recording(self):
+        """
+        停止所有設備的錄製，等待擷取線程與寫入器結束後寫入共享時間戳索引。
+        """
+        for recorder in self.recorders:
+            recorder.recive_from_model("stop_record")
+        for recorder in self.recorders:
+            thread = recorder.thread
+            if thread is not None and thread is not threading.current_thread():
+                thread.join()
+        if self.args.record_imgs and self.recorders:
+            self.save_timestamp_index()
+
+    def save_timestamp_index(self):
+        """
+        寫入共享時間戳索引。
+        """
+        try:
+            index = build_timestamp_index(self.args.output_folder, self.serials, self.tolerance_ms)
+            with open(join(self.args.output_folder, MULTI_CAMERA_INDEX_FILE), 'w') as outfile:
+                json.dump(index, outfile, indent=4)
+            paired = sum(1 for row in index['frames'] if -1 not in row[1:])
+            self.send_to_model("terminal_print", {"owner": "record", "message": f"Multi-camera index: {paired}/{len(index['frames'])} frames paired across {len(self.serials)} cameras"})
+        except Exception as e:
+            print(f"Error saving multi-camera index: {e}")
+            self.send_to_model("show_error", {"title": "Error saving multi-camera index", "message": str(e)})
+
+    def get_stats(self):
+        """
+        獲取每台設備的統計數據。
+
+        回傳:
+        dict: 設備序號到 RealSenseRecorder.get_stats() 結果的字典。
+        """
+        return {serial: recorder.get_stats() for serial, recorder in zip(self.serials, self.recorders)}
+
+    def recive_from_model(self, mode, data=None):
+        """
+        從模型接收消息。
+
+        參數:
+        mode (str): 模式。
+        data (dict, optional): 附加數據。預設為 None。
+        """
+        try:
+            if mode == "start_preview":
+                self.start_preview()
+            elif mode == "start_record":
+                self.start_recording()
+            elif mode == "stop_record":
+                self.stop_recording()
+        except Exception as e:
+            print(f"Error receiving from model: {e}")
+            self.send_to_model("show_error", {"title": "Error receiving from model", "message": str(e)})
+
+    def send_to_model(self, mode, data):
+        """
+        發送消息到模型。
+
+        參數:
+        mode (str): 模式。
+        data (dict): 附加數據。
+        """
+        if self.callback is not None:
+            try:
+                if mode in ["record_imgs", "show_error", "terminal_print", "overlap"]:
+                    self.callback(mode, data)
+            except Exception as e:
+                print(f"Error sending to model: {e}")
+                if mode != "show_error":  # 防止遞歸調用
+                    self.callback("show_error", {"title": "Error sending to model", "message": str(e)})
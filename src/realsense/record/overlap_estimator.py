@@ -0,0 +1,120 @@
+import time
+import numpy as np
+from depth_projection import DepthBackProjector
+from voxel_map import voxel_keys
+
+class OverlapResult:
+    __slots__ = ("ratio", "is_keyframe", "warning")
+
+    def __init__(self, ratio, is_keyframe, warning):
+        """
+        單幀重疊估計的結果。
+
+        參數:
+        ratio (float): 此幀的體素中也被上一關鍵幀佔用的比例。
+        is_keyframe (bool): 此幀是否成為新的關鍵幀。
+        warning (bool): 重疊比例是否低於警告門檻（或有效深度太少）。
+        """
+        self.ratio = ratio
+        self.is_keyframe = is_keyframe
+        self.warning = warning
+
+class OverlapEstimator:
+    def __init__(self, intrinsics_dict, depth_image_shape, depth_scale=0.001, voxel_size=0.05, stride=8,
+                 keyframe_threshold=0.7, warn_threshold=0.3, min_voxels=50):
+        """
+        初始化 OverlapEstimator。
+
+        以粗網格的體素佔用估計新幀與上一關鍵幀的重疊：兩幀都在相機座標下投影並量化為體素鍵，
+        重疊比例為目前幀的體素中也被關鍵幀佔用的比例。不需要 ICP 或位姿，
+        相機移動或轉動越多，相同座標的體素越少。以 stride 稀疏取樣，每幀只需約一毫秒。
+
+        參數:
+        intrinsics_dict (dict): 相機內參字典，包含 'fx', 'fy', 'ppx', 'ppy'。
+        depth_image_shape (tuple): 深度圖像的形狀 (height, width)。
+        depth_scale (float, optional): 深度單位（米）。預設為 0.001。
+        voxel_size (float, optional): 佔用網格的體素大小（米）。預設為 0.05。
+        stride (int, optional): 像素取樣間隔。預設為 8。
+        keyframe_threshold (float, optional): 重疊比例低於此值時將目前幀標記為新的關鍵幀。預設為 0.7。
+        warn_threshold (float, optional): 重疊比例低於此值時發出警告。預設為 0.3。
+        min_voxels (int, optional): 有效體素少於此值時視為深度不足並發出警告。預設為 50。
+        """
+        self.voxel_size = voxel_size
+        self.keyframe_threshold = keyframe_threshold
+        self.warn_threshold = warn_threshold
+        self.min_voxels = min_voxels
+        self.projector = DepthBackProjector(intrinsics_dict, depth_image_shape, depth_scale=depth_scale, stride=stride, flip=False)
+        self.keyframe_keys = None
+        self.frames = 0
+        self.keyframes = 0
+        self.warnings = 0
+
+    def occupancy(self, depth_image):
+        """
+        回傳:
+        np.ndarray: 深度圖像佔用的體素鍵（已排序且不重複）。
+        """
+        return np.unique(voxel_keys(self.projector.project(depth_image), self.voxel_size))
+
+    def update(self, depth_image):
+        """
+        估計一幀與上一關鍵幀的重疊比例，低於 keyframe_threshold 時以此幀作為新的關鍵幀。
+
+        參數:
+        depth_image (np.ndarray): uint16 深度圖像。
+
+        回傳:
+        OverlapResult: 估計結果。
+        """
+        self.frames += 1
+        keys = self.occupancy(depth_image)
+        if len(keys) < self.min_voxels:
+            self.warnings += 1
+            return OverlapResult(0.0, False, True)
+
+        if self.keyframe_keys is None:
+            self.keyframe_keys = keys
+            self.keyframes += 1
+            return OverlapResult(1.0, True, False)
+
+        ratio = np.count_nonzero(np.isin(keys, self.keyframe_keys, assume_unique=True)) / len(keys)
+        is_keyframe = ratio < self.keyframe_threshold
+        if is_keyframe:
+            self.keyframe_keys = keys
+            self.keyframes += 1
+        warning = ratio < self.warn_threshold
+        if warning:
+            self.warnings += 1
+        return OverlapResult(float(ratio), is_keyframe, warning)
+
+    def reset(self):
+        """
+        清除關鍵幀與計數。
+        """
+        self.keyframe_keys = None
+        self.frames = 0
+        self.keyframes = 0
+        self.warnings = 0
+
+    def get_stats(self):
+        """
+        回傳:
+        dict: 包含 'frames'、'keyframes' 與 'warnings' 的字典。
+        """
+        return {'frames': self.frames, 'keyframes': self.keyframes, 'warnings': self.warnings}
+
+if __name__ == "__main__":
+    # 以平移的合成平面估計每幀耗時與重疊比例
+    height, width, n_frames = 480, 640, 60
+    intrinsics = {'fx': 600.0, 'fy': 600.0, 'ppx': 320.0, 'ppy': 240.0}
+    u = np.arange(width)[None, :]
+    v = np.arange(height)[:, None]
+    estimator = OverlapEstimator(intrinsics, (height, width))
+    start = time.perf_counter()
+    for i in range(n_frames):
+        depth = (1500 + 300 * np.sin((u + 2 * i) / 80.0) + 0.5 * v).astype(np.uint16)
+        result = estimator.update(depth)
+        if result.is_keyframe:
+            print(f"frame {i:2d}: overlap {result.ratio:.2f} -> keyframe")
+    elapsed_ms = 1000.0 * (time.perf_counter() - start) / n_frames
+    print(f"{elapsed_ms:.2f} ms/frame, {estimator.get_stats()}")
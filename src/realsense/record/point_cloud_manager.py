@@ -2,114 +2,234 @@ import multiprocessing
 import threading
 import time
 import numpy as np
-import ctypes
-from queue import Queue
+from collections import deque
+from queue import Queue, Empty, Full
 import open3d as o3d
+from depth_projection import DepthBackProjector
+from voxel_map import VoxelHashMap
+from frame_tracker import KeyframeTracker
+from live_tsdf import LiveTSDFIntegrator
+
+# 隊列中表示生產者已結束的標記
+STOP = None
+# 保留的最近位姿數量
+POSE_HISTORY = 1000
+# 等待新幀時處理窗口事件的間隔（秒）
+POLL_INTERVAL = 0.05
 
 class PointCloudManager:
-    def __init__(self, depth_image_shape, data_queue, shared_depth_image, stop_event, intrinsics_dict, voxel_size=0.02):
+    def __init__(self, depth_image_shape, depth_ring, stop_event, intrinsics_dict, voxel_size=0.02, stride=1, max_voxels=1000000, tracking="keyframe",
+                 live_tsdf=False, tsdf_voxel_size=0.05, tsdf_rate=2.0):
         """
         初始化 PointCloudManager。
 
         參數:
         depth_image_shape (tuple): 深度圖像的形狀 (height, width)。
-        data_queue (multiprocessing.Queue): 用於接收新數據的隊列。
-        shared_depth_image (multiprocessing.Array): 共享的深度圖像數組。
+        depth_ring (SharedFrameRing): 共享記憶體的深度幀環形緩衝區。
         stop_event (multiprocessing.Event): 用於停止所有線程的事件。
         intrinsics_dict (dict): 相機內參字典，包含 'fx', 'fy', 'ppx', 'ppy'。
         voxel_size (float, optional): 體素大小，用於下採樣點雲。預設為 0.02。
+        stride (int, optional): 轉換點雲時的像素取樣間隔。預設為 1。
+        max_voxels (int, optional): 全域地圖的體素數量上限。預設為 1000000。
+        tracking (str, optional): 追蹤方式，"keyframe" 為與關鍵幀窗口的局部模型配準，
+            "pairwise" 為與上一幀進行兩次 ICP。預設為 "keyframe"。
+        live_tsdf (bool, optional): 是否將已追蹤的幀融合到即時 TSDF 預覽重建中，需要 "keyframe" 追蹤。
+            在點雲窗口按 T 顯示 TSDF 網格，按 P 返回點雲地圖。預設為 False。
+        tsdf_voxel_size (float, optional): 即時 TSDF 的體素大小（米）。預設為 0.05。
+        tsdf_rate (float, optional): 即時 TSDF 每秒最多融合的幀數。預設為 2.0。
         """
-        self.data_queue = data_queue
+        if tracking not in ("keyframe", "pairwise"):
+            raise ValueError(f"Unsupported tracking mode: {tracking}")
+        if live_tsdf and tracking != "keyframe":
+            raise ValueError("Live TSDF requires keyframe tracking")
         self.depth_image_shape = depth_image_shape
-        self.shared_depth_image = shared_depth_image
+        self.depth_ring = depth_ring
         self.stop_event = stop_event
         self.intrinsics_dict = intrinsics_dict
         self.voxel_size = voxel_size
+        self.projector = DepthBackProjector(intrinsics_dict, depth_image_shape, stride=stride)
         self.threads = []
-        self.point_cloud_queue = Queue()
-        self.point_clouds = []
-        self.transformation_matrices = []
+        # 只保留最新的一幀，配準來不及時舊幀直接被取代，記憶體不會隨錄製時間增長
+        self.point_cloud_queue = Queue(maxsize=1)
+        self.closed = threading.Event()
+        self.received_frames = 0
+        self.replaced_frames = 0
+        self.previous_pcd = None
+        self.tracker = KeyframeTracker(voxel_size) if tracking == "keyframe" else None
+        self.voxel_map = VoxelHashMap(voxel_size, max_voxels)
+        self.transformation_matrices = deque(maxlen=POSE_HISTORY)
+        self.tsdf = LiveTSDFIntegrator(intrinsics_dict, voxel_size=tsdf_voxel_size, integrate_rate=tsdf_rate) if live_tsdf else None
+        self.show_tsdf = False
+        self.refresh_tsdf = False
 
     def add_point_cloud(self):
         """
-        從數據隊列中獲取深度圖像，並將其添加到點雲隊列中。
+        從環形緩衝區阻塞讀取最新的深度幀，直接在共享記憶體上轉換為點雲後放入點雲隊列。
+        結束時放入 STOP 標記，通知可視化線程退出。
+        """
+        last_seq = 0
+        try:
+            while not self.should_stop() and not self.depth_ring.is_closed():
+                with self.depth_ring.read_latest(last_seq, timeout=0.5) as frame:
+                    if frame is None:
+                        continue
+                    last_seq, _, depth_image_np = frame
+                    # 轉換結果位於重複使用的緩衝區，交給其他線程前複製有效點
+                    points = self.convert_depth_to_pointcloud(depth_image_np).copy()
+                    depth_small = self.tsdf.downsample(depth_image_np) if self.tsdf is not None else None
+                self.received_frames += 1
+                self.put_latest((points, depth_small))
+        finally:
+            self.put_latest(STOP)
+
+    def put_latest(self, item):
+        """
+        將項目放入只保留一項的點雲隊列，尚未被取走的舊幀會被取代（只有一個生產者）。
+
+        參數:
+        item (tuple): (點雲, 取樣後的深度圖像) 或 STOP。
+        """
+        while True:
+            try:
+                self.point_cloud_queue.put_nowait(item)
+                return
+            except Full:
+                try:
+                    self.point_cloud_queue.get_nowait()
+                    self.replaced_frames += 1
+                except Empty:
+                    pass
+
+    def should_stop(self):
+        """
+        回傳:
+        bool: 是否收到停止事件或可視化窗口已關閉。
         """
-        while not self.stop_event.is_set():
-            if not self.data_queue.empty():
-                signal = self.data_queue.get()  # 接收信號
-                if signal:
-                    depth_image_np = np.frombuffer(self.shared_depth_image.get_obj(), dtype=np.uint16).reshape(self.depth_image_shape)
-                    self.point_cloud_queue.put(depth_image_np)
+        return self.stop_event.is_set() or self.closed.is_set()
 
     def visualize_point_cloud(self):
         """
         可視化點雲數據。
         """
-        vis = o3d.visualization.Visualizer()
+        vis = o3d.visualization.VisualizerWithKeyCallback()
         vis.create_window(window_name='Point Cloud Visualizer')
         
         # 創建一個初始的虛擬點雲數據以避免 Open3D 警告
         initial_points = np.random.rand(5, 3)
         pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(initial_points))
         vis.add_geometry(pcd)
+        mesh = None
 
-        while not self.stop_event.is_set():
-            if not self.point_cloud_queue.empty():
-                depth_image_np = self.point_cloud_queue.get()
-                
-                # 將深度圖像轉換為點雲
-                points = self.convert_depth_to_pointcloud(depth_image_np)
-                new_pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points))
-                new_pcd = new_pcd.voxel_down_sample(self.voxel_size)
-                new_pcd.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=self.voxel_size * 2, max_nn=30))
-
-                if len(self.point_clouds) > 0:
-                    # 與上一个點雲進行配準
-                    transformation_icp, _ = self.pairwise_registration(self.point_clouds[-1], new_pcd)
-                    new_pcd.transform(transformation_icp)
-                    self.transformation_matrices.append(transformation_icp)
-
-                self.point_clouds.append(new_pcd)
-                combined_pcd = self.get_combined_point_cloud()
+        if self.tsdf is not None:
+            self.tsdf.start()
+            vis.register_key_callback(ord("T"), self.on_show_tsdf)
+            vis.register_key_callback(ord("P"), self.on_show_points)
+
+        while not self.should_stop():
+            if self.refresh_tsdf:
+                # 只在按鍵時提取網格，不在每幀提取
+                self.refresh_tsdf = False
+                if mesh is not None:
+                    vis.remove_geometry(mesh, reset_bounding_box=False)
+                    mesh = None
+                else:
+                    vis.remove_geometry(pcd, reset_bounding_box=False)
+                if self.show_tsdf:
+                    mesh = self.tsdf.extract_triangle_mesh()
+                    mesh.compute_vertex_normals()
+                    vis.add_geometry(mesh, reset_bounding_box=False)
+                else:
+                    vis.add_geometry(pcd, reset_bounding_box=False)
+
+            # 阻塞等待新幀，逾時只處理窗口事件（需要時才重繪），閒置時不佔用 CPU
+            try:
+                item = self.point_cloud_queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                if not vis.poll_events():
+                    self.closed.set()
+                continue
+            if item is STOP:
+                break
+            points, depth_small = item
+
+            new_pcd = self.register_frame(points)
+            if new_pcd is not None:
+                # 只將新的點合併到體素地圖，不重新合併所有點雲
+                self.voxel_map.integrate(np.asarray(new_pcd.points))
+                if self.tsdf is not None:
+                    self.tsdf.submit(depth_small, self.transformation_matrices[-1])
 
                 # 更新點雲數據並渲染
-                pcd.points = combined_pcd.points
-                pcd.colors = combined_pcd.colors
-                vis.update_geometry(pcd)
-                vis.poll_events()
-                vis.update_renderer()
-            else:
-                pass
-                #time.sleep(0.1)
+                pcd.points = o3d.utility.Vector3dVector(self.voxel_map.get_points().astype(np.float64))
+                if mesh is None:
+                    vis.update_geometry(pcd)
+            if not vis.poll_events():
+                self.closed.set()
+            vis.update_renderer()
 
+        # 窗口關閉時通知生產者線程退出
+        self.closed.set()
+        if self.tsdf is not None:
+            self.tsdf.stop()
         vis.destroy_window()
 
-    def convert_depth_to_pointcloud(self, depth_image):
+    def on_show_tsdf(self, vis):
+        """
+        按鍵回調：提取並顯示目前的 TSDF 網格（再次按下會重新提取）。
+        """
+        self.show_tsdf = True
+        self.refresh_tsdf = True
+        return False
+
+    def on_show_points(self, vis):
+        """
+        按鍵回調：返回顯示點雲地圖。
+        """
+        if self.show_tsdf:
+            self.show_tsdf = False
+            self.refresh_tsdf = True
+        return False
+
+    def register_frame(self, points):
         """
-        將深度圖像轉換為點雲。
+        將一幀點雲下採樣並配準到全域座標。
 
         參數:
-        depth_image (np.ndarray): 深度圖像數組。
+        points (np.ndarray): (n, 3) 相機座標系下的點。
 
         回傳:
-        np.ndarray: 點雲數據。
+        o3d.geometry.PointCloud: 全域座標下的點雲；幾乎沒有移動而跳過時為 None。
         """
-        fx, fy = self.intrinsics_dict['fx'], self.intrinsics_dict['fy']
-        cx, cy = self.intrinsics_dict['ppx'], self.intrinsics_dict['ppy']
+        new_pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points.astype(np.float64)))
+        new_pcd = new_pcd.voxel_down_sample(self.voxel_size)
+
+        if self.tracker is not None:
+            result = self.tracker.track(new_pcd)
+            if result.skipped:
+                return None
+            self.transformation_matrices.append(result.pose)
+            return new_pcd.transform(result.pose)
 
-        height, width = depth_image.shape
-        x, y = np.meshgrid(np.arange(width), np.arange(height))
-        z = depth_image / 1000.0  # 轉換為米
+        new_pcd.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=self.voxel_size * 2, max_nn=30))
+        if self.previous_pcd is not None:
+            # 與上一个點雲進行配準
+            transformation_icp, _ = self.pairwise_registration(self.previous_pcd, new_pcd)
+            new_pcd.transform(transformation_icp)
+            self.transformation_matrices.append(transformation_icp)
+        self.previous_pcd = new_pcd
+        return new_pcd
 
-        x = (x - cx) * z / fx
-        y = (y - cy) * z / fy
+    def convert_depth_to_pointcloud(self, depth_image):
+        """
+        將深度圖像轉換為點雲（翻轉 x 和 y 軸，只包含深度有效的像素）。
 
-        # 翻轉 x 和 y 軸
-        x = -x
-        y = -y
+        參數:
+        depth_image (np.ndarray): 深度圖像數組。
 
-        points = np.stack((x, y, z), axis=-1).reshape(-1, 3)
-        return points
+        回傳:
+        np.ndarray: (n, 3) float32 點雲數據，位於重複使用的緩衝區中，下一幀會被覆寫。
+        """
+        return self.projector.project(depth_image)
 
     def pairwise_registration(self, source, target):
         """
@@ -136,15 +256,23 @@ class PointCloudManager:
 
     def get_combined_point_cloud(self):
         """
-        獲取合併的點雲。
+        獲取合併的點雲（體素地圖中每個體素的平均位置）。
 
         回傳:
         o3d.geometry.PointCloud: 合併後的點雲。
         """
-        combined_pcd = o3d.geometry.PointCloud()
-        for pcd in self.point_clouds:
-            combined_pcd += pcd
-        return combined_pcd
+        return o3d.geometry.PointCloud(o3d.utility.Vector3dVector(self.voxel_map.get_points().astype(np.float64)))
+
+    def get_tsdf_mesh(self):
+        """
+        提取即時 TSDF 的三角網格。
+
+        回傳:
+        o3d.geometry.TriangleMesh: 網格；未啟用即時 TSDF 時為 None。
+        """
+        if self.tsdf is None:
+            return None
+        return self.tsdf.extract_triangle_mesh()
 
     def start(self):
         """
@@ -163,18 +291,29 @@ class PointCloudManager:
         """
         for t in self.threads:
             t.join()
+        self.threads = []
+
+    def get_counters(self):
+        """
+        回傳:
+        dict: 包含 'received'（已轉換的幀數）與 'replaced'（未配準即被較新幀取代的幀數）的字典。
+        """
+        return {'received': self.received_frames, 'replaced': self.replaced_frames}
 
-def run_point_cloud_manager(depth_image_shape, data_queue, shared_depth_image, stop_event, intrinsics_dict):
+def run_point_cloud_manager(depth_image_shape, depth_ring, stop_event, intrinsics_dict, manager_options=None):
     """
     運行點雲管理器。
 
     參數:
     depth_image_shape (tuple): 深度圖像的形狀 (height, width)。
-    data_queue (multiprocessing.Queue): 用於接收新數據的隊列。
-    shared_depth_image (multiprocessing.Array): 共享的深度圖像數組。
+    depth_ring (SharedFrameRing): 共享記憶體的深度幀環形緩衝區。
     stop_event (multiprocessing.Event): 用於停止所有線程的事件。
     intrinsics_dict (dict): 相機內參字典，包含 'fx', 'fy', 'ppx', 'ppy'。
+    manager_options (dict, optional): 傳給 PointCloudManager 的其他參數。預設為 None。
     """
-    point_cloud_manager = PointCloudManager(depth_image_shape, data_queue, shared_depth_image, stop_event, intrinsics_dict)
+    point_cloud_manager = PointCloudManager(depth_image_shape, depth_ring, stop_event, intrinsics_dict, **(manager_options or {}))
     point_cloud_manager.start()
     point_cloud_manager.join()
+    counters = point_cloud_manager.get_counters()
+    print(f"Point cloud manager: received {counters['received']} frames, replaced {counters['replaced']} before registration")
+    depth_ring.close()
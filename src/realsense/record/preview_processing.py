@@ -0,0 +1,181 @@
+import time
+import threading
+from functools import lru_cache
+import numpy as np
+import cv2
+
+@lru_cache(maxsize=4)
+def get_depth_colormap_lut(alpha=0.09, colormap=cv2.COLORMAP_JET):
+    """
+    獲取 uint16 深度值到 BGR 顏色的查找表（快取）。
+
+    查找表與 cv2.applyColorMap(cv2.convertScaleAbs(depth, alpha=alpha), colormap) 的結果逐值一致。
+    每個條目打包為一個 uint32 (B, G, R, 0)，查表時每個像素只需一次 4 位元組的讀取。
+
+    參數:
+    alpha (float, optional): 深度縮放比例。預設為 0.09。
+    colormap (int, optional): OpenCV 色彩映射。預設為 cv2.COLORMAP_JET。
+
+    回傳:
+    np.ndarray: 長度為 65536 的 uint32 查找表（唯讀）。
+    """
+    all_depths = np.arange(65536, dtype=np.uint16).reshape(256, 256)
+    bgr = cv2.applyColorMap(cv2.convertScaleAbs(all_depths, alpha=alpha), colormap).reshape(65536, 3)
+    packed = np.zeros((65536, 4), dtype=np.uint8)
+    packed[:, :3] = bgr
+    lut = packed.view(np.uint32).reshape(65536)
+    lut.flags.writeable = False
+    return lut
+
+class PreviewProcessor:
+    STEPS = ("mask", "colorize", "total")
+
+    def __init__(self, clipping_distance, grey_color=153, alpha=0.09, n_buffers=3):
+        """
+        初始化 PreviewProcessor。
+
+        以快取的查找表進行深度著色，並將背景移除的結果寫入預先分配的輸出緩衝區，
+        每幀不再配置新的全幅數組。輸出緩衝區輪流使用，回傳的數組只在之後 n_buffers - 1
+        次調用之內保持不變，保留更久的接收者必須自行複製：GUI 的 FrameChannel 以 copy_arrays=True
+        在 push() 時複製，因此不受 GUI 線程落後多少幀影響。
+
+        參數:
+        clipping_distance (float): 剪切距離（深度單位）。
+        grey_color (int, optional): 背景填充灰度。預設為 153。
+        alpha (float, optional): 深度著色的縮放比例。預設為 0.09。
+        n_buffers (int, optional): 輸出緩衝區組數。預設為 3。
+        """
+        self.clipping_distance = clipping_distance
+        # depth > clipping_distance 等價於 depth > floor(clipping_distance)
+        self.max_valid_depth = int(min(65535, max(0, np.floor(clipping_distance))))
+        self.grey_color = grey_color
+        self.lut = get_depth_colormap_lut(alpha)
+        self.n_buffers = max(1, n_buffers)
+        self.shape = None
+        self.buffers = []
+        self.buffer_index = 0
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.totals = dict.fromkeys(self.STEPS, 0.0)
+        self.maxima = dict.fromkeys(self.STEPS, 0.0)
+        self.last = dict.fromkeys(self.STEPS, 0.0)
+
+    def allocate(self, depth_shape, color_shape):
+        """
+        依照幀的形狀分配輸出與遮罩緩衝區。
+
+        參數:
+        depth_shape (tuple): 深度圖像形狀 (h, w)。
+        color_shape (tuple): 顏色圖像形狀 (h, w, 3)。
+        """
+        self.shape = (depth_shape, color_shape)
+        self.mask = np.empty(depth_shape, dtype=np.uint8)
+        self.packed = np.empty(depth_shape, dtype=np.uint32)
+        self.buffers = [
+            (np.empty(depth_shape + (3,), dtype=np.uint8), np.empty(color_shape, dtype=np.uint8))
+            for _ in range(self.n_buffers)
+        ]
+        self.buffer_index = 0
+
+    def process(self, depth_image, color_image):
+        """
+        生成預覽圖像。
+
+        參數:
+        depth_image (np.ndarray): uint16 深度圖像。
+        color_image (np.ndarray): 顏色圖像。
+
+        回傳:
+        tuple: (深度彩色映射, 移除背景後的顏色圖像)。
+        """
+        start = time.perf_counter()
+        if self.shape != (depth_image.shape, color_image.shape):
+            self.allocate(depth_image.shape, color_image.shape)
+        depth_out, color_out = self.buffers[self.buffer_index]
+        self.buffer_index = (self.buffer_index + 1) % self.n_buffers
+
+        # 背景移除：先填滿灰色，再只複製深度在 (0, 剪切距離] 之內的像素
+        cv2.inRange(depth_image, 1, self.max_valid_depth, dst=self.mask)
+        color_out.fill(self.grey_color)
+        cv2.copyTo(color_image, self.mask, color_out)
+        mask_done = time.perf_counter()
+
+        # 深度著色：查表寫入打包緩衝區，再去掉填充通道寫入輸出緩衝區
+        np.take(self.lut, depth_image, out=self.packed, mode='clip')
+        cv2.cvtColor(self.packed.view(np.uint8).reshape(depth_image.shape + (4,)), cv2.COLOR_BGRA2BGR, dst=depth_out)
+        done = time.perf_counter()
+
+        self.record_timing({'mask': mask_done - start, 'colorize': done - mask_done, 'total': done - start})
+        return depth_out, color_out
+
+    def record_timing(self, timings):
+        """
+        記錄每一步驟的耗時。
+
+        參數:
+        timings (dict): 步驟名稱到耗時（秒）的字典。
+        """
+        with self.lock:
+            self.frames += 1
+            for step, value in timings.items():
+                self.totals[step] += value
+                self.last[step] = value
+                self.maxima[step] = max(self.maxima[step], value)
+
+    def get_stats(self):
+        """
+        獲取每幀處理耗時統計。
+
+        回傳:
+        dict: 包含 'frames' 以及每一步驟的 'mean_ms'、'last_ms'、'max_ms'。
+        """
+        with self.lock:
+            stats = {'frames': self.frames}
+            for step in self.STEPS:
+                stats[step] = {
+                    'mean_ms': 1000.0 * self.totals[step] / self.frames if self.frames else 0.0,
+                    'last_ms': 1000.0 * self.last[step],
+                    'max_ms': 1000.0 * self.maxima[step]
+                }
+            return stats
+
+def legacy_process(depth_image, color_image, clipping_distance, grey_color=153):
+    """
+    原本的預覽處理方式，用於比較。
+
+    參數:
+    depth_image (np.ndarray): uint16 深度圖像。
+    color_image (np.ndarray): 顏色圖像。
+    clipping_distance (float): 剪切距離。
+    grey_color (int, optional): 背景填充灰度。預設為 153。
+
+    回傳:
+    tuple: (深度彩色映射, 移除背景後的顏色圖像)。
+    """
+    depth_image_3d = np.dstack((depth_image, depth_image, depth_image))
+    bg_removed = np.where((depth_image_3d > clipping_distance) | (depth_image_3d <= 0), grey_color, color_image)
+    depth_colormap = cv2.applyColorMap(cv2.convertScaleAbs(depth_image, alpha=0.09), cv2.COLORMAP_JET)
+    return depth_colormap, bg_removed
+
+if __name__ == "__main__":
+    # 以隨機數據比較原本的處理方式與查表方式的每幀耗時
+    height, width, n_frames = 720, 1280, 100
+    rng = np.random.default_rng(0)
+    depth = rng.integers(0, 6000, size=(height, width), dtype=np.uint16)
+    color = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    clipping_distance = 3000
+
+    start = time.perf_counter()
+    for _ in range(n_frames):
+        expected = legacy_process(depth, color, clipping_distance)
+    legacy_ms = 1000.0 * (time.perf_counter() - start) / n_frames
+
+    processor = PreviewProcessor(clipping_distance)
+    for _ in range(n_frames):
+        result = processor.process(depth, color)
+    assert np.array_equal(result[0], expected[0]) and np.array_equal(result[1], expected[1])
+
+    stats = processor.get_stats()
+    print(f"{width}x{height}, {n_frames} frames")
+    print(f"legacy : {legacy_ms:.2f} ms/frame")
+    print(f"lut    : {stats['total']['mean_ms']:.2f} ms/frame (mask {stats['mask']['mean_ms']:.2f}, colorize {stats['colorize']['mean_ms']:.2f})")
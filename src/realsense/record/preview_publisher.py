@@ -0,0 +1,135 @@
+import threading
+import time
+import cv2
+
+class PreviewPublisher:
+    def __init__(self, render, callback, display_rate=15, display_scale=1.0, stats=None):
+        """
+        初始化 PreviewPublisher。
+
+        擷取線程只調用 submit() 交出最新的一幀，背景移除、深度著色與發送到 GUI 都在
+        發佈線程中以固定的顯示頻率進行。發佈線程來不及處理的舊幀會被直接覆蓋，
+        因此擷取吞吐量不再受 Qt 繪製速度影響。
+
+        參數:
+        render (callable): 預覽處理函數，接收 (depth_image, color_image)，回傳 (depth_display, color_display)。
+        callback (callable): 發送函數，接收 (mode, data)。
+        display_rate (float, optional): 顯示頻率 (Hz)。預設為 15。
+        display_scale (float, optional): 預覽圖像的縮放比例。預設為 1.0。
+        stats (CaptureStats, optional): 若提供，記錄預覽處理（"render"）與 GUI 回調（"gui_callback"）的耗時。預設為 None。
+        """
+        self.render = render
+        self.callback = callback
+        self.display_rate = display_rate
+        self.display_scale = display_scale
+        self.stats = stats
+        self.lock = threading.Lock()
+        self.frame_event = threading.Event()
+        self.stop_flag = threading.Event()
+        self.thread = None
+        self.latest = None
+        self.submitted = 0
+        self.published = 0
+
+    def start(self):
+        """
+        啟動發佈線程。
+        """
+        if self.thread is None:
+            self.stop_flag.clear()
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """
+        停止發佈線程。
+        """
+        self.stop_flag.set()
+        self.frame_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, depth_image, color_image):
+        """
+        交出最新的一幀，覆蓋尚未發佈的舊幀。
+
+        參數:
+        depth_image (np.ndarray): 深度圖像數組。
+        color_image (np.ndarray): 顏色圖像數組。
+        """
+        with self.lock:
+            self.latest = (depth_image, color_image)
+            self.submitted += 1
+        self.frame_event.set()
+
+    def get_counters(self):
+        """
+        獲取發佈計數器。
+
+        回傳:
+        dict: 包含 'submitted'、'published' 與 'skipped' 的字典。
+        """
+        with self.lock:
+            return {
+                'submitted': self.submitted,
+                'published': self.published,
+                'skipped': self.submitted - self.published
+            }
+
+    def downscale(self, depth_image, color_image):
+        """
+        依照 display_scale 縮小預覽圖像。
+
+        參數:
+        depth_image (np.ndarray): 深度圖像數組。
+        color_image (np.ndarray): 顏色圖像數組。
+
+        回傳:
+        tuple: 縮小後的 (depth_image, color_image)。
+        """
+        if self.display_scale == 1.0:
+            return depth_image, color_image
+        height, width = depth_image.shape[:2]
+        size = (max(1, int(width * self.display_scale)), max(1, int(height * self.display_scale)))
+        # 深度使用最近鄰插值，避免在物體邊緣產生不存在的深度值
+        depth_small = cv2.resize(depth_image, size, interpolation=cv2.INTER_NEAREST)
+        color_small = cv2.resize(color_image, size, interpolation=cv2.INTER_AREA)
+        return depth_small, color_small
+
+    def run(self):
+        """
+        發佈線程的主循環。
+        """
+        interval = 1.0 / self.display_rate if self.display_rate > 0 else 0.0
+        next_time = time.perf_counter()
+        while not self.stop_flag.is_set():
+            if not self.frame_event.wait(timeout=0.5):
+                continue
+
+            # 等待到下一個顯示時刻，期間到達的幀會互相覆蓋
+            delay = next_time - time.perf_counter()
+            if delay > 0 and self.stop_flag.wait(delay):
+                break
+
+            with self.lock:
+                frame = self.latest
+                self.latest = None
+                self.frame_event.clear()
+            if frame is None:
+                continue
+            next_time = time.perf_counter() + interval
+
+            try:
+                start = time.perf_counter()
+                depth_image, color_image = self.downscale(*frame)
+                depth_display, color_display = self.render(depth_image, color_image)
+                rendered = time.perf_counter()
+                self.callback("record_imgs", {"depth_image": depth_display, "color_image": color_display})
+                if self.stats is not None:
+                    self.stats.add_timing("render", rendered - start, per_frame=False)
+                    self.stats.add_timing("gui_callback", time.perf_counter() - rendered, per_frame=False)
+                with self.lock:
+                    self.published += 1
+            except Exception as e:
+                print(f"Error publishing preview: {e}")
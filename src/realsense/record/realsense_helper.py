@@ -44,9 +44,21 @@ def get_profiles():
 
     return color_profiles, depth_profiles
 
+def get_serial_numbers():
+    """
+    獲取所有已連接的 RealSense 設備的序號。
+
+    回傳:
+    list: 設備序號列表。
+    """
+    ctx = rs.context()
+    return [device.get_info(rs.camera_info.serial_number) for device in ctx.query_devices()]
+
 if __name__ == "__main__":
     color_profiles, depth_profiles = get_profiles()
     print("Color profiles:")
     print(color_profiles)
     print("Depth profiles:")
     print(depth_profiles)
+    print("Serial numbers:")
+    print(get_serial_numbers())
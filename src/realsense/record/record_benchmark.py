@@ -0,0 +1,133 @@
+import argparse
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from RealSenseRecorder import Args, RealSenseRecorder
+from frame_source import SyntheticSource, FolderSource
+
+def run_benchmark(source, output_folder, fps=30, duration=None, record_format="imgs", depth_codec="png",
+                  writer_workers=2, writer_queue_size=64, writer_policy="block", writer_use_processes=False,
+                  stats_dump_path=None, estimate_overlap=False, keyframe_filter=False):
+    """
+    以指定的幀來源端到端執行 RealSenseRecorder.record()，並回傳吞吐量統計。
+
+    參數:
+    source (FrameSource): 幀來源。
+    output_folder (str): 錄製輸出資料夾（會被清空）。
+    fps (float, optional): 預期幀率，用於判斷延遲幀。預設為 30。
+    duration (float, optional): 錄製秒數，None 表示直到幀來源結束。預設為 None。
+    record_format (str, optional): "imgs" 或 "chunks"。預設為 "imgs"。
+    depth_codec (str, optional): 深度編碼方式，"imgs" 時為深度文件的編碼，"chunks" 時為容器的深度編碼。預設為 "png"。
+    writer_workers (int, optional): 圖像編碼工作者數量。預設為 2。
+    writer_queue_size (int, optional): 寫入隊列的最大長度。預設為 64。
+    writer_policy (str, optional): 寫入隊列的背壓策略。預設為 "block"。
+    writer_use_processes (bool, optional): 是否以進程進行編碼。預設為 False。
+    stats_dump_path (str, optional): 擷取統計的 .json 或 .csv 輸出文件。預設為 None。
+    estimate_overlap (bool, optional): 是否在擷取循環中估計重疊比例。預設為 False。
+    keyframe_filter (bool, optional): 是否只保存關鍵幀篩選保留的幀。預設為 False。
+
+    回傳:
+    dict: 包含 'elapsed_s'、'written'、'throughput_fps'、'preview_frames' 以及 RealSenseRecorder.get_stats() 的結果。
+    """
+    args = Args(output_folder, record_rosbag=False, record_imgs=True, playback_rosbag=False,
+                calculate_overlap=False, overwrite=True, fps=fps,
+                writer_workers=writer_workers, writer_queue_size=writer_queue_size,
+                writer_policy=writer_policy, writer_use_processes=writer_use_processes,
+                record_format=record_format, depth_codec=depth_codec,
+                chunk_depth_codec="zlib" if depth_codec == "png" else depth_codec, stats_interval=0, stats_dump_path=stats_dump_path,
+                estimate_overlap=estimate_overlap, keyframe_filter=keyframe_filter)
+
+    preview_frames = [0]
+    def callback(mode, data):
+        if mode == "record_imgs":
+            preview_frames[0] += 1
+        elif mode == "show_error":
+            print(f"{data['title']}: {data['message']}")
+
+    recorder = RealSenseRecorder(args, callback, source=source)
+    recorder.is_running = True
+    recorder.is_recording = True
+
+    start = time.perf_counter()
+    thread = threading.Thread(target=recorder.record)
+    thread.start()
+    if duration is not None:
+        thread.join(duration)
+        recorder.stop_recording()
+        recorder.stop_pipeline()
+    thread.join()
+    # 包含寫入器排空隊列的時間，即持續吞吐量
+    elapsed = time.perf_counter() - start
+
+    stats = recorder.get_stats()
+    written = stats['writer']['written'] if stats['writer'] is not None else 0
+    return {
+        'elapsed_s': elapsed,
+        'written': written,
+        'throughput_fps': written / elapsed if elapsed > 0 else 0.0,
+        'preview_frames': preview_frames[0],
+        'stats': stats
+    }
+
+def print_report(result):
+    """
+    輸出基準測試結果。
+
+    參數:
+    result (dict): run_benchmark() 的結果。
+    """
+    capture = result['stats']['capture']
+    writer = result['stats']['writer']
+    print(f"Captured {capture['frames']} frames, wrote {result['written']} in {result['elapsed_s']:.2f} s")
+    print(f"Sustained throughput: {result['throughput_fps']:.1f} fps (capture loop {capture['fps']:.1f} fps)")
+    print(f"Dropped {capture['dropped_frames']}, late {capture['late_frames']}, "
+          f"writer dropped {writer['dropped'] if writer else 0}, errors {writer['errors'] if writer else 0}, "
+          f"preview frames {result['preview_frames']}")
+    for name, stage in capture['stages'].items():
+        print(f"  {name:<16} n={stage['count']:<6} mean {stage['mean_ms']:7.2f} ms  p95 {stage['p95_ms']:7.2f} ms  max {stage['max_ms']:7.2f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark RealSenseRecorder.record() without a camera")
+    parser.add_argument("--source", choices=["synthetic", "folder"], default="synthetic", help="frame source")
+    parser.add_argument("--dataset", type=str, help="recorded folder (depth/, color/ or rgbd_chunks/) for --source folder")
+    parser.add_argument("--width", type=int, default=640, help="synthetic frame width")
+    parser.add_argument("--height", type=int, default=480, help="synthetic frame height")
+    parser.add_argument("--fps", type=float, default=30, help="source frame rate")
+    parser.add_argument("--frames", type=int, default=300, help="number of synthetic frames")
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--realtime", action="store_true", help="pace the source at --fps instead of running flat out")
+    parser.add_argument("--loop", action="store_true", help="loop the folder source (use with --duration)")
+    parser.add_argument("--record_format", choices=["imgs", "chunks"], default="imgs")
+    parser.add_argument("--depth_codec", choices=["png", "rvl", "zstd"], default="png", help="depth codec (png uses zlib in chunks)")
+    parser.add_argument("--writer_workers", type=int, default=2)
+    parser.add_argument("--writer_queue_size", type=int, default=64)
+    parser.add_argument("--writer_policy", choices=["block", "drop_oldest", "fail"], default="block")
+    parser.add_argument("--writer_use_processes", action="store_true")
+    parser.add_argument("--output", type=str, default=None, help="output folder (overwritten); a temporary folder is used by default")
+    parser.add_argument("--stats_dump", type=str, default=None, help="write capture stats to this .json or .csv file")
+    parser.add_argument("--estimate_overlap", action="store_true", help="estimate keyframe overlap in the capture loop")
+    parser.add_argument("--keyframe_filter", action="store_true", help="write only frames that add new information")
+    args = parser.parse_args()
+
+    if args.source == "folder":
+        if not args.dataset:
+            parser.error("--source folder requires --dataset")
+        source = FolderSource(args.dataset, fps=args.fps, realtime=args.realtime, loop=args.loop, preload=True)
+    else:
+        source = SyntheticSource(args.width, args.height, fps=args.fps, num_frames=args.frames, realtime=args.realtime)
+
+    output_folder = args.output or tempfile.mkdtemp(prefix="record_benchmark_")
+    try:
+        result = run_benchmark(source, output_folder, fps=args.fps, duration=args.duration,
+                               record_format=args.record_format, depth_codec=args.depth_codec, writer_workers=args.writer_workers,
+                               writer_queue_size=args.writer_queue_size, writer_policy=args.writer_policy,
+                               writer_use_processes=args.writer_use_processes, stats_dump_path=args.stats_dump,
+                               estimate_overlap=args.estimate_overlap, keyframe_filter=args.keyframe_filter)
+        print_report(result)
+    finally:
+        if args.output is None:
+            shutil.rmtree(output_folder, ignore_errors=True)
@@ -0,0 +1,293 @@
+import json
+import threading
+from os import makedirs, listdir
+from os.path import exists, isfile, join
+import numpy as np
+import cv2
+from depth_codec import DEPTH_CODECS, encode_depth, decode_depth, resolve_depth_codec
+
+CONTAINER_FOLDER = "rgbd_chunks"
+HEADER_FILE = "container.json"
+INDEX_FILE = "index.bin"
+INTRINSIC_FILE = "intrinsic.json"
+CHUNK_TEMPLATE = "chunk_%05d.bin"
+FORMAT_VERSION = 1
+
+COLOR_CODECS = ("jpg", "raw")
+
+# 每一幀在索引文件中的固定長度記錄
+INDEX_DTYPE = np.dtype([
+    ('frame_id', '<i8'),
+    ('chunk', '<i8'),
+    ('depth_offset', '<i8'),
+    ('depth_size', '<i8'),
+    ('color_offset', '<i8'),
+    ('color_size', '<i8'),
+    ('timestamp', '<f8')
+])
+
+def is_rgbd_container(path_dataset):
+    """
+    檢查數據集資料夾內是否存在 RGBD 容器。
+
+    參數:
+    path_dataset (str): 數據集資料夾。
+
+    回傳:
+    bool: 是否存在容器。
+    """
+    return isfile(join(path_dataset, CONTAINER_FOLDER, HEADER_FILE))
+
+def encode_color(color_image, codec, jpeg_quality=95):
+    """
+    將顏色圖像編碼為位元組。
+
+    參數:
+    color_image (np.ndarray): 顏色圖像。
+    codec (str): 顏色編碼方式。
+    jpeg_quality (int, optional): JPEG 品質。預設為 95。
+
+    回傳:
+    bytes: 編碼後的數據。
+    """
+    if codec == "raw":
+        return np.ascontiguousarray(color_image).tobytes()
+    if codec == "jpg":
+        success, encoded = cv2.imencode(".jpg", color_image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+        if not success:
+            raise RuntimeError("Failed to encode color image")
+        return encoded.tobytes()
+    raise ValueError(f"Unsupported color codec: {codec}")
+
+def decode_color(buffer, codec, shape):
+    """
+    將位元組解碼為顏色圖像，通道順序與錄製時交給容器的數組相同。
+
+    參數:
+    buffer (buffer-like): 編碼後的數據。
+    codec (str): 顏色編碼方式。
+    shape (tuple): 顏色圖像形狀 (height, width, 3)。
+
+    回傳:
+    np.ndarray: 顏色圖像。
+    """
+    if codec == "raw":
+        return np.frombuffer(buffer, dtype=np.uint8).reshape(shape)
+    if codec == "jpg":
+        return cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_COLOR)
+    raise ValueError(f"Unsupported color codec: {codec}")
+
+class RGBDChunkWriter:
+    def __init__(self, path_output, width, height, intrinsic_matrix, depth_scale=0.001,
+                 depth_codec="zlib", color_codec="jpg", chunk_size=1 << 30):
+        """
+        初始化 RGBDChunkWriter。
+
+        所有幀依序追加到少量的大型 chunk 文件中，並以固定長度的索引記錄每幀的位置、
+        時間戳，取代每幀一個 PNG 與一個 JPG 的小文件。append() 可由多個線程同時調用，
+        編碼在鎖外進行，只有追加寫入是串行的。
+
+        參數:
+        path_output (str): 錄製輸出資料夾，容器會建立在其中的 rgbd_chunks 子資料夾。
+        width (int): 圖像寬度。
+        height (int): 圖像高度。
+        intrinsic_matrix (list): 以列為主的 3x3 內參矩陣（與 camera_intrinsic.json 相同格式）。
+        depth_scale (float, optional): 深度單位（米）。預設為 0.001。
+        depth_codec (str, optional): 深度編碼方式，見 depth_codec.DEPTH_CODECS；沒有安裝 zstandard 時 zstd 退回 zlib。預設為 "zlib"。
+        color_codec (str, optional): 顏色編碼方式。預設為 "jpg"。
+        chunk_size (int, optional): 單個 chunk 文件的最大位元組數。預設為 1 GiB。
+        """
+        depth_codec = resolve_depth_codec(depth_codec)
+        if color_codec not in COLOR_CODECS:
+            raise ValueError(f"Unsupported color codec: {color_codec}")
+        self.path_container = join(path_output, CONTAINER_FOLDER)
+        self.width = width
+        self.height = height
+        self.depth_codec = depth_codec
+        self.color_codec = color_codec
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.chunk_id = -1
+        self.chunk_file = None
+        self.chunk_offset = 0
+        self.frame_count = 0
+
+        if not exists(self.path_container):
+            makedirs(self.path_container)
+        if listdir(self.path_container):
+            raise RuntimeError(f"Container folder {self.path_container} is not empty")
+
+        header = {
+            'version': FORMAT_VERSION,
+            'width': width,
+            'height': height,
+            'depth_scale': depth_scale,
+            'depth_codec': depth_codec,
+            'color_codec': color_codec,
+            'chunk_template': CHUNK_TEMPLATE,
+            'intrinsic_matrix': list(intrinsic_matrix)
+        }
+        with open(join(self.path_container, HEADER_FILE), 'w') as outfile:
+            json.dump(header, outfile, indent=4)
+        with open(join(self.path_container, INTRINSIC_FILE), 'w') as outfile:
+            json.dump({'width': width, 'height': height, 'intrinsic_matrix': list(intrinsic_matrix)}, outfile, indent=4)
+        self.index_file = open(join(self.path_container, INDEX_FILE), 'ab')
+        self._open_next_chunk()
+
+    def _open_next_chunk(self):
+        """
+        關閉目前的 chunk 文件並開啟下一個。
+        """
+        if self.chunk_file is not None:
+            self.chunk_file.close()
+        self.chunk_id += 1
+        self.chunk_file = open(join(self.path_container, CHUNK_TEMPLATE % self.chunk_id), 'ab')
+        self.chunk_offset = 0
+
+    def _write_payload(self, payload):
+        """
+        寫入一段數據並補齊到 8 位元組邊界。
+
+        參數:
+        payload (bytes): 要寫入的數據。
+
+        回傳:
+        int: 數據在 chunk 文件中的偏移量。
+        """
+        offset = self.chunk_offset
+        self.chunk_file.write(payload)
+        padding = (-len(payload)) % 8
+        if padding:
+            self.chunk_file.write(b'\0' * padding)
+        self.chunk_offset += len(payload) + padding
+        return offset
+
+    def append(self, frame_id, depth_image, color_image, timestamp=0.0):
+        """
+        追加一幀。
+
+        參數:
+        frame_id (int): 幀編號。
+        depth_image (np.ndarray): uint16 深度圖像。
+        color_image (np.ndarray): 顏色圖像。
+        timestamp (float, optional): 時間戳（毫秒）。預設為 0.0。
+        """
+        depth_bytes = encode_depth(depth_image, self.depth_codec)
+        color_bytes = encode_color(color_image, self.color_codec)
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        with self.lock:
+            if self.chunk_offset > 0 and self.chunk_offset + len(depth_bytes) + len(color_bytes) + 16 > self.chunk_size:
+                self._open_next_chunk()
+            record['frame_id'] = frame_id
+            record['chunk'] = self.chunk_id
+            record['depth_offset'] = self._write_payload(depth_bytes)
+            record['depth_size'] = len(depth_bytes)
+            record['color_offset'] = self._write_payload(color_bytes)
+            record['color_size'] = len(color_bytes)
+            record['timestamp'] = timestamp
+            # 索引在數據之後寫入並立即刷新，中途崩潰時已索引的幀仍可讀取
+            self.chunk_file.flush()
+            self.index_file.write(record.tobytes())
+            self.index_file.flush()
+            self.frame_count += 1
+
+    def close(self):
+        """
+        關閉容器。
+        """
+        with self.lock:
+            if self.chunk_file is not None:
+                self.chunk_file.close()
+                self.chunk_file = None
+            if self.index_file is not None:
+                self.index_file.close()
+                self.index_file = None
+
+class RGBDChunkReader:
+    def __init__(self, path_dataset):
+        """
+        初始化 RGBDChunkReader。
+
+        以記憶體映射方式讀取 chunk 文件，幀按 frame_id 排序。
+
+        參數:
+        path_dataset (str): 錄製輸出資料夾（包含 rgbd_chunks 子資料夾）。
+        """
+        self.path_container = join(path_dataset, CONTAINER_FOLDER)
+        with open(join(self.path_container, HEADER_FILE)) as infile:
+            self.header = json.load(infile)
+        if self.header['version'] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported container version: {self.header['version']}")
+        self.width = self.header['width']
+        self.height = self.header['height']
+        self.depth_codec = self.header['depth_codec']
+        self.color_codec = self.header['color_codec']
+        self.path_intrinsic = join(self.path_container, INTRINSIC_FILE)
+
+        index = np.fromfile(join(self.path_container, INDEX_FILE), dtype=INDEX_DTYPE)
+        self.index = index[np.argsort(index['frame_id'], kind='stable')]
+        self.chunks = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def _chunk(self, chunk_id):
+        """
+        獲取 chunk 文件的記憶體映射（延遲開啟）。
+
+        參數:
+        chunk_id (int): chunk 編號。
+
+        回傳:
+        np.memmap: chunk 文件的唯讀映射。
+        """
+        chunk = self.chunks.get(chunk_id)
+        if chunk is None:
+            chunk = np.memmap(join(self.path_container, self.header['chunk_template'] % chunk_id), dtype=np.uint8, mode='r')
+            self.chunks[chunk_id] = chunk
+        return chunk
+
+    def read_depth(self, i):
+        """
+        讀取第 i 幀的深度圖像。
+
+        參數:
+        i (int): 幀索引。
+
+        回傳:
+        np.ndarray: uint16 深度圖像。
+        """
+        record = self.index[i]
+        chunk = self._chunk(int(record['chunk']))
+        offset = int(record['depth_offset'])
+        buffer = chunk[offset:offset + int(record['depth_size'])]
+        return decode_depth(buffer, self.depth_codec, (self.height, self.width))
+
+    def read_color(self, i):
+        """
+        讀取第 i 幀的顏色圖像。
+
+        參數:
+        i (int): 幀索引。
+
+        回傳:
+        np.ndarray: 顏色圖像，通道順序與錄製時傳入的陣列相同（與 cv2.imread 讀取單檔圖像一致）。
+        """
+        record = self.index[i]
+        chunk = self._chunk(int(record['chunk']))
+        offset = int(record['color_offset'])
+        buffer = chunk[offset:offset + int(record['color_size'])]
+        return decode_color(buffer, self.color_codec, (self.height, self.width, 3))
+
+    def get_timestamp(self, i):
+        """
+        回傳:
+        float: 第 i 幀的時間戳（毫秒）。
+        """
+        return float(self.index[i]['timestamp'])
+
+    def close(self):
+        """
+        釋放所有 chunk 文件的映射。
+        """
+        self.chunks = {}
@@ -0,0 +1,208 @@
+import multiprocessing
+from multiprocessing import shared_memory
+from contextlib import contextmanager
+import numpy as np
+
+# 標頭欄位位置 (int64)
+_LATEST_SLOT = 0
+_LATEST_SEQ = 1
+_CLOSED = 2
+_GLOBAL_FIELDS = 4
+# 每個槽位的欄位 (int64): 序號、幀編號、讀取者數量
+_SLOT_SEQ = 0
+_SLOT_FRAME_NUMBER = 1
+_SLOT_READERS = 2
+_SLOT_FIELDS = 3
+
+class SharedFrameRing:
+    def __init__(self, frame_shape, dtype=np.uint16, n_slots=4):
+        """
+        初始化 SharedFrameRing。
+
+        在 multiprocessing.shared_memory 上建立 N 個槽位的環形緩衝區。生產者每幀只複製一次到
+        空閒槽位，消費者直接讀取最新槽位的視圖。正在被讀取的槽位不會被覆寫，因此不會讀到
+        寫了一半的幀；雙方都以條件變量等待，不需要忙等。
+
+        參數:
+        frame_shape (tuple): 幀的形狀，例如 (height, width)。
+        dtype (np.dtype, optional): 幀的數據類型。預設為 np.uint16。
+        n_slots (int, optional): 槽位數量，至少為 3。預設為 4。
+        """
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.n_slots = max(3, n_slots)
+        self.condition = multiprocessing.Condition()
+        self.shm = shared_memory.SharedMemory(create=True, size=self._total_size())
+        self.is_owner = True
+        self._attach()
+        self.header[:] = 0
+        self.header[_LATEST_SLOT] = -1
+
+    def _header_size(self):
+        """
+        計算標頭大小（對齊到 64 位元組）。
+
+        回傳:
+        int: 標頭位元組數。
+        """
+        n_fields = _GLOBAL_FIELDS + self.n_slots * _SLOT_FIELDS
+        return ((n_fields * 8 + 63) // 64) * 64
+
+    def _frame_bytes(self):
+        """
+        計算單幀的位元組數（對齊到 64 位元組）。
+
+        回傳:
+        int: 單幀位元組數。
+        """
+        size = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        return ((size + 63) // 64) * 64
+
+    def _total_size(self):
+        return self._header_size() + self.n_slots * self._frame_bytes()
+
+    def _attach(self):
+        """
+        在共享記憶體上建立標頭與槽位的 numpy 視圖。
+        """
+        n_fields = _GLOBAL_FIELDS + self.n_slots * _SLOT_FIELDS
+        self.header = np.ndarray((n_fields,), dtype=np.int64, buffer=self.shm.buf)
+        self.slot_fields = self.header[_GLOBAL_FIELDS:].reshape(self.n_slots, _SLOT_FIELDS)
+        offset = self._header_size()
+        frame_bytes = self._frame_bytes()
+        self.slots = [
+            np.ndarray(self.frame_shape, dtype=self.dtype, buffer=self.shm.buf, offset=offset + i * frame_bytes)
+            for i in range(self.n_slots)
+        ]
+
+    def __getstate__(self):
+        # 傳遞給子進程時只傳送共享記憶體的名稱，子進程重新映射同一塊記憶體
+        return {
+            'name': self.shm.name,
+            'frame_shape': self.frame_shape,
+            'dtype': self.dtype.str,
+            'n_slots': self.n_slots,
+            'condition': self.condition
+        }
+
+    def __setstate__(self, state):
+        self.frame_shape = state['frame_shape']
+        self.dtype = np.dtype(state['dtype'])
+        self.n_slots = state['n_slots']
+        self.condition = state['condition']
+        self.shm = shared_memory.SharedMemory(name=state['name'])
+        self.is_owner = False
+        self._attach()
+
+    def write(self, frame, frame_number=0):
+        """
+        生產者：將一幀寫入空閒槽位並發佈為最新幀。
+
+        參數:
+        frame (np.ndarray): 要寫入的幀。
+        frame_number (int, optional): 幀編號。預設為 0。
+
+        回傳:
+        bool: 是否成功寫入。所有槽位都被佔用時回傳 False（該幀被丟棄）。
+        """
+        with self.condition:
+            if self.header[_CLOSED]:
+                return False
+            slot = self._select_write_slot()
+        if slot is None:
+            return False
+
+        # 複製在鎖外進行，所選槽位既非最新幀也沒有讀取者，消費者不會觸及
+        np.copyto(self.slots[slot], frame)
+
+        with self.condition:
+            seq = int(self.header[_LATEST_SEQ]) + 1
+            self.slot_fields[slot, _SLOT_SEQ] = seq
+            self.slot_fields[slot, _SLOT_FRAME_NUMBER] = frame_number
+            self.header[_LATEST_SLOT] = slot
+            self.header[_LATEST_SEQ] = seq
+            self.condition.notify_all()
+        return True
+
+    def _select_write_slot(self):
+        """
+        選擇一個可寫入的槽位（需在持有鎖時調用）。
+
+        回傳:
+        int 或 None: 槽位索引，沒有可用槽位時為 None。
+        """
+        latest = int(self.header[_LATEST_SLOT])
+        for i in range(1, self.n_slots + 1):
+            slot = (latest + i) % self.n_slots
+            if slot != latest and self.slot_fields[slot, _SLOT_READERS] == 0:
+                return slot
+        return None
+
+    @contextmanager
+    def read_latest(self, last_seq=0, timeout=None):
+        """
+        消費者：阻塞等待比 last_seq 更新的幀，並在 with 區塊內提供其唯讀視圖。
+
+        區塊執行期間該槽位不會被生產者覆寫，離開區塊後視圖即失效，不應再被引用。
+
+        參數:
+        last_seq (int, optional): 上一次讀取的序號。預設為 0。
+        timeout (float, optional): 等待逾時秒數，None 表示一直等待。預設為 None。
+
+        回傳:
+        tuple 或 None: (seq, frame_number, frame_view)；逾時或環形緩衝區已關閉時為 None。
+        """
+        with self.condition:
+            ready = self.condition.wait_for(
+                lambda: self.header[_CLOSED] or self.header[_LATEST_SEQ] > last_seq, timeout)
+            if not ready or self.header[_LATEST_SEQ] <= last_seq:
+                slot = None
+            else:
+                slot = int(self.header[_LATEST_SLOT])
+                self.slot_fields[slot, _SLOT_READERS] += 1
+                seq = int(self.slot_fields[slot, _SLOT_SEQ])
+                frame_number = int(self.slot_fields[slot, _SLOT_FRAME_NUMBER])
+
+        if slot is None:
+            yield None
+            return
+
+        try:
+            view = self.slots[slot].view()
+            view.flags.writeable = False
+            yield (seq, frame_number, view)
+        finally:
+            with self.condition:
+                self.slot_fields[slot, _SLOT_READERS] -= 1
+                self.condition.notify_all()
+
+    def shutdown(self):
+        """
+        標記環形緩衝區已關閉並喚醒所有等待中的消費者。
+        """
+        with self.condition:
+            self.header[_CLOSED] = 1
+            self.condition.notify_all()
+
+    def is_closed(self):
+        """
+        回傳:
+        bool: 環形緩衝區是否已關閉。
+        """
+        return bool(self.header[_CLOSED])
+
+    def close(self):
+        """
+        釋放本進程對共享記憶體的映射。
+        """
+        self.header = None
+        self.slot_fields = None
+        self.slots = []
+        self.shm.close()
+
+    def unlink(self):
+        """
+        銷毀共享記憶體（僅由建立者調用）。
+        """
+        if self.is_owner:
+            self.shm.unlink()
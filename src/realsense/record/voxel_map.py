@@ -0,0 +1,181 @@
+import time
+import numpy as np
+
+# 每個軸的體素座標以 21 位元打包成一個 int64 鍵
+KEY_BITS = 21
+KEY_OFFSET = 1 << (KEY_BITS - 1)
+KEY_MASK = (1 << KEY_BITS) - 1
+EMPTY_KEY = -1
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+def voxel_keys(points, voxel_size):
+    """
+    計算點所在體素的打包鍵。
+
+    參數:
+    points (np.ndarray): (n, 3) 點座標。
+    voxel_size (float): 體素大小（米）。
+
+    回傳:
+    np.ndarray: (n,) int64 鍵。
+    """
+    coords = np.floor(points / voxel_size).astype(np.int64) + KEY_OFFSET
+    np.clip(coords, 0, KEY_MASK, out=coords)
+    return (coords[:, 0] << (2 * KEY_BITS)) | (coords[:, 1] << KEY_BITS) | coords[:, 2]
+
+class VoxelHashMap:
+    def __init__(self, voxel_size=0.02, max_voxels=1000000):
+        """
+        初始化 VoxelHashMap。
+
+        以開放定址的體素雜湊表儲存全域地圖，每個體素保存落在其中的點的座標總和與數量，
+        輸出的點為平均位置。合併一幀只處理該幀的點 (O(幀))，不會重新合併整張地圖；
+        體素數量達到 max_voxels 後，新體素的點會被捨棄（已存在的體素仍會更新）。
+
+        參數:
+        voxel_size (float, optional): 體素大小（米）。預設為 0.02。
+        max_voxels (int, optional): 體素數量上限。預設為 1000000。
+        """
+        self.voxel_size = voxel_size
+        self.max_voxels = max(1, int(max_voxels))
+        # 雜湊表容量為 2 的冪且至少為上限的兩倍，使負載率不超過 0.5
+        self.table_bits = max(4, int(np.ceil(np.log2(self.max_voxels * 2))))
+        self.table_mask = (1 << self.table_bits) - 1
+        self.table_keys = np.full(1 << self.table_bits, EMPTY_KEY, dtype=np.int64)
+        self.table_index = np.zeros(1 << self.table_bits, dtype=np.int64)
+
+        self.sums = np.zeros((self.max_voxels, 3), dtype=np.float64)
+        self.counts = np.zeros(self.max_voxels, dtype=np.int64)
+        self.points = np.zeros((self.max_voxels, 3), dtype=np.float32)
+        self.n_voxels = 0
+        self.dropped_points = 0
+
+    def __len__(self):
+        return self.n_voxels
+
+    def voxel_keys(self, points):
+        """
+        計算點所在體素的打包鍵。
+
+        參數:
+        points (np.ndarray): (n, 3) 點座標。
+
+        回傳:
+        np.ndarray: (n,) int64 鍵。
+        """
+        return voxel_keys(points, self.voxel_size)
+
+    def lookup_or_insert(self, keys):
+        """
+        以線性探測查找鍵對應的體素索引，不存在時分配新體素。
+
+        參數:
+        keys (np.ndarray): 互不相同的 int64 鍵。
+
+        回傳:
+        np.ndarray: 每個鍵的體素索引，超出上限而無法分配的為 -1。
+        """
+        result = np.full(len(keys), -1, dtype=np.int64)
+        shift = np.uint64(64 - self.table_bits)
+        slots = ((keys.astype(np.uint64) * HASH_MULTIPLIER) >> shift).astype(np.int64)
+        pending = np.arange(len(keys))
+        while pending.size:
+            pending_keys = keys[pending]
+            pending_slots = slots[pending]
+            slot_keys = self.table_keys[pending_slots]
+
+            hit = slot_keys == pending_keys
+            result[pending[hit]] = self.table_index[pending_slots[hit]]
+
+            # 同一個空槽位只能由一個鍵佔用，其餘的鍵在下一輪看到已佔用的槽位後繼續探測
+            empty = np.flatnonzero(slot_keys == EMPTY_KEY)
+            claimed = np.zeros(len(pending), dtype=bool)
+            if empty.size:
+                _, first = np.unique(pending_slots[empty], return_index=True)
+                winners = empty[first]
+                n_new = min(len(winners), self.max_voxels - self.n_voxels)
+                if n_new < len(winners):
+                    # 已達上限：無法分配的鍵放棄
+                    claimed[winners[n_new:]] = True
+                    winners = winners[:n_new]
+                new_index = np.arange(self.n_voxels, self.n_voxels + n_new)
+                self.table_keys[pending_slots[winners]] = pending_keys[winners]
+                self.table_index[pending_slots[winners]] = new_index
+                result[pending[winners]] = new_index
+                self.n_voxels += n_new
+                claimed[winners] = True
+                if self.n_voxels >= self.max_voxels:
+                    # 不再分配新體素，仍在探測的鍵只需找出已存在的體素
+                    claimed[empty] = True
+
+            occupied = (slot_keys != EMPTY_KEY) & ~hit
+            slots[pending[occupied]] = (pending_slots[occupied] + 1) & self.table_mask
+            pending = pending[~hit & ~claimed]
+        return result
+
+    def integrate(self, points):
+        """
+        將已轉換到全域座標的點合併到地圖中，落在同一體素的點取平均。
+
+        參數:
+        points (np.ndarray): (n, 3) 點座標。
+
+        回傳:
+        np.ndarray: 本次更新的體素索引。
+        """
+        points = np.asarray(points)
+        if len(points) == 0:
+            return np.empty(0, dtype=np.int64)
+        keys = self.voxel_keys(points)
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.ravel()
+
+        # 先在幀內依體素累加，再一次寫入地圖
+        n_unique = len(unique_keys)
+        frame_sums = np.stack([np.bincount(inverse, weights=points[:, i], minlength=n_unique) for i in range(3)], axis=1)
+        frame_counts = np.bincount(inverse, minlength=n_unique)
+
+        index = self.lookup_or_insert(unique_keys)
+        valid = index >= 0
+        self.dropped_points += int(frame_counts[~valid].sum())
+        index = index[valid]
+        self.sums[index] += frame_sums[valid]
+        self.counts[index] += frame_counts[valid]
+        self.points[index] = self.sums[index] / self.counts[index, None]
+        return index
+
+    def get_points(self):
+        """
+        回傳:
+        np.ndarray: (n_voxels, 3) float32 的體素平均位置（內部數組的視圖，不需重建）。
+        """
+        return self.points[:self.n_voxels]
+
+    def get_stats(self):
+        """
+        回傳:
+        dict: 包含 'voxels'、'max_voxels' 與 'dropped_points' 的字典。
+        """
+        return {'voxels': self.n_voxels, 'max_voxels': self.max_voxels, 'dropped_points': self.dropped_points}
+
+    def clear(self):
+        """
+        清空地圖。
+        """
+        self.table_keys.fill(EMPTY_KEY)
+        self.n_voxels = 0
+        self.dropped_points = 0
+        self.sums.fill(0)
+        self.counts.fill(0)
+
+if __name__ == "__main__":
+    # 合併的耗時只與每幀的點數有關，不隨地圖大小增加
+    rng = np.random.default_rng(0)
+    voxel_map = VoxelHashMap(voxel_size=0.02, max_voxels=2000000)
+    for i in range(200):
+        offset = np.array([i * 0.05, 0.0, 0.0])
+        frame = rng.random((50000, 3)) * np.array([1.0, 1.0, 0.2]) + offset
+        start = time.perf_counter()
+        voxel_map.integrate(frame)
+        if i % 50 == 0 or i == 199:
+            print(f"frame {i:3d}: {1000.0 * (time.perf_counter() - start):6.2f} ms, {len(voxel_map)} voxels")
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+from os import makedirs
+from os.path import abspath, dirname, exists, isfile, join, normpath, relpath
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+class CheckpointManifest:
+    def __init__(self, config):
+        """
+        初始化 CheckpointManifest。
+
+        記錄每個處理單元（片段或片段配對）的輸入文件內容雜湊、相關配置值與輸出文件，
+        重新執行時輸入與配置都沒有改變且輸出仍然存在的單元可以跳過，只重新計算失效的單元。
+        上游單元的輸出是下游單元的輸入，因此重新生成的片段會使依賴它的配對失效。
+        清單保存在 path_dataset/folder_checkpoint/manifest.json，config["checkpoint"] 為 False 時不跳過任何單元。
+
+        參數:
+        config (dict): 重建系統的配置。
+        """
+        self.config = config
+        self.path_dataset = config["path_dataset"]
+        self.enabled = config.get("checkpoint", True)
+        self.path = join(self.path_dataset, config["folder_checkpoint"], MANIFEST_FILE)
+        self.units = {}
+        # 路徑 -> [大小, 修改時間, 雜湊]，大小與修改時間相同時不重新計算雜湊
+        self.hashes = {}
+        if self.enabled and isfile(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    manifest = json.load(f)
+                if manifest.get("version") == MANIFEST_VERSION:
+                    self.units = manifest["units"]
+                    self.hashes = manifest["hashes"]
+            except (ValueError, KeyError) as e:
+                print(f"Ignoring unreadable checkpoint manifest {self.path}: {e}")
+
+    def relative(self, path):
+        """
+        回傳:
+        str: 數據集內的文件以相對路徑記錄，移動數據集資料夾後清單仍然有效。
+        """
+        path = abspath(path)
+        try:
+            rel = relpath(path, abspath(self.path_dataset))
+        except ValueError:
+            return normpath(path)
+        return normpath(path) if rel.startswith("..") else rel
+
+    def file_hash(self, path):
+        """
+        計算文件內容的雜湊。
+
+        參數:
+        path (str): 文件路徑。
+
+        回傳:
+        str: SHA-1 雜湊。
+        """
+        stat = os.stat(path)
+        key = self.relative(path)
+        cached = self.hashes.get(key)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        self.hashes[key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def signature(self, inputs, config_keys):
+        """
+        回傳:
+        dict: 輸入文件雜湊與相關配置值，以 JSON 形式正規化以便與清單中的記錄比較。
+        """
+        signature = {
+            "inputs": {self.relative(path): self.file_hash(path) for path in inputs},
+            "config": {key: self.config.get(key) for key in config_keys}
+        }
+        return json.loads(json.dumps(signature))
+
+    def is_done(self, unit, inputs, config_keys, outputs):
+        """
+        檢查單元是否可以跳過。
+
+        參數:
+        unit (str): 單元名稱。
+        inputs (list): 輸入文件路徑。
+        config_keys (tuple): 影響結果的配置鍵。
+        outputs (list): 相對於 path_dataset 的輸出文件路徑。
+
+        回傳:
+        bool: 輸入與配置都沒有改變且所有輸出都存在時為 True。
+        """
+        if not self.enabled:
+            return False
+        entry = self.units.get(unit)
+        if entry is None or entry["outputs"] != list(outputs):
+            return False
+        if not all(isfile(join(self.path_dataset, output)) for output in outputs):
+            return False
+        return entry["signature"] == self.signature(inputs, config_keys)
+
+    def record(self, unit, inputs, config_keys, outputs):
+        """
+        記錄一個已完成的單元並立即保存清單，中途崩潰時已完成的單元仍然有效。
+
+        參數:
+        unit (str): 單元名稱。
+        inputs (list): 輸入文件路徑。
+        config_keys (tuple): 影響結果的配置鍵。
+        outputs (list): 相對於 path_dataset 的輸出文件路徑。
+        """
+        if not self.enabled:
+            return
+        self.units[unit] = {"signature": self.signature(inputs, config_keys), "outputs": list(outputs)}
+        self.save()
+
+    def save(self):
+        """
+        以先寫入臨時文件再替換的方式保存清單。
+        """
+        if not exists(dirname(self.path)):
+            makedirs(dirname(self.path))
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "units": self.units, "hashes": self.hashes}, f, indent=1)
+        os.replace(temp_path, self.path)
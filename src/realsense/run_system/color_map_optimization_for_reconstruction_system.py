@@ -95,8 +95,8 @@ def main(config, keys):
     # Load images
     rgbd_images = []
     for i in range(len(depth_files)):
-        depth = o3d.io.read_image(os.path.join(depth_files[i]))
-        color = o3d.io.read_image(os.path.join(color_files[i]))
+        depth = read_image(depth_files[i])
+        color = read_image(color_files[i])
         rgbd_image = o3d.geometry.RGBDImage.create_from_color_and_depth(
             color,
             depth,
@@ -15,15 +15,20 @@ import json
 from os.path import isfile, join, splitext, dirname, basename
 from warnings import warn
 from data_loader import lounge_data_loader, bedroom_data_loader, jackjack_data_loader
+from open3d_example import is_rgbd_container, open_rgbd_container
 import multiprocessing
 
-def extract_rgbd_frames(rgbd_video_file):
+def extract_rgbd_frames(rgbd_video_file, progress=None):
     """
     Extract color and aligned depth frames and intrinsic calibration from an
     RGBD video file (currently only RealSense bag files supported). Folder
     structure is:
         <directory of rgbd_video_file/<rgbd_video_file name without extension>/
             {depth/00000.jpg,color/00000.png,intrinsic.json}
+
+    Frames are extracted with non real-time playback and parallel encoding
+    (record/bag_extractor.py) when pyrealsense2 is available, otherwise with
+    Open3D's RGBDVideoReader.
     """
     frames_folder = join(dirname(rgbd_video_file),
                          basename(splitext(rgbd_video_file)[0]))
@@ -32,8 +37,14 @@ def extract_rgbd_frames(rgbd_video_file):
         warn(f"Skipping frame extraction for {rgbd_video_file} since files are"
              " present.")
     else:
-        rgbd_video = o3d.t.io.RGBDVideoReader.create(rgbd_video_file)
-        rgbd_video.save_frames(frames_folder)
+        try:
+            from bag_extractor import extract_bag
+            extract_bag(rgbd_video_file, frames_folder, progress=progress)
+        except Exception as e:
+            warn(f"Fast extraction failed for {rgbd_video_file} ({e}), "
+                 "falling back to RGBDVideoReader.")
+            rgbd_video = o3d.t.io.RGBDVideoReader.create(rgbd_video_file)
+            rgbd_video.save_frames(frames_folder)
     with open(path_intrinsic) as intr_file:
         intr = json.load(intr_file)
     depth_scale = intr["depth_scale"]
@@ -62,6 +73,11 @@ def initialize_config(config, message_queue):
     set_default_value(config, "icp_method", "color")
     set_default_value(config, "global_registration", "ransac")
     set_default_value(config, "python_multi_threading", True)
+    # candidate selection for global fragment registration; a top-k of 0
+    # registers every fragment pair.
+    set_default_value(config, "candidate_top_k", 10)
+    set_default_value(config, "candidate_max_distance", 5.0)
+    set_default_value(config, "candidate_min_overlap", 0.1)
 
     # `slac` and `slac_integrate` related parameters.
     # `voxel_size` and `depth_min` parameters from previous section,
@@ -90,6 +106,12 @@ def initialize_config(config, message_queue):
     set_default_value(config, "template_fragment_pointcloud",
                       "fragments/fragment_%03d.ply")
     set_default_value(config, "folder_scene", "scene/")
+    set_default_value(config, "folder_feature_cache", "feature_cache/")
+    set_default_value(config, "folder_checkpoint", "checkpoint/")
+    # skip fragments and fragment pairs whose inputs are unchanged on rerun
+    set_default_value(config, "checkpoint", True)
+    set_default_value(config, "rgbd_cache_mb", 256)
+    set_default_value(config, "rgbd_prefetch_frames", 4)
     set_default_value(config, "template_global_posegraph",
                       "scene/global_registration.json")
     set_default_value(config, "template_global_posegraph_optimized",
@@ -106,12 +128,14 @@ def initialize_config(config, message_queue):
     if config["path_dataset"].endswith(".bag"):
         assert os.path.isfile(config["path_dataset"]), (
             f"File {config['path_dataset']} not found.")
-        if message_queue is not None:
-            message_queue.put("Extracting frames from RGBD video file")
-        else:
-            print("Extracting frames from RGBD video file")
+        progress = message_queue.put if message_queue is not None else print
+        progress("Extracting frames from RGBD video file")
         config["path_dataset"], config["path_intrinsic"], config[
-            "depth_scale"] = extract_rgbd_frames(config["path_dataset"])
+            "depth_scale"] = extract_rgbd_frames(config["path_dataset"], progress)
+
+    # RGBD chunk containers carry their own intrinsics.
+    if not config.get("path_intrinsic") and is_rgbd_container(config["path_dataset"]):
+        config["path_intrinsic"] = open_rgbd_container(config["path_dataset"]).path_intrinsic
 
 
 def dataset_loader(dataset_name):
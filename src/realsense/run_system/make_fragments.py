@@ -1,19 +1,32 @@
 import math
 import multiprocessing
 import os
+import queue
+from os.path import normpath
 import numpy as np
 import open3d as o3d
 from open3d_example import *
 from optimize_posegraph import optimize_posegraph_for_fragment
+from checkpoint import CheckpointManifest
+from rgbd_cache import RGBDImageCache, merge_cache_counters, format_cache_counters
+from rgbd_container import CONTAINER_FOLDER, HEADER_FILE, INDEX_FILE
+
+# configuration that changes the fragment pose graphs and point clouds
+FRAGMENT_CONFIG_KEYS = ("n_frames_per_fragment", "n_keyframes_per_n_frame", "depth_scale", "depth_max",
+                        "depth_diff_max", "preference_loop_closure_odometry", "tsdf_cubic_size")
 
 # check opencv python package
 with_opencv = initialize_opencv()
 if with_opencv:
     from opencv_pose_estimation import pose_estimation
 
-def register_one_rgbd_pair(s, t, color_files, depth_files, intrinsic, with_opencv, config):
-    source_rgbd_image = read_rgbd_image(color_files[s], depth_files[s], True, config)
-    target_rgbd_image = read_rgbd_image(color_files[t], depth_files[t], True, config)
+def register_one_rgbd_pair(s, t, color_files, depth_files, intrinsic, with_opencv, config, rgbd_cache=None):
+    if rgbd_cache is not None:
+        source_rgbd_image = rgbd_cache.get(s)
+        target_rgbd_image = rgbd_cache.get(t)
+    else:
+        source_rgbd_image = read_rgbd_image(color_files[s], depth_files[s], True, config)
+        target_rgbd_image = read_rgbd_image(color_files[t], depth_files[t], True, config)
     option = o3d.pipelines.odometry.OdometryOption()
     option.depth_diff_max = config["depth_diff_max"]
     if abs(s - t) != 1:
@@ -32,28 +45,59 @@ def register_one_rgbd_pair(s, t, color_files, depth_files, intrinsic, with_openc
             o3d.pipelines.odometry.RGBDOdometryJacobianFromHybridTerm(), option)
         return [success, trans, info]
 
-def make_posegraph_for_fragment(path_dataset, sid, eid, color_files, depth_files, fragment_id, n_fragments, intrinsic, with_opencv, config, stop_event, message_queue):
-    o3d.utility.set_verbosity_level(o3d.utility.VerbosityLevel.Error)
+def rgbd_pairs_for_fragment(sid, eid, config):
+    # Odometry pairs (s, s + 1) and keyframe loop closures, in pose graph edge order.
+    pairs = []
+    for s in range(sid, eid):
+        for t in range(s + 1, eid):
+            if t == s + 1:
+                pairs.append((s, t, False))
+            if s % config['n_keyframes_per_n_frame'] == 0 and t % config['n_keyframes_per_n_frame'] == 0:
+                pairs.append((s, t, True))
+    return pairs
+
+def rgbd_pair_blocks(pairs, config):
+    # Runs of consecutive odometry pairs together with the loop closures that
+    # start at their keyframe, so one block reads a contiguous range of frames
+    # and the keyframes it shares.
+    blocks = {}
+    for i, (s, t, _) in enumerate(pairs):
+        blocks.setdefault(s // config['n_keyframes_per_n_frame'], []).append((i, s, t))
+    return list(blocks.values())
+
+def make_posegraph_from_pairs(sid, pairs, results):
     pose_graph = o3d.pipelines.registration.PoseGraph()
     trans_odometry = np.identity(4)
     pose_graph.nodes.append(o3d.pipelines.registration.PoseGraphNode(trans_odometry))
-    for s in range(sid, eid):
-        for t in range(s + 1, eid):
+    for (s, t, loop_closure), [success, trans, info] in zip(pairs, results):
+        if not loop_closure:
+            trans_odometry = np.dot(trans, trans_odometry)
+            trans_odometry_inv = np.linalg.inv(trans_odometry)
+            pose_graph.nodes.append(o3d.pipelines.registration.PoseGraphNode(trans_odometry_inv))
+            pose_graph.edges.append(o3d.pipelines.registration.PoseGraphEdge(s - sid, t - sid, trans, info, uncertain=False))
+        elif success:
+            pose_graph.edges.append(o3d.pipelines.registration.PoseGraphEdge(s - sid, t - sid, trans, info, uncertain=True))
+    return pose_graph
+
+def make_posegraph_for_fragment(path_dataset, sid, eid, color_files, depth_files, fragment_id, n_fragments, intrinsic, with_opencv, config, stop_event, message_queue):
+    o3d.utility.set_verbosity_level(o3d.utility.VerbosityLevel.Error)
+    pairs = rgbd_pairs_for_fragment(sid, eid, config)
+    # Consecutive pairs and keyframe loop closures read the same frames
+    # repeatedly, so decoded images are cached and decoded ahead of use.
+    rgbd_cache = RGBDImageCache(color_files, depth_files, config)
+    rgbd_cache.prefetch([i for s, t, _ in pairs for i in (s, t)])
+    results = []
+    try:
+        for s, t, _ in pairs:
             if stop_event.is_set():
                 message_queue.put(f"Stopping posegraph creation for fragment {fragment_id}")
                 return
-            if t == s + 1:
-                message_queue.put(f"Fragment {fragment_id:03d} / {n_fragments - 1:03d} :: RGBD matching between frame : {s} and {t}")
-                [success, trans, info] = register_one_rgbd_pair(s, t, color_files, depth_files, intrinsic, with_opencv, config)
-                trans_odometry = np.dot(trans, trans_odometry)
-                trans_odometry_inv = np.linalg.inv(trans_odometry)
-                pose_graph.nodes.append(o3d.pipelines.registration.PoseGraphNode(trans_odometry_inv))
-                pose_graph.edges.append(o3d.pipelines.registration.PoseGraphEdge(s - sid, t - sid, trans, info, uncertain=False))
-            if s % config['n_keyframes_per_n_frame'] == 0 and t % config['n_keyframes_per_n_frame'] == 0:
-                message_queue.put(f"Fragment {fragment_id:03d} / {n_fragments - 1:03d} :: RGBD matching between frame : {s} and {t}")
-                [success, trans, info] = register_one_rgbd_pair(s, t, color_files, depth_files, intrinsic, with_opencv, config)
-                if success:
-                    pose_graph.edges.append(o3d.pipelines.registration.PoseGraphEdge(s - sid, t - sid, trans, info, uncertain=True))
+            message_queue.put(f"Fragment {fragment_id:03d} / {n_fragments - 1:03d} :: RGBD matching between frame : {s} and {t}")
+            results.append(register_one_rgbd_pair(s, t, color_files, depth_files, intrinsic, with_opencv, config, rgbd_cache))
+    finally:
+        rgbd_cache.close()
+    message_queue.put(f"Fragment {fragment_id:03d} / {n_fragments - 1:03d} :: {rgbd_cache.summary()}")
+    pose_graph = make_posegraph_from_pairs(sid, pairs, results)
     o3d.io.write_pose_graph(join(path_dataset, config["template_fragment_posegraph"] % fragment_id), pose_graph)
 
 def integrate_rgb_frames_for_fragment(color_files, depth_files, fragment_id, n_fragments, pose_graph_name, intrinsic, config, stop_event, message_queue):
@@ -77,6 +121,8 @@ def integrate_rgb_frames_for_fragment(color_files, depth_files, fragment_id, n_f
 
 def make_pointcloud_for_fragment(path_dataset, color_files, depth_files, fragment_id, n_fragments, intrinsic, config, stop_event, message_queue):
     mesh = integrate_rgb_frames_for_fragment(color_files, depth_files, fragment_id, n_fragments, join(path_dataset, config["template_fragment_posegraph_optimized"] % fragment_id), intrinsic, config, stop_event, message_queue)
+    if mesh is None:
+        return
     pcd = o3d.geometry.PointCloud()
     pcd.points = mesh.vertices
     pcd.colors = mesh.vertex_colors
@@ -87,36 +133,197 @@ def process_single_fragment(fragment_id, color_files, depth_files, n_files, n_fr
     if stop_event.is_set():
         message_queue.put(f"Skipping fragment {fragment_id} as stop event is set")
         return
-    if config["path_intrinsic"]:
-        intrinsic = o3d.io.read_pinhole_camera_intrinsic(config["path_intrinsic"])
-    else:
-        intrinsic = o3d.camera.PinholeCameraIntrinsic(o3d.camera.PinholeCameraIntrinsicParameters.PrimeSenseDefault)
+    intrinsic = read_fragment_intrinsic(config)
     sid = fragment_id * config['n_frames_per_fragment']
     eid = min(sid + config['n_frames_per_fragment'], n_files)
 
     make_posegraph_for_fragment(config["path_dataset"], sid, eid, color_files, depth_files, fragment_id, n_fragments, intrinsic, with_opencv, config, stop_event, message_queue)
     if stop_event.is_set():
         return
+    return finish_single_fragment(fragment_id, color_files, depth_files, n_fragments, intrinsic, config, stop_event, message_queue)
+
+def read_fragment_intrinsic(config):
+    if config["path_intrinsic"]:
+        return o3d.io.read_pinhole_camera_intrinsic(config["path_intrinsic"])
+    return o3d.camera.PinholeCameraIntrinsic(o3d.camera.PinholeCameraIntrinsicParameters.PrimeSenseDefault)
+
+def finish_single_fragment(fragment_id, color_files, depth_files, n_fragments, intrinsic, config, stop_event, message_queue):
     optimize_posegraph_for_fragment(config["path_dataset"], fragment_id, config)
     if stop_event.is_set():
         return
     make_pointcloud_for_fragment(config["path_dataset"], color_files, depth_files, fragment_id, n_fragments, intrinsic, config, stop_event, message_queue)
+    return not stop_event.is_set()
+
+def process_fragment_job(args):
+    return (args[0], process_single_fragment(*args))
+
+# State of a shared fragment pool worker, set once by init_fragment_worker so
+# that the frame lists are not pickled into every block job.
+fragment_worker = {}
+
+def init_fragment_worker(color_files, depth_files, n_fragments, config, stop_event, message_queue):
+    o3d.utility.set_verbosity_level(o3d.utility.VerbosityLevel.Error)
+    fragment_worker.update(color_files=color_files, depth_files=depth_files, n_fragments=n_fragments,
+                           config=config, stop_event=stop_event, message_queue=message_queue,
+                           intrinsic=read_fragment_intrinsic(config),
+                           rgbd_cache=RGBDImageCache(color_files, depth_files, config))
+
+def register_rgbd_block_job(args):
+    fragment_id, block = args
+    w = fragment_worker
+    rgbd_cache = w["rgbd_cache"]
+    # The worker's cache outlives the block, so frames shared with the
+    # blocks it handled before are not decoded again.
+    rgbd_cache.prefetch([i for _, s, t in block for i in (s, t)])
+    results = []
+    try:
+        for i, s, t in block:
+            if w["stop_event"].is_set():
+                return (fragment_id, None, None)
+            w["message_queue"].put(f"Fragment {fragment_id:03d} / {w['n_fragments'] - 1:03d} :: RGBD matching between frame : {s} and {t}")
+            results.append((i, register_one_rgbd_pair(s, t, w["color_files"], w["depth_files"], w["intrinsic"], with_opencv, w["config"], rgbd_cache)))
+    finally:
+        rgbd_cache.stop_prefetch()
+    return (fragment_id, results, (os.getpid(), rgbd_cache.get_counters()))
+
+def finish_fragment_job(fragment_id):
+    w = fragment_worker
+    if w["stop_event"].is_set():
+        return (fragment_id, None)
+    return (fragment_id, finish_single_fragment(fragment_id, w["color_files"], w["depth_files"], w["n_fragments"], w["intrinsic"],
+                                                w["config"], w["stop_event"], w["message_queue"]))
+
+def run_fragment_pool(pending, units, color_files, depth_files, n_files, n_fragments, config, stop_event, message_queue, manifest):
+    # The odometry and loop-closure pairs of every pending fragment are split
+    # into small blocks (see rgbd_pair_blocks) pulled one at a time by the
+    # workers of a single pool, so all cores stay busy until the last block
+    # rather than the last fragment, while each worker's RGBD cache and
+    # prefetch thread still see contiguous frames. A fragment's pose graph is
+    # assembled here as soon as its pairs are done, and its optimization and
+    # integration run in the same pool.
+    pairs = {}
+    for fragment_id in pending:
+        sid = fragment_id * config['n_frames_per_fragment']
+        eid = min(sid + config['n_frames_per_fragment'], n_files)
+        pairs[fragment_id] = rgbd_pairs_for_fragment(sid, eid, config)
+    jobs = [(fragment_id, block) for fragment_id in pending for block in rgbd_pair_blocks(pairs[fragment_id], config)]
+    n_pairs = sum(len(pairs[fragment_id]) for fragment_id in pending)
+    results = {fragment_id: [None] * len(pairs[fragment_id]) for fragment_id in pending}
+    remaining = {fragment_id: len(pairs[fragment_id]) for fragment_id in pending}
+    cache_counters = {}
+
+    max_workers = min(max(1, multiprocessing.cpu_count() - 1), max(len(jobs), len(pending)))
+    os.environ['OMP_NUM_THREADS'] = '1'
+    mp_context = multiprocessing.get_context('spawn')
+    with mp_context.Pool(processes=max_workers, initializer=init_fragment_worker,
+                         initargs=(color_files, depth_files, n_fragments, config, stop_event, message_queue)) as pool:
+        # Results of finish_fragment_job (or its exception), put by the pool's
+        # result thread as each fragment completes.
+        finished = queue.Queue()
+        n_finishing = 0
+
+        def pose_graph_done(fragment_id):
+            nonlocal n_finishing
+            sid = fragment_id * config['n_frames_per_fragment']
+            pose_graph = make_posegraph_from_pairs(sid, pairs[fragment_id], results[fragment_id])
+            o3d.io.write_pose_graph(join(config["path_dataset"], config["template_fragment_posegraph"] % fragment_id), pose_graph)
+            pool.apply_async(finish_fragment_job, (fragment_id,), callback=finished.put, error_callback=finished.put)
+            n_finishing += 1
+
+        def record_finished(block):
+            # Record each fragment as soon as it is done, so a crash or a stop keeps the finished ones.
+            nonlocal n_finishing
+            while n_finishing > 0:
+                try:
+                    result = finished.get(block=block)
+                except queue.Empty:
+                    return
+                n_finishing -= 1
+                if isinstance(result, BaseException):
+                    raise result
+                fragment_id, done = result
+                if done:
+                    manifest.record(*units[fragment_id])
+
+        for fragment_id in pending:
+            if remaining[fragment_id] == 0:
+                pose_graph_done(fragment_id)
+        for fragment_id, block_results, counters in pool.imap_unordered(register_rgbd_block_job, jobs):
+            if block_results is None:
+                continue
+            for i, result in block_results:
+                results[fragment_id][i] = result
+            cache_counters[counters[0]] = counters[1]
+            remaining[fragment_id] -= len(block_results)
+            if remaining[fragment_id] == 0:
+                pose_graph_done(fragment_id)
+            record_finished(block=False)
+        if not stop_event.is_set():
+            message_queue.put(f"{n_pairs} RGBD pairs in {len(jobs)} blocks on {max_workers} workers :: {format_cache_counters(merge_cache_counters(cache_counters.values()))}")
+        # Fragments being finished when a stop arrives return without being recorded.
+        record_finished(block=True)
+        if stop_event.is_set():
+            message_queue.put("Stopping fragment creation")
+
+def frame_input_files(files):
+    # Frames of an RGBD container are covered by its header and index, so
+    # appending frames invalidates every fragment of that container.
+    paths = []
+    for file in files:
+        if isinstance(file, ContainerFrame):
+            path_container = join(file.path_dataset, CONTAINER_FOLDER)
+            paths += [join(path_container, HEADER_FILE), join(path_container, INDEX_FILE)]
+        else:
+            paths.append(file)
+    return list(dict.fromkeys(paths))
+
+def fragment_unit(fragment_id, color_files, depth_files, n_files, config):
+    sid = fragment_id * config['n_frames_per_fragment']
+    eid = min(sid + config['n_frames_per_fragment'], n_files)
+    inputs = frame_input_files(color_files[sid:eid] + depth_files[sid:eid])
+    if config["path_intrinsic"]:
+        inputs.append(config["path_intrinsic"])
+    outputs = [config["template_fragment_posegraph"] % fragment_id,
+               config["template_fragment_posegraph_optimized"] % fragment_id,
+               config["template_fragment_pointcloud"] % fragment_id]
+    return ("fragment_%03d" % fragment_id, inputs, FRAGMENT_CONFIG_KEYS, outputs)
+
+def remove_stale_fragments(path_fragment, units, config):
+    # Fragments beyond the current count would otherwise be registered.
+    expected = set(normpath(join(config["path_dataset"], output)) for unit in units for output in unit[3])
+    for name in listdir(path_fragment):
+        path = normpath(join(path_fragment, name))
+        if isfile(path) and path not in expected:
+            os.remove(path)
 
 def run(config, stop_event, message_queue):
     message_queue.put("making fragments from RGBD sequence.")
-    make_clean_folder(join(config["path_dataset"], config["folder_fragment"]))
+    path_fragment = join(config["path_dataset"], config["folder_fragment"])
+    manifest = CheckpointManifest(config)
+    if not manifest.enabled:
+        make_clean_folder(path_fragment)
+    elif not exists(path_fragment):
+        makedirs(path_fragment)
 
     [color_files, depth_files] = get_rgbd_file_lists(config["path_dataset"])
     n_files = len(color_files)
     n_fragments = int(math.ceil(float(n_files) / config['n_frames_per_fragment']))
 
+    # Only fragments whose frames, intrinsic or configuration changed are rebuilt.
+    units = [fragment_unit(fragment_id, color_files, depth_files, n_files, config) for fragment_id in range(n_fragments)]
+    if manifest.enabled:
+        remove_stale_fragments(path_fragment, units, config)
+    pending = [fragment_id for fragment_id in range(n_fragments) if not manifest.is_done(*units[fragment_id])]
+    if len(pending) < n_fragments:
+        message_queue.put(f"checkpoint: {n_fragments - len(pending)} of {n_fragments} fragments are up to date, making {len(pending)}")
+
+    if not pending:
+        return
     if config["python_multi_threading"] is True:
-        max_workers = min(max(1, multiprocessing.cpu_count() - 1), n_fragments)
-        os.environ['OMP_NUM_THREADS'] = '1'
-        mp_context = multiprocessing.get_context('spawn')
-        with mp_context.Pool(processes=max_workers) as pool:
-            args = [(fragment_id, color_files, depth_files, n_files, n_fragments, config, stop_event, message_queue) for fragment_id in range(n_fragments)]
-            pool.starmap(process_single_fragment, args)
+        run_fragment_pool(pending, units, color_files, depth_files, n_files, n_fragments, config, stop_event, message_queue, manifest)
     else:
-        for fragment_id in range(n_fragments):
-            process_single_fragment(fragment_id, color_files, depth_files, n_files, n_fragments, config, stop_event, message_queue)
+        args = [(fragment_id, color_files, depth_files, n_files, n_fragments, config, stop_event, message_queue) for fragment_id in pending]
+        for arg in args:
+            fragment_id, done = process_fragment_job(arg)
+            if done:
+                manifest.record(*units[fragment_id])
@@ -18,6 +18,11 @@ from warnings import warn
 import json
 import open3d as o3d
 import copy
+from functools import lru_cache
+
+sys.path.append(join(dirname(os.path.abspath(__file__)), "..", "record"))
+from rgbd_container import RGBDChunkReader, is_rgbd_container
+from depth_codec import is_depth_file, read_depth_file
 
 if (sys.version_info > (3, 0)):
     pyver = 3
@@ -188,9 +193,63 @@ def add_if_exists(path_dataset, folder_names):
         f"None of the folders {folder_names} found in {path_dataset}")
 
 
+class ContainerFrame:
+    """
+    Reference to one frame of an RGBD chunk container. It is used in place of
+    a file name in the lists returned by get_rgbd_file_lists, and is cheap to
+    pickle into worker processes.
+    """
+
+    def __init__(self, path_dataset, index, kind):
+        self.path_dataset = path_dataset
+        self.index = index
+        self.kind = kind
+
+    def __repr__(self):
+        return "%s[%d:%s]" % (self.path_dataset, self.index, self.kind)
+
+
+@lru_cache(maxsize=4)
+def open_rgbd_container(path_dataset):
+    # One memory-mapped reader per dataset and per process.
+    return RGBDChunkReader(path_dataset)
+
+
+def read_image_array(file):
+    reader = open_rgbd_container(file.path_dataset)
+    if file.kind == "depth":
+        return reader.read_depth(file.index)
+    # The container returns the recorded array, while a per-file color image is
+    # written by cv2.imwrite (BGR) and read back by o3d.io.read_image (RGB).
+    # Reverse the channels so both formats give Open3D the same colors.
+    return np.ascontiguousarray(reader.read_color(file.index)[..., ::-1])
+
+
+def is_encoded_depth(file):
+    # Depth written with the rvl/zstd codecs instead of PNG.
+    return isinstance(file, str) and is_depth_file(file) and \
+            not file.endswith(".png")
+
+
+def read_image(file):
+    if isinstance(file, ContainerFrame):
+        return o3d.geometry.Image(read_image_array(file))
+    if is_encoded_depth(file):
+        return o3d.geometry.Image(read_depth_file(file))
+    return o3d.io.read_image(file)
+
+
+def read_t_image(file):
+    if isinstance(file, ContainerFrame):
+        return o3d.t.geometry.Image(o3d.core.Tensor(read_image_array(file)))
+    if is_encoded_depth(file):
+        return o3d.t.geometry.Image(o3d.core.Tensor(read_depth_file(file)))
+    return o3d.t.io.read_image(file)
+
+
 def read_rgbd_image(color_file, depth_file, convert_rgb_to_intensity, config):
-    color = o3d.io.read_image(color_file)
-    depth = o3d.io.read_image(depth_file)
+    color = read_image(color_file)
+    depth = read_image(depth_file)
     rgbd_image = o3d.geometry.RGBDImage.create_from_color_and_depth(
         color,
         depth,
@@ -207,10 +266,15 @@ def get_rgbd_folders(path_dataset):
 
 
 def get_rgbd_file_lists(path_dataset):
+    if is_rgbd_container(path_dataset):
+        n_frames = len(open_rgbd_container(path_dataset))
+        color_files = [ContainerFrame(path_dataset, i, "color") for i in range(n_frames)]
+        depth_files = [ContainerFrame(path_dataset, i, "depth") for i in range(n_frames)]
+        return color_files, depth_files
     path_color, path_depth = get_rgbd_folders(path_dataset)
     color_files = get_file_list(path_color, ".jpg") + \
             get_file_list(path_color, ".png")
-    depth_files = get_file_list(path_depth, ".png")
+    depth_files = [f for f in get_file_list(path_depth) if is_depth_file(f)]
     return color_files, depth_files
 
 
@@ -225,6 +289,8 @@ def make_clean_folder(path_folder):
 def check_folder_structure(path_dataset):
     if isfile(path_dataset) and path_dataset.endswith(".bag"):
         return
+    if is_rgbd_container(path_dataset):
+        return
     path_color, path_depth = get_rgbd_folders(path_dataset)
     assert exists(path_depth), \
             "Path %s is not exist!" % path_depth
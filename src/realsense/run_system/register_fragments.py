@@ -7,9 +7,13 @@
 
 # examples/python/reconstruction_system/register_fragments.py
 
+import hashlib
 import multiprocessing
 import os
 import sys
+from functools import lru_cache
+from os import makedirs
+from os.path import basename, exists, splitext
 
 import numpy as np
 import open3d as o3d
@@ -18,6 +22,7 @@ from open3d_example import join, get_file_list, make_clean_folder, draw_registra
 
 from optimize_posegraph import optimize_posegraph_for_scene
 from refine_registration import multiscale_icp
+from checkpoint import CheckpointManifest
 
 
 def preprocess_point_cloud(pcd, config):
@@ -33,6 +38,172 @@ def preprocess_point_cloud(pcd, config):
     return (pcd_down, pcd_fpfh)
 
 
+# configuration that changes the result of registering a fragment pair
+PAIR_CONFIG_KEYS = ("voxel_size", "global_registration", "icp_method")
+
+# Bump when preprocess_point_cloud changes so that old cache entries are ignored.
+FEATURE_CACHE_VERSION = 2
+# fpfh is written last and marks a complete entry; colors are needed by the
+# colored ICP that refines odometry pairs.
+FEATURE_ARRAYS = ("points", "normals", "colors", "fpfh")
+
+
+def fragment_feature_key(ply_file_name, config):
+    # Features depend only on the fragment contents and the voxel size.
+    digest = hashlib.sha1(b"%d:%.6f:" % (FEATURE_CACHE_VERSION, config["voxel_size"]))
+    with open(ply_file_name, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return "%s_%s" % (splitext(basename(ply_file_name))[0], digest.hexdigest()[:16])
+
+
+def cache_fragment_features(ply_file_name, config, stop_event, message_queue):
+    path_cache = join(config["path_dataset"], config["folder_feature_cache"])
+    prefix = join(path_cache, fragment_feature_key(ply_file_name, config))
+    # The fpfh array is renamed into place last, so it marks a complete entry.
+    if exists("%s_fpfh.npy" % prefix):
+        message_queue.put(f"using cached features of {ply_file_name}")
+        return prefix
+    if stop_event.is_set():
+        return prefix
+
+    message_queue.put(f"computing features of {ply_file_name} ...")
+    pcd = o3d.io.read_point_cloud(ply_file_name)
+    (pcd_down, pcd_fpfh) = preprocess_point_cloud(pcd, config)
+    arrays = {
+        "points": np.asarray(pcd_down.points),
+        "normals": np.asarray(pcd_down.normals),
+        "colors": np.asarray(pcd_down.colors),
+        "fpfh": np.asarray(pcd_fpfh.data)
+    }
+    for name in FEATURE_ARRAYS:
+        temp_file = "%s_%s.%d.npy" % (prefix, name, os.getpid())
+        np.save(temp_file, arrays[name])
+        os.replace(temp_file, "%s_%s.npy" % (prefix, name))
+    return prefix
+
+
+def make_feature_cache(ply_file_names, config, stop_event, message_queue):
+    # Downsample and compute FPFH once per fragment instead of once per pair.
+    path_cache = join(config["path_dataset"], config["folder_feature_cache"])
+    if not exists(path_cache):
+        makedirs(path_cache)
+    args = [(ply_file_name, config, stop_event, message_queue)
+            for ply_file_name in ply_file_names]
+    if config["python_multi_threading"] is True and len(args) > 1:
+        os.environ['OMP_NUM_THREADS'] = '1'
+        max_workers = max(1, min(multiprocessing.cpu_count() - 1, len(args)))
+        mp_context = multiprocessing.get_context('spawn')
+        with mp_context.Pool(processes=max_workers) as pool:
+            return pool.starmap(cache_fragment_features, args)
+    return [cache_fragment_features(*arg) for arg in args]
+
+
+def load_feature_arrays(prefix):
+    # Memory-mapped (copy-on-write, Open3D needs writable arrays) so that pair
+    # workers share the page cache.
+    return {
+        name: np.load("%s_%s.npy" % (prefix, name), mmap_mode="c")
+        for name in FEATURE_ARRAYS
+    }
+
+
+@lru_cache(maxsize=4)
+def load_fragment_features(prefix):
+    # Pairs are handed out in order of the source fragment, which stays
+    # cached here.
+    arrays = load_feature_arrays(prefix)
+    pcd_down = o3d.geometry.PointCloud()
+    pcd_down.points = o3d.utility.Vector3dVector(arrays["points"])
+    pcd_down.normals = o3d.utility.Vector3dVector(arrays["normals"])
+    if len(arrays["colors"]) > 0:
+        pcd_down.colors = o3d.utility.Vector3dVector(arrays["colors"])
+    pcd_fpfh = o3d.pipelines.registration.Feature()
+    pcd_fpfh.data = arrays["fpfh"]
+    return (pcd_down, pcd_fpfh)
+
+
+def chain_fragment_poses(n_fragments, config):
+    # Place every fragment in the frame of the first one by chaining the
+    # odometry between consecutive fragments, as update_posegraph_for_scene
+    # does with the refined transformations.
+    poses = [np.identity(4)]
+    for s in range(n_fragments - 1):
+        pose_graph_frag = o3d.io.read_pose_graph(
+            join(config["path_dataset"],
+                 config["template_fragment_posegraph_optimized"] % s))
+        poses.append(np.dot(poses[-1], pose_graph_frag.nodes[-1].pose))
+    return poses
+
+
+def fragment_summary(arrays, pose):
+    points = np.asarray(arrays["points"])
+    points = np.dot(points, pose[:3, :3].T) + pose[:3, 3]
+    return (points.min(axis=0), points.max(axis=0), points.mean(axis=0))
+
+
+def box_overlap(min_s, max_s, min_t, max_t, voxel_size):
+    # Intersection volume relative to the smaller box; flat fragments are
+    # given a thickness of one voxel.
+    extent_s = np.maximum(max_s - min_s, voxel_size)
+    extent_t = np.maximum(max_t - min_t, voxel_size)
+    intersection = np.minimum(min_s + extent_s, min_t + extent_t) - \
+            np.maximum(min_s, min_t)
+    if np.any(intersection <= 0):
+        return 0.0
+    return float(np.prod(intersection) /
+                 min(np.prod(extent_s), np.prod(extent_t)))
+
+
+def select_candidate_pairs(feature_files, config, message_queue):
+    # Keep all consecutive pairs plus, for every fragment, the top-k loop
+    # closure candidates ranked by chained pose proximity and bounding box
+    # overlap. A mean FPFH similarity is not used: the averaged histograms of
+    # different fragments are nearly identical and do not separate pairs.
+    n_files = len(feature_files)
+    all_pairs = [(s, t) for s in range(n_files) for t in range(s + 1, n_files)]
+    top_k = config["candidate_top_k"]
+    if top_k <= 0 or n_files < 3:
+        return all_pairs
+
+    poses = chain_fragment_poses(n_files, config)
+    summaries = [
+        fragment_summary(load_feature_arrays(feature_files[s]), poses[s])
+        for s in range(n_files)
+    ]
+    max_distance = config["candidate_max_distance"]
+    scores = {}
+    n_far = 0
+    n_disjoint = 0
+    for (s, t) in all_pairs:
+        if t == s + 1:
+            continue
+        (min_s, max_s, center_s) = summaries[s]
+        (min_t, max_t, center_t) = summaries[t]
+        distance = np.linalg.norm(center_s - center_t)
+        if distance > max_distance:
+            n_far += 1
+            continue
+        overlap = box_overlap(min_s, max_s, min_t, max_t, config["voxel_size"])
+        if overlap < config["candidate_min_overlap"]:
+            n_disjoint += 1
+            continue
+        scores[(s, t)] = overlap + 1.0 - distance / max_distance
+
+    candidates = set((s, s + 1) for s in range(n_files - 1))
+    for s in range(n_files):
+        ranked = sorted((pair for pair in scores if s in pair),
+                        key=lambda pair: scores[pair], reverse=True)
+        candidates.update(ranked[:top_k])
+    n_ranked_out = len(scores) - (len(candidates) - (n_files - 1))
+    message_queue.put(
+        "candidate selection: registering %d of %d fragment pairs, skipped %d "
+        "(distance %d, overlap %d, top-k %d)"
+        % (len(candidates), len(all_pairs), len(all_pairs) - len(candidates),
+           n_far, n_disjoint, n_ranked_out))
+    return sorted(candidates)
+
+
 def register_point_cloud_fpfh(source, target, source_fpfh, target_fpfh, config):
     o3d.utility.set_verbosity_level(o3d.utility.VerbosityLevel.Debug)
     distance_threshold = config["voxel_size"] * 1.4
@@ -119,17 +290,14 @@ def update_posegraph_for_scene(s, t, transformation, information, odometry,
     return (odometry, pose_graph)
 
 
-def register_point_cloud_pair(ply_file_names, s, t, config, stop_event, message_queue):
+def register_point_cloud_pair(feature_files, s, t, config, stop_event, message_queue):
     if stop_event.is_set():
         message_queue.put(f"Stopping registration of point cloud pair {s} and {t}")
         return (False, np.identity(4), np.identity(6))
 
-    message_queue.put(f"reading {ply_file_names[s]} ...")
-    source = o3d.io.read_point_cloud(ply_file_names[s])
-    message_queue.put(f"reading {ply_file_names[t]} ...")
-    target = o3d.io.read_point_cloud(ply_file_names[t])
-    (source_down, source_fpfh) = preprocess_point_cloud(source, config)
-    (target_down, target_fpfh) = preprocess_point_cloud(target, config)
+    message_queue.put(f"registering fragments {s} and {t} ...")
+    (source_down, source_fpfh) = load_fragment_features(feature_files[s])
+    (target_down, target_fpfh) = load_fragment_features(feature_files[t])
     (success, transformation, information) = \
             compute_initial_registration(
             s, t, source_down, target_down,
@@ -142,6 +310,34 @@ def register_point_cloud_pair(ply_file_names, s, t, config, stop_event, message_
     return (True, transformation, information)
 
 
+def register_pair_job(args):
+    return (args[1], args[2], register_point_cloud_pair(*args))
+
+
+def pair_unit(ply_file_names, s, t, config):
+    inputs = [ply_file_names[s], ply_file_names[t]]
+    if t == s + 1:  # odometry case starts from the fragment pose graph
+        inputs.append(join(config["path_dataset"],
+                           config["template_fragment_posegraph_optimized"] % s))
+    outputs = [join(config["folder_checkpoint"], "pairs",
+                    "pair_%03d_%03d.npz" % (s, t))]
+    return ("pair_%03d_%03d" % (s, t), inputs, PAIR_CONFIG_KEYS, outputs)
+
+
+def load_pair_result(unit, config):
+    data = np.load(join(config["path_dataset"], unit[3][0]))
+    return (bool(data["success"]), data["transformation"], data["information"])
+
+
+def save_pair_result(manifest, unit, result, config):
+    path_result = join(config["path_dataset"], unit[3][0])
+    if not exists(os.path.dirname(path_result)):
+        makedirs(os.path.dirname(path_result))
+    np.savez(path_result, success=result[0], transformation=result[1],
+             information=result[2])
+    manifest.record(*unit)
+
+
 class matching_result:
     def __init__(self, s, t):
         self.s = s
@@ -156,35 +352,58 @@ def make_posegraph_for_scene(ply_file_names, config, stop_event, message_queue):
     odometry = np.identity(4)
     pose_graph.nodes.append(o3d.pipelines.registration.PoseGraphNode(odometry))
 
+    feature_files = make_feature_cache(ply_file_names, config, stop_event, message_queue)
+    if stop_event.is_set():
+        message_queue.put("Stopping posegraph creation for scene")
+        return
+
     n_files = len(ply_file_names)
     matching_results = {}
-    for s in range(n_files):
-        for t in range(s + 1, n_files):
-            matching_results[s * n_files + t] = matching_result(s, t)
+    for (s, t) in select_candidate_pairs(feature_files, config, message_queue):
+        matching_results[s * n_files + t] = matching_result(s, t)
+
+    # Pairs whose fragments and configuration are unchanged reuse the
+    # checkpointed result.
+    manifest = CheckpointManifest(config)
+    units = {}
+    pending = []
+    for r in matching_results:
+        (s, t) = (matching_results[r].s, matching_results[r].t)
+        units[r] = pair_unit(ply_file_names, s, t, config)
+        if manifest.is_done(*units[r]):
+            (matching_results[r].success, matching_results[r].transformation,
+             matching_results[r].information) = load_pair_result(units[r], config)
+        else:
+            pending.append(r)
+    if len(pending) < len(matching_results):
+        message_queue.put(
+            "checkpoint: %d of %d fragment pairs are up to date, registering %d"
+            % (len(matching_results) - len(pending), len(matching_results), len(pending)))
+
+    def store(s, t, result):
+        r = s * n_files + t
+        (matching_results[r].success, matching_results[r].transformation,
+         matching_results[r].information) = result
+        # A pair cut short by the stop event is not a valid result.
+        if not stop_event.is_set():
+            save_pair_result(manifest, units[r], result, config)
 
-    if config["python_multi_threading"] is True:
+    args = [(feature_files, matching_results[r].s, matching_results[r].t,
+             config, stop_event, message_queue) for r in pending]
+    if config["python_multi_threading"] is True and len(args) > 1:
         os.environ['OMP_NUM_THREADS'] = '1'
         max_workers = max(
-            1, min(multiprocessing.cpu_count() - 1, len(matching_results)))
+            1, min(multiprocessing.cpu_count() - 1, len(args)))
         mp_context = multiprocessing.get_context('spawn')
         with mp_context.Pool(processes=max_workers) as pool:
-            args = [(ply_file_names, v.s, v.t, config, stop_event, message_queue)
-                    for k, v in matching_results.items()]
-            results = pool.starmap(register_point_cloud_pair, args)
-
-        for i, r in enumerate(matching_results):
-            matching_results[r].success = results[i][0]
-            matching_results[r].transformation = results[i][1]
-            matching_results[r].information = results[i][2]
+            for (s, t, result) in pool.imap_unordered(register_pair_job, args):
+                store(s, t, result)
     else:
-        for r in matching_results:
+        for arg in args:
             if stop_event.is_set():
                 message_queue.put("Stopping posegraph creation for scene")
                 break
-            (matching_results[r].success, matching_results[r].transformation,
-             matching_results[r].information) = \
-                register_point_cloud_pair(ply_file_names,
-                                          matching_results[r].s, matching_results[r].t, config, stop_event, message_queue)
+            store(*register_pair_job(arg))
 
     for r in matching_results:
         if matching_results[r].success:
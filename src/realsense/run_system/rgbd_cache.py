@@ -0,0 +1,222 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from open3d_example import read_rgbd_image
+
+class RGBDImageCache:
+    def __init__(self, color_files, depth_files, config, convert_rgb_to_intensity=True):
+        """
+        初始化 RGBDImageCache。
+
+        工作者內有界的 LRU 快取，保存已解碼的 RGBDImage。相鄰的里程計配對會讀取同一幀兩次，
+        關鍵幀迴環配對也會反覆讀取相同的關鍵幀，快取後每幀只需解碼一次。
+        快取的總大小不超過 config["rgbd_cache_mb"]（以圖像數據的位元組計算），為 0 時停用快取。
+        config["rgbd_prefetch_frames"] 大於 0 且呼叫 prefetch() 時，預取線程依存取順序提前解碼接下來的幀。
+
+        參數:
+        color_files (list): 顏色圖像文件列表。
+        depth_files (list): 深度圖像文件列表。
+        config (dict): 重建系統的配置。
+        convert_rgb_to_intensity (bool, optional): 是否將顏色轉為灰階。預設為 True。
+        """
+        self.color_files = color_files
+        self.depth_files = depth_files
+        self.config = config
+        self.convert_rgb_to_intensity = convert_rgb_to_intensity
+        self.capacity = int(config.get("rgbd_cache_mb", 256) * 1024 * 1024)
+        self.prefetch_frames = config.get("rgbd_prefetch_frames", 4) if self.capacity > 0 else 0
+        self.images = OrderedDict()
+        self.size = 0
+        # 正在解碼的幀 -> threading.Event，避免兩個線程解碼同一幀
+        self.loading = {}
+        self.condition = threading.Condition()
+        self.order = []
+        self.position = 0
+        self.thread = None
+        self.running = False
+        self.requests = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.decode_time = 0.0
+        self.wait_time = 0.0
+        self.miss_time = 0.0
+
+    def decode(self, index):
+        """
+        解碼一幀並記錄耗時。
+
+        回傳:
+        tuple: (RGBDImage, 解碼耗時秒數)，以線程 CPU 時間計算，預取線程與存取線程爭用 GIL 時不會誇大耗時。
+        """
+        start = time.thread_time()
+        rgbd_image = read_rgbd_image(self.color_files[index], self.depth_files[index], self.convert_rgb_to_intensity, self.config)
+        return rgbd_image, time.thread_time() - start
+
+    def insert(self, index, rgbd_image, elapsed):
+        """
+        將已解碼的幀加入快取，超出記憶體預算時移除最久未使用的幀（在持有 condition 時調用）。
+        """
+        self.decode_time += elapsed
+        nbytes = np.asarray(rgbd_image.color).nbytes + np.asarray(rgbd_image.depth).nbytes
+        if nbytes > self.capacity:
+            return
+        self.images[index] = (rgbd_image, nbytes)
+        self.size += nbytes
+        while self.size > self.capacity:
+            _, (_, evicted) = self.images.popitem(last=False)
+            self.size -= evicted
+
+    def get(self, index):
+        """
+        取得一幀的 RGBDImage，快取中沒有時解碼（預取線程正在解碼時等待其完成）。
+
+        參數:
+        index (int): 幀索引。
+
+        回傳:
+        open3d.geometry.RGBDImage: 已解碼的圖像，呼叫者不應修改。
+        """
+        with self.condition:
+            self.requests += 1
+            self.position += 1
+            self.condition.notify_all()
+            if index in self.images:
+                self.hits += 1
+                self.images.move_to_end(index)
+                return self.images[index][0]
+            event = self.loading.get(index)
+            if event is None:
+                self.loading[index] = threading.Event()
+        if event is not None:
+            start = time.perf_counter()
+            event.wait()
+            with self.condition:
+                self.wait_time += time.perf_counter() - start
+                if index in self.images:
+                    self.hits += 1
+                    self.images.move_to_end(index)
+                    return self.images[index][0]
+        rgbd_image, elapsed = self.decode(index)
+        with self.condition:
+            self.misses += 1
+            self.miss_time += elapsed
+            if self.capacity > 0:
+                self.insert(index, rgbd_image, elapsed)
+            else:
+                self.decode_time += elapsed
+            event = self.loading.pop(index, None)
+        if event is not None:
+            event.set()
+        return rgbd_image
+
+    def prefetch(self, order):
+        """
+        啟動預取線程，先停止之前仍在運行的預取線程。
+
+        參數:
+        order (list): 接下來 get() 的幀索引順序，預取線程最多領先 rgbd_prefetch_frames 次存取。
+        """
+        if self.prefetch_frames <= 0:
+            return
+        self.stop_prefetch()
+        with self.condition:
+            self.order = list(order)
+            self.position = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="rgbd-prefetch", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """
+        預取線程的主循環。
+        """
+        for ahead, index in enumerate(self.order):
+            with self.condition:
+                while self.running and ahead - self.position >= self.prefetch_frames:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                if index in self.images or index in self.loading:
+                    continue
+                self.loading[index] = threading.Event()
+            rgbd_image, elapsed = self.decode(index)
+            with self.condition:
+                self.prefetched += 1
+                self.insert(index, rgbd_image, elapsed)
+                event = self.loading.pop(index)
+            event.set()
+
+    def stop_prefetch(self):
+        """
+        停止預取線程，已解碼的幀保留在快取中，之後可再以新的存取順序呼叫 prefetch()。
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        """
+        停止預取線程並清空快取。
+        """
+        self.stop_prefetch()
+        self.images.clear()
+        self.size = 0
+
+    def get_counters(self):
+        """
+        回傳:
+        dict: 包含 'requests'、'hits'、'misses'、'prefetched'、'hit_rate'、'decode_time' 與
+            'time_saved'（與每次存取都解碼相比，存取線程節省的解碼秒數）的字典。
+        """
+        with self.condition:
+            decoded = self.misses + self.prefetched
+            mean_decode = self.decode_time / decoded if decoded else 0.0
+            return {
+                'requests': self.requests,
+                'hits': self.hits,
+                'misses': self.misses,
+                'prefetched': self.prefetched,
+                'hit_rate': self.hits / self.requests if self.requests else 0.0,
+                'decode_time': self.decode_time,
+                'time_saved': max(0.0, self.requests * mean_decode - self.miss_time - self.wait_time)
+            }
+
+    def summary(self):
+        """
+        回傳:
+        str: 命中率與節省的解碼時間摘要。
+        """
+        return format_cache_counters(self.get_counters())
+
+def merge_cache_counters(counters_list):
+    """
+    合併多個工作者的快取計數器。
+
+    參數:
+    counters_list (iterable): get_counters() 回傳的字典。
+
+    回傳:
+    dict: 與 get_counters() 相同鍵的字典，'hit_rate' 依合併後的次數重新計算。
+    """
+    merged = {'requests': 0, 'hits': 0, 'misses': 0, 'prefetched': 0, 'decode_time': 0.0, 'time_saved': 0.0}
+    for counters in counters_list:
+        for key in merged:
+            merged[key] += counters[key]
+    merged['hit_rate'] = merged['hits'] / merged['requests'] if merged['requests'] else 0.0
+    return merged
+
+def format_cache_counters(counters):
+    """
+    回傳:
+    str: 命中率與節省的解碼時間摘要。
+    """
+    return (f"RGBD cache hit rate {counters['hit_rate']:.1%} ({counters['hits']} of {counters['requests']}), "
+            f"decoded {counters['misses'] + counters['prefetched']} frames ({counters['prefetched']} prefetched) "
+            f"in {counters['decode_time']:.2f} s, saved {counters['time_saved']:.2f} s")
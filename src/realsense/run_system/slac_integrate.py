@@ -12,7 +12,7 @@ import open3d as o3d
 import open3d.core as o3c
 import os, sys
 
-from open3d_example import join, get_rgbd_file_lists
+from open3d_example import join, get_rgbd_file_lists, read_t_image
 
 def run(config, stop_event, message_queue):
     message_queue.put("slac non-rigid optimization.")
@@ -84,8 +84,8 @@ def run(config, stop_event, message_queue):
             pose = np.dot(posegraph.nodes[i].pose, node.pose)
             extrinsic_t = o3d.core.Tensor(np.linalg.inv(pose))
 
-            depth = o3d.t.io.read_image(depth_files[k]).to(device)
-            color = o3d.t.io.read_image(color_files[k]).to(device)
+            depth = read_t_image(depth_files[k]).to(device)
+            color = read_t_image(color_files[k]).to(device)
             rgbd = o3d.t.geometry.RGBDImage(color, depth)
 
             message_queue.put('Deforming and integrating Frame {:3d}'.format(k))